@@ -0,0 +1,365 @@
+"""
+Throughput and latency of /api/ask_agent with fake LLM and search services
+--------------------------------------------------------------------------
+
+* Starts the server (main.app on uvicorn) in a child process with the fakes of benchmarks/offline_fakes.py:
+  Azure OpenAI, Tavily, arXiv and the embedding model are replaced by local fakes with fixed latency and output size.
+  Everything else runs as in production: middlewares, session and CSRF, admission control, graph, SSE stream.
+* --concurrency clients each open a session, then send requests (one new chat per request) until --requests are done.
+  The first --warmup requests are not measured.
+* Prints the throughput, p50/p95/p99 latency of the whole stream and of the first token of the answer,
+  and the CPU time and RSS of the server process while the requests ran.
+* With --output, the results are written to a JSON file. With --baseline, they are compared with such a file and
+  the command fails when the throughput, a p95 or the CPU time per request is worse by more than --max-regression,
+  so that it can catch performance regressions in CI.
+
+The server settings come from the environment as usual (e.g. MAX_CONCURRENT_RUNS, SSE_FLUSH_INTERVAL).
+Needs no network access or API key (the server listens on 127.0.0.1).
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_ask_agent_offline [--requests 40] [--concurrency 4] [--llm-latency 0.2] [--output result.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.offline_fakes import FakeSettings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REQUESTS = [
+    "Tell me about Fic-NextFood and the plant-based protein market.",
+    "What are the latest papers on fermentation of plant protein?",
+    "Fic-NextFoodの主な製品と市場動向を調べてください。",
+]
+# Metrics compared with the baseline: True if a higher value is better
+COMPARED = {
+    "throughput": True,
+    "latency_p95": False,
+    "ttft_p95": False,
+    "cpu_seconds_per_request": False,
+}
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def get_rss_mb() -> float | None:
+    """Current RSS of this process (Linux only)."""
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def get_usage() -> dict:
+    """CPU time and memory of this process."""
+    if resource is None:
+        return {"cpu_seconds": None, "max_rss_mb": None, "rss_mb": get_rss_mb()}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    max_rss = usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    return {
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": max_rss,
+        "rss_mb": get_rss_mb(),
+    }
+
+
+def add_fake_args(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeSettings()
+    parser.add_argument("--llm-latency", type=float, default=defaults.llm_latency)
+    parser.add_argument("--token-interval", type=float, default=defaults.token_interval)
+    parser.add_argument("--answer-words", type=int, default=defaults.answer_words)
+    parser.add_argument("--plan-steps", type=int, default=defaults.plan_steps)
+    parser.add_argument("--replan", action="store_true")
+    parser.add_argument("--search-latency", type=float, default=defaults.search_latency)
+    parser.add_argument("--search-results", type=int, default=defaults.search_results)
+    parser.add_argument("--search-chars", type=int, default=defaults.search_chars)
+
+
+FAKE_ARGS = [
+    "llm_latency",
+    "token_interval",
+    "answer_words",
+    "plan_steps",
+    "search_latency",
+    "search_results",
+    "search_chars",
+]
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Run the server with the fakes (child process)."""
+    from benchmarks import offline_fakes
+
+    offline_fakes.install(
+        FakeSettings(
+            replan=args.replan, **{name: getattr(args, name) for name in FAKE_ARGS}
+        )
+    )
+    import uvicorn
+
+    from main import app
+
+    # Before the catch-all route of the Vue Router
+    app.add_api_route("/bench/usage", get_usage, methods=["GET"])
+    app.router.routes.insert(0, app.router.routes.pop())
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_server(args: argparse.Namespace) -> tuple:
+    """Start the server in a child process and return (process, base url)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, "-m", "benchmarks.bench_ask_agent_offline", "--serve"]
+    command += ["--port", str(port)]
+    for name in FAKE_ARGS:
+        command += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    if args.replan:
+        command.append("--replan")
+    process = subprocess.Popen(command)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client, process, timeout: float = 300) -> None:
+    import httpx
+
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup.")
+        try:
+            await client.get("/bench/usage")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.5)
+    raise RuntimeError("The server did not start.")
+
+
+def parse_frames(buffer: str) -> tuple:
+    """Split the complete frames (legacy or SSE framing) from the rest of the buffer."""
+    *frames, rest = buffer.split("\n\n")
+    events = []
+    for frame in frames:
+        data = "\n".join(
+            line[len("data: ") :] if line.startswith("data: ") else line
+            for line in frame.split("\n")
+            if not line.startswith("id: ")
+        )
+        if data.strip():
+            events.append(json.loads(data))
+    return events, rest
+
+
+class Session:
+    """A client with its own session cookie and CSRF token."""
+
+    def __init__(self, client):
+        self.client = client
+        self.headers = {}
+
+    async def open(self) -> None:
+        response = await self.client.post("/api/get_csrf")
+        response.raise_for_status()
+        # The session cookie is "Secure", so it is sent explicitly over http://127.0.0.1
+        self.headers = {
+            "Cookie": f"session={response.cookies['session']}",
+            "X-CSRF-Token": response.json()["csrf_token"],
+        }
+
+    async def ask(self, user_request: str) -> dict:
+        """Send one request and measure its stream."""
+        response = await self.client.post("/api/get_chat_id", headers=self.headers)
+        response.raise_for_status()
+        body = {
+            "chat_id": response.json()["chat_id"],
+            "user_request": user_request,
+            "answer": "",
+        }
+        start = time.perf_counter()
+        ttft = None
+        final = False
+        buffer = ""
+        async with self.client.stream(
+            "POST", "/api/ask_agent", json=body, headers=self.headers
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return {"error": f"HTTP {response.status_code}"}
+            async for text in response.aiter_text():
+                buffer += text
+                events, buffer = parse_frames(buffer)
+                for event in events:
+                    if event.get("type") == "msg" and ttft is None:
+                        ttft = time.perf_counter() - start
+                    elif event.get("type") == "final_msg":
+                        final = True
+                    elif event.get("type") == "error":
+                        return {"error": event.get("content")}
+        if not final:
+            return {"error": "The stream ended without a final answer."}
+        return {"latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def run_load(base_url: str, process, args: argparse.Namespace) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=args.timeout, limits=limits
+    ) as client:
+        await wait_ready(client, process)
+        sessions = [Session(client) for _ in range(args.concurrency)]
+        for session in sessions:
+            await session.open()
+        for i in range(args.warmup):
+            await sessions[0].ask(REQUESTS[i % len(REQUESTS)])
+
+        counter = iter(range(args.requests))
+        results = []
+
+        async def worker(session: Session):
+            for i in counter:
+                results.append(await session.ask(REQUESTS[i % len(REQUESTS)]))
+
+        before = (await client.get("/bench/usage")).json()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for session in sessions))
+        wall = time.perf_counter() - start
+        after = (await client.get("/bench/usage")).json()
+    return summarize(results, wall, before, after, args)
+
+
+def summarize(results: list, wall: float, before: dict, after: dict, args) -> dict:
+    done = [result for result in results if "latency" in result]
+    latencies = [result["latency"] for result in done]
+    ttfts = [result["ttft"] for result in done if result["ttft"] is not None]
+    errors = [result["error"] for result in results if "error" in result]
+    summary = {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "throughput": len(done) / wall,
+    }
+    for name, values in (("latency", latencies), ("ttft", ttfts)):
+        for pct in (50, 95, 99):
+            summary[f"{name}_p{pct}"] = (
+                percentile(values, pct / 100) if values else None
+            )
+    cpu_seconds = None
+    if after["cpu_seconds"] is not None:
+        cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+    summary["cpu_seconds"] = cpu_seconds
+    summary["cpu_utilization"] = cpu_seconds / wall if cpu_seconds is not None else None
+    summary["cpu_seconds_per_request"] = (
+        cpu_seconds / len(done) if cpu_seconds is not None and done else None
+    )
+    summary["rss_mb"] = after["rss_mb"]
+    summary["max_rss_mb"] = after["max_rss_mb"]
+    summary["first_errors"] = errors[:3]
+    return summary
+
+
+def fmt(value, unit: str = "", digits: int = 3) -> str:
+    return "n/a" if value is None else f"{value:.{digits}f}{unit}"
+
+
+def print_summary(summary: dict) -> None:
+    print(
+        f"requests: {summary['requests']}  concurrency: {summary['concurrency']}  errors: {summary['errors']}"
+    )
+    print(
+        f"throughput: {fmt(summary['throughput'], ' req/s', 2)}  wall: {fmt(summary['wall_seconds'], 's', 1)}"
+    )
+    for name, label in (("latency", "latency"), ("ttft", "first token")):
+        print(
+            f"{label:12s} p50 {fmt(summary[name + '_p50'], 's')}  p95 {fmt(summary[name + '_p95'], 's')}  p99 {fmt(summary[name + '_p99'], 's')}"
+        )
+    utilization, per_request = (
+        summary["cpu_utilization"],
+        summary["cpu_seconds_per_request"],
+    )
+    print(
+        f"server CPU: {fmt(summary['cpu_seconds'], 's', 2)}"
+        f" ({fmt(utilization and utilization * 100, '% of a core', 1)},"
+        f" {fmt(per_request and per_request * 1000, ' ms/request', 1)})"
+    )
+    print(
+        f"server RSS: {fmt(summary['rss_mb'], ' MB', 1)}  peak: {fmt(summary['max_rss_mb'], ' MB', 1)}"
+    )
+    for error in summary["first_errors"]:
+        print(f"error: {error}")
+
+
+def compare(summary: dict, baseline: dict, max_regression: float) -> list:
+    """Metrics worse than the baseline by more than max_regression."""
+    regressions = []
+    for name, higher_is_better in COMPARED.items():
+        value, base = summary.get(name), baseline.get(name)
+        if value is None or not base:
+            continue
+        change = (value - base) / base
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(f"{name}: {base:.4f} -> {value:.4f} ({change:+.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    add_fake_args(parser)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    process, base_url = start_server(args)
+    try:
+        summary = asyncio.run(run_load(base_url, process, args))
+    finally:
+        process.terminate()
+        process.wait()
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+    failed = summary["errors"] > 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(summary, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
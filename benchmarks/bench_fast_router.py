@@ -0,0 +1,145 @@
+"""
+Benchmark of FastRouter against the LLM router
+----------------------------------------------
+
+* Reads user requests labeled with the decision of the LLM router (check_request) from a JSONL file:
+  {"request": "...", "agent_name": "answer_llm" | "auto_research" | "ask_human"}
+  With --label-with-llm, the requests are labeled by calling the LLM router (Azure OpenAI settings of .env are required)
+  and its latency is measured as well.
+  Without a file, a small built-in set of requests labeled by hand is used.
+* For several confidence thresholds, prints the share of requests routed locally (coverage)
+  and the agreement with the LLM router on those requests (accuracy).
+* Prints the latency of the fast router (and of the LLM router with --label-with-llm).
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_fast_router [--data requests.jsonl] [--label-with-llm]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from src.routers.agentic_rag.fast_router import FastRouter
+
+# Requests that are not in router_examples.yaml, labeled by hand
+BUILTIN_DATA = [
+    {"request": "Good morning!", "agent_name": "answer_llm"},
+    {"request": "What is a vector database?", "agent_name": "answer_llm"},
+    {"request": "Explain what an API is in simple words.", "agent_name": "answer_llm"},
+    {"request": "おはようございます", "agent_name": "answer_llm"},
+    {"request": "ベクトルデータベースとは何ですか？", "agent_name": "answer_llm"},
+    {
+        "request": "Where are the laboratories of Fic-NextFood?",
+        "agent_name": "auto_research",
+    },
+    {
+        "request": "What products does Fic-TechFrontier sell?",
+        "agent_name": "auto_research",
+    },
+    {
+        "request": "Latest research papers on quantum error correction",
+        "agent_name": "auto_research",
+    },
+    {
+        "request": "Fic-GreenLifeの従業員数を教えてください。",
+        "agent_name": "auto_research",
+    },
+    {"request": "最新の半導体市場の動向を調べて", "agent_name": "auto_research"},
+    {"request": "hmm", "agent_name": "ask_human"},
+    {"request": "qwerty", "agent_name": "ask_human"},
+    {"request": "これ", "agent_name": "ask_human"},
+]
+THRESHOLDS = [0.5, 0.7, 0.8, 0.9, 0.95]
+
+
+def load_data(path: str | None) -> list:
+    if path is None:
+        return list(BUILTIN_DATA)
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def label_with_llm(data: list) -> list:
+    """Replace the labels by the decisions of the LLM router and record its latency."""
+    from src.routers.agentic_rag.router_agent import RouterAgent
+
+    router = RouterAgent()
+    labeled = []
+    for item in data:
+        start = time.perf_counter()
+        router_json = asyncio.run(
+            router._check_request_llm(item["request"], [], config={})
+        )
+        elapsed = time.perf_counter() - start
+        labeled.append(
+            {
+                "request": item["request"],
+                "agent_name": router_json["agent_name"],
+                "llm_seconds": elapsed,
+            }
+        )
+    return labeled
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="JSONL file of requests labeled by the LLM")
+    parser.add_argument("--label-with-llm", action="store_true")
+    args = parser.parse_args()
+
+    data = load_data(args.data)
+    if args.label_with_llm:
+        data = label_with_llm(data)
+
+    router = FastRouter()
+    # Load the embedding model and the centroids before measuring
+    router.classify("warm up")
+    results = []
+    for item in data:
+        start = time.perf_counter()
+        agent_name, confidence = router.classify(item["request"])
+        elapsed = time.perf_counter() - start
+        results.append((item, agent_name, confidence, elapsed))
+
+    print(f"requests: {len(results)}")
+    print(f"{'threshold':>10}{'coverage':>10}{'accuracy':>10}")
+    for threshold in THRESHOLDS:
+        covered = [r for r in results if r[2] >= threshold]
+        correct = sum(
+            1 for item, agent_name, _, _ in covered if agent_name == item["agent_name"]
+        )
+        coverage = len(covered) / len(results)
+        accuracy = correct / len(covered) if covered else float("nan")
+        print(f"{threshold:>10.2f}{coverage:>10.1%}{accuracy:>10.1%}")
+
+    print("\nMisrouted requests (any confidence):")
+    for item, agent_name, confidence, _ in results:
+        if agent_name != item["agent_name"]:
+            print(
+                f"  {item['request'][:50]!r}: {agent_name} ({confidence:.2f}), LLM: {item['agent_name']}"
+            )
+
+    fast_ms = [r[3] * 1000 for r in results]
+    print(
+        f"\nfast router latency(ms): median {statistics.median(fast_ms):.1f}, "
+        f"p95 {percentile(fast_ms, 0.95):.1f}"
+    )
+    llm_ms = [item["llm_seconds"] * 1000 for item in data if "llm_seconds" in item]
+    if llm_ms:
+        print(
+            f"LLM router latency(ms): median {statistics.median(llm_ms):.1f}, "
+            f"p95 {percentile(llm_ms, 0.95):.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Tail latency of search requests with and without hedging
+--------------------------------------------------------
+
+* Starts a local HTTP server standing in for a search service. Most responses take 20-60 ms,
+  and a share of them (--slow-rate) takes --slow-seconds, like the long tail of Tavily and arXiv.
+* Sends the same sequence of requests directly and through HedgePolicy (the policy of ans_tavily / ans_arxiv).
+* Prints p50, p90, p99 and max latency of each mode, and the share of duplicate requests sent (extra load).
+
+Needs no network access or API key.
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_hedged_search [--requests 300] [--slow-rate 0.03] [--slow-seconds 1.0]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.routers.agentic_rag.hedge import HedgePolicy
+
+
+def start_server(slow_rate: float, slow_seconds: float, seed: int):
+    """Start the fake search service and return (server, url)."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                slow = rng.random() < slow_rate
+                latency = slow_seconds if slow else rng.uniform(0.02, 0.06)
+            time.sleep(latency)
+            body = b'{"results": []}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/search"
+
+
+def search(url: str) -> bytes:
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def run(policy: HedgePolicy, url: str, requests: int) -> list:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        policy.call("search", search, url)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-seconds", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"requests: {args.requests}, slow responses: {args.slow_rate:.0%} "
+        f"({args.slow_seconds:.1f}s)"
+    )
+    print(
+        f"{'mode':<10}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'extra':>8}"
+    )
+    for mode, enabled in (("direct", False), ("hedged", True)):
+        # Same seed for both modes (a duplicate request draws its own latency)
+        server, url = start_server(args.slow_rate, args.slow_seconds, args.seed)
+        policy = HedgePolicy(enabled=enabled)
+        latencies = [seconds * 1000 for seconds in run(policy, url, args.requests)]
+        server.shutdown()
+        stats = policy.get_stats("search")
+        extra = stats["hedges"] / args.requests
+        print(
+            f"{mode:<10}{percentile(latencies, 0.5):>10.0f}{percentile(latencies, 0.9):>10.0f}"
+            f"{percentile(latencies, 0.99):>10.0f}{max(latencies):>10.0f}{extra:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Latency of the graph under several model tier profiles
+------------------------------------------------------
+
+* Runs a fixed set of questions through the graph once per profile of src/routers/utils/model_tiers.yaml.
+  Each profile runs in its own process with MODEL_TIER_PROFILE set, because the models are created once per process.
+* Prints, per profile, the median and p95 latency of the whole request and the LLM time spent in each node.
+* With --output, the answers of every profile are written to a JSONL file to compare their quality.
+
+Requires the same .env as the server (Azure OpenAI, Tavily, vector store index).
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_model_tiers [--profiles tiered,large] [--output answers.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+QUESTIONS = [
+    "Hello! What can you do?",
+    "What is a vector database?",
+    "What is Fic-NextFood's main product?",
+    "Compare the businesses of Fic-GreenLife and Fic-TechFrontier.",
+    "Latest research papers on retrieval augmented generation",
+    "Fic-GreenLifeの従業員数を教えてください。",
+]
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Sums the time of the LLM calls per graph node."""
+
+    def __init__(self):
+        self.started = {}
+        self.seconds = defaultdict(float)
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, metadata=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node", "other")
+        self.started[run_id] = (node, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self.started:
+            node, start = self.started.pop(run_id)
+            self.seconds[node] += time.perf_counter() - start
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def run_questions() -> dict:
+    """Run the questions with the profile of this process."""
+    from langchain_core.messages import HumanMessage
+
+    from src.routers.agentic_rag.auto_rag_agent import AutoRagAgent
+    from src.routers.agentic_rag.message_utils import MsgUtils
+
+    graph_app = await AutoRagAgent().create_graph()
+    msg_util = MsgUtils()
+    timer = NodeTimer()
+    results = []
+    for question in QUESTIONS:
+        input_data = {
+            "messages": [HumanMessage(content=question)],
+            "turn": 1,
+            "request": "",
+            "rev_request": "",
+            "plan": "",
+            "plan_status": [],
+            "plan_over": False,
+            "plan_exec": "",
+            "step_memo": [],
+            "stop_reason": "",
+            "cached_answer": "",
+        }
+        config = {
+            "recursion_limit": 400,
+            "configurable": {"thread_id": uuid.uuid4().hex},
+            "callbacks": [timer],
+        }
+        start = time.perf_counter()
+        output = await graph_app.ainvoke(input_data, config=config)
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "question": question,
+                "seconds": elapsed,
+                "answer": msg_util.get_latest_ai_tool_msg(output["messages"]),
+            }
+        )
+    return {"results": results, "node_seconds": dict(timer.seconds)}
+
+
+def run_profile(profile: str) -> dict:
+    """Run the questions in a new process with MODEL_TIER_PROFILE set."""
+    env = dict(os.environ, MODEL_TIER_PROFILE=profile)
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_model_tiers", "--worker"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # The graph logs to stdout, the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profiles",
+        default="tiered,large",
+        help="Comma-separated profiles of model_tiers.yaml",
+    )
+    parser.add_argument("--output", help="JSONL file of the answers of each profile")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_questions()), ensure_ascii=False))
+        return
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    outputs = {profile: run_profile(profile) for profile in profiles}
+
+    print(f"questions: {len(QUESTIONS)}")
+    print(f"{'profile':<12}{'median(s)':>10}{'p95(s)':>10}{'total(s)':>10}")
+    for profile, output in outputs.items():
+        seconds = [r["seconds"] for r in output["results"]]
+        print(
+            f"{profile:<12}{statistics.median(seconds):>10.2f}"
+            f"{percentile(seconds, 0.95):>10.2f}{sum(seconds):>10.2f}"
+        )
+
+    nodes = sorted({n for output in outputs.values() for n in output["node_seconds"]})
+    print("\nLLM time per node(s):")
+    print(f"{'node':<22}" + "".join(f"{profile:>12}" for profile in profiles))
+    for node in nodes:
+        print(
+            f"{node:<22}"
+            + "".join(
+                f"{outputs[profile]['node_seconds'].get(node, 0.0):>12.2f}"
+                for profile in profiles
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            for profile, output in outputs.items():
+                for result in output["results"]:
+                    file.write(
+                        json.dumps({"profile": profile, **result}, ensure_ascii=False)
+                        + "\n"
+                    )
+
+
+if __name__ == "__main__":
+    main()
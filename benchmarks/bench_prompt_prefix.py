@@ -0,0 +1,86 @@
+"""
+Static prefix of the prompts of each node
+-----------------------------------------
+
+* Renders every prompt of PromptManager with representative request values.
+* Prints, per node, the number of tokens of the static prefix (system message) that stays identical between requests,
+  the total number of tokens, and the share of the static prefix.
+* Also prints the stable prefix of the previous layout (raw template up to its first request-dependent variable).
+* Providers only cache prefixes from 1024 tokens (Azure OpenAI / OpenAI prompt caching), shown in the last column.
+
+Requires tiktoken and the same .env as the server (the tool information is imported from auto_research).
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_prompt_prefix
+"""
+
+from __future__ import annotations
+
+from string import Formatter
+
+import tiktoken
+
+from src.routers.agentic_rag.auto_research import max_plan, tool_info, vector_db_info
+from src.routers.utils.prompt_manager import STATIC_VARIABLES, PromptManager
+
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+SEARCH_RESULT = (
+    "## Title: Fic-NextFood Annual Report\n"
+    "### URL:https://example.com/report\n### Content:\n"
+    + "Fic-NextFood develops plant-based protein products and operates research institutes. "
+    * 20
+    + "\n\n"
+)
+SAMPLE_VALUES = {
+    "tool_info": tool_info,
+    "vector_db_info": vector_db_info,
+    "max_plan": max_plan,
+    "request": "What is Fic-NextFood's main product and how does it compare with its competitors?",
+    "rev_request": "What is Fic-NextFood's main product and how does it compare with its competitors?",
+    "question": "Tell me about the main product of Fic-NextFood.",
+    "plan": '{"type": "plan", "plan": ["Tell me about the main product of Fic-NextFood.", "Tell me about competitors of Fic-NextFood."], "plan_status": ["done", "done"]}',
+    "remaining_plans": "- Tell me about competitors of Fic-NextFood.",
+    "msg_history": "Human: Hello\nAI: Hello! How can I help you?\n" * 5,
+    "res_history": SEARCH_RESULT * 5,
+    "date_time": "2025-03-26 15:30:00",
+}
+
+
+def previous_prefix(template: str) -> str:
+    """Raw template rendered up to its first request-dependent variable (layout before the split)."""
+    prefix = ""
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        prefix += literal.replace("{", "{{").replace("}", "}}")
+        if field is None:
+            continue
+        if field not in STATIC_VARIABLES:
+            break
+        prefix += "{" + field + "}"
+    return prefix.format(**SAMPLE_VALUES)
+
+
+def main() -> None:
+    encoding = tiktoken.encoding_for_model("gpt-4o")
+    prompt_mgr = PromptManager()
+
+    def count(text: str) -> int:
+        return len(encoding.encode(text))
+
+    print(
+        f"{'node':<22}{'before':>8}{'static':>8}{'total':>8}{'share':>8}{'cached':>8}"
+    )
+    for name, chat_prompt in prompt_mgr.chat_prompts.items():
+        values = {k: SAMPLE_VALUES[k] for k in chat_prompt.input_variables}
+        messages = chat_prompt.format_messages(**values)
+        static = sum(count(m.content) for m in messages if m.type == "system")
+        total = sum(count(m.content) for m in messages)
+        before = count(previous_prefix(prompt_mgr.get_prompt(name)))
+        cached = "yes" if static >= MIN_CACHED_PREFIX_TOKENS else "no"
+        print(
+            f"{name:<22}{before:>8}{static:>8}{total:>8}{static / total:>8.1%}{cached:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of SearchAnswerEngine.repair_enc_univ
+-----------------------------------------------
+
+* Builds a corpus of clean (ASCII, Japanese, accented Latin) and garbled (UTF-8 / Shift_JIS read as latin1) samples.
+* Checks that the current implementation returns exactly the same text as the previous one.
+* Prints the time per call of both implementations for each kind of sample.
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_repair_enc
+"""
+
+from __future__ import annotations
+
+import timeit
+
+from src.routers.agentic_rag.search_answer import SearchAnswerEngine
+
+EN_TEXT = (
+    "Fic-NextFood develops plant-based protein products and operates research "
+    "institutes in Japan, Singapore and the Netherlands. "
+) * 40
+JA_TEXT = (
+    "Fic-NextFoodは植物由来のタンパク質製品を開発し、日本・シンガポール・オランダに研究所を持っています。"
+) * 40
+LATIN_TEXT = (
+    "Café, naïve façade, São Paulo and Zürich are mentioned in the résumé. " * 40
+)
+
+
+def _garble(text: str, encoding: str) -> str:
+    """Reproduce typical mojibake: bytes in `encoding` decoded as latin1."""
+    return text.encode(encoding).decode("latin1")
+
+
+CORPUS = {
+    "clean_ascii": EN_TEXT,
+    "clean_japanese": JA_TEXT,
+    "clean_latin1": LATIN_TEXT,
+    "garbled_utf8": _garble(JA_TEXT, "utf-8"),
+    "garbled_sjis": _garble(JA_TEXT, "shift_jis"),
+}
+
+
+def repair_enc_univ_reference(text) -> str:
+    """Previous implementation of repair_enc_univ, kept as the reference for the results and timings."""
+    candidates = []
+    original = text
+    intermediate_encodings = ["latin1", "iso-8859-1"]
+    target_encodings = ["utf-8", "shift_jis", "euc-jp", "cp932"]
+    for inter_enc in intermediate_encodings:
+        try:
+            byte_data = text.encode(inter_enc, errors="replace")
+            for target_enc in target_encodings:
+                try:
+                    candidates.append(byte_data.decode(target_enc, errors="replace"))
+                except Exception:
+                    continue
+            for target_enc in target_encodings:
+                try:
+                    intermediate = byte_data.decode(target_enc, errors="replace")
+                    for second_enc in target_encodings:
+                        try:
+                            re_encoded = intermediate.encode(
+                                second_enc, errors="replace"
+                            )
+                            candidates.append(
+                                re_encoded.decode("utf-8", errors="replace")
+                            )
+                        except Exception:
+                            continue
+                except Exception:
+                    continue
+        except Exception:
+            continue
+    best_score = -1
+    best_text = original
+    for candidate in candidates:
+        replacement_chars = candidate.count("�") + candidate.count("?")
+        jp_chars = sum(1 for c in candidate if ord(c) > 0x3000 and ord(c) < 0x30FF)
+        score = jp_chars * 2 - replacement_chars * 3
+        if score > best_score:
+            best_score = score
+            best_text = candidate
+    if best_score <= 0:
+        return original
+    return best_text
+
+
+def main(number: int = 20) -> None:
+    sa_ins = SearchAnswerEngine()
+    print(
+        f"{'sample':<16}{'chars':>8}{'before(ms)':>12}{'after(ms)':>12}{'speedup':>10}"
+    )
+    for name, text in CORPUS.items():
+        if sa_ins.repair_enc_univ(text) != repair_enc_univ_reference(text):
+            raise AssertionError(f"Result mismatch for sample '{name}'")
+        before = timeit.timeit(lambda: repair_enc_univ_reference(text), number=number)
+        after = timeit.timeit(lambda: sa_ins.repair_enc_univ(text), number=number)
+        before_ms = before / number * 1000
+        after_ms = after / number * 1000
+        print(
+            f"{name:<16}{len(text):>8}{before_ms:>12.3f}{after_ms:>12.3f}"
+            f"{before_ms / after_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of streaming an answer with and without coalescing of the tokens
+---------------------------------------------------------------------
+
+* Streams a synthetic answer token by token, with tokens arriving at --token-rate per second (simulated clock).
+* per-token: one JSON-encoded event per token (previous behavior of exec_graph_stream).
+* coalesced: SseEncoder with SSE framing, the flush interval and byte threshold of .env (SSE_FLUSH_INTERVAL, SSE_FLUSH_BYTES).
+* Prints, per answer, the CPU time of the encoding, the number of events and the bytes sent.
+  StreamingResponse writes every yielded event to the socket separately, so the number of events is the number of send syscalls.
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_sse_encoder [--tokens 2000] [--token-rate 60] [--repeat 200]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+
+from src.routers.utils.sse_encoder import SseEncoder
+
+WORDS = "the research results show that Fic-NextFood develops plant-based protein products in three countries".split()
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_tokens(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [" " + rng.choice(WORDS) for _ in range(count)]
+
+
+def per_token(tokens: list, token_rate: float) -> list:
+    frames = []
+    for token in tokens:
+        frames.append(f"{json.dumps({'type': 'msg', 'content': token})}\n\n")
+    frames.append(
+        f"{json.dumps({'type': 'final_msg', 'content': ''.join(tokens)})}\n\n"
+    )
+    return frames
+
+
+def coalesced(tokens: list, token_rate: float) -> list:
+    clock = SimulatedClock()
+    encoder = SseEncoder(framing="sse", clock=clock)
+    frames = []
+    for token in tokens:
+        clock.now += 1 / token_rate
+        frame = encoder.add_token(token)
+        if frame:
+            frames.append(frame)
+    frames.append(encoder.add_event({"type": "final_msg", "content": "".join(tokens)}))
+    return frames
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--token-rate", type=float, default=60)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.tokens, seed=0)
+    print(f"tokens per answer: {args.tokens}, token rate: {args.token_rate:.0f}/s")
+    print(f"{'mode':<12}{'CPU(ms)':>10}{'events':>10}{'bytes':>10}")
+    for name, encode in (("per-token", per_token), ("coalesced", coalesced)):
+        start = time.process_time()
+        for _ in range(args.repeat):
+            frames = encode(tokens, args.token_rate)
+        cpu_ms = (time.process_time() - start) * 1000 / args.repeat
+        size = sum(len(frame.encode("utf-8")) for frame in frames)
+        print(f"{name:<12}{cpu_ms:>10.2f}{len(frames):>10}{size:>10}")
+
+
+if __name__ == "__main__":
+    main()
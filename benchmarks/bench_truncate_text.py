@@ -0,0 +1,78 @@
+"""
+Benchmark of SearchAnswerEngine.truncate_text
+---------------------------------------------
+
+* Truncates English, Japanese and mixed pages to MAX_SEARCH_TXT width units.
+* Checks that the current implementation returns exactly the same text as the previous one.
+* Prints the time per call of both implementations for each kind of page.
+
+Run from the root directory of the repository:
+  python -m benchmarks.bench_truncate_text
+"""
+
+from __future__ import annotations
+
+import os
+import timeit
+import unicodedata
+
+from src.routers.agentic_rag.search_answer import SearchAnswerEngine
+
+MAX_SEARCH_TXT = int(os.environ.get("MAX_SEARCH_TXT", 10000))
+
+PAGES = {
+    "english": (
+        "Fic-TechFrontier announced a new research institute for edge AI devices. "
+    )
+    * 400,
+    "japanese": (
+        "Fic-TechFrontierはエッジAIデバイスの新しい研究所の設立を発表しました。"
+    )
+    * 400,
+    "mixed": (
+        "Fic-GreenLife (フィック・グリーンライフ) reported revenue of ¥12.3 billion, "
+        "up 8% year over year. 売上高は前年比8%増加しました。 "
+    )
+    * 200,
+}
+
+
+def truncate_text_reference(text: str, max_length: int = 10000) -> str:
+    """Previous implementation of truncate_text, kept as the reference for the results and timings."""
+    current_length = 0
+    result = []
+    for char in text:
+        current_length += 2 if unicodedata.east_asian_width(char) in "FWA" else 1
+        if current_length > max_length:
+            break
+        result.append(char)
+    return "".join(result)
+
+
+def main(number: int = 20) -> None:
+    sa_ins = SearchAnswerEngine()
+    print(f"{'page':<10}{'chars':>8}{'before(ms)':>12}{'after(ms)':>12}{'speedup':>10}")
+    for name, text in PAGES.items():
+        for max_length in (0, 1, 2, 3, 100, 101, MAX_SEARCH_TXT):
+            if sa_ins.truncate_text(text, max_length) != truncate_text_reference(
+                text, max_length
+            ):
+                raise AssertionError(
+                    f"Result mismatch for page '{name}' ({max_length})"
+                )
+        before = timeit.timeit(
+            lambda: truncate_text_reference(text, MAX_SEARCH_TXT), number=number
+        )
+        after = timeit.timeit(
+            lambda: sa_ins.truncate_text(text, MAX_SEARCH_TXT), number=number
+        )
+        before_ms = before / number * 1000
+        after_ms = after / number * 1000
+        print(
+            f"{name:<10}{len(text):>8}{before_ms:>12.3f}{after_ms:>12.3f}"
+            f"{before_ms / after_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Deterministic local fakes of the external services of the agent
+---------------------------------------------------------------
+
+* FakeChatModel replaces AzureChatOpenAI inside get_gpt_model(), so the tiers, the rate limiter and the LLM cache
+  of the server are still used. Its answer depends only on the graph node that calls it:
+  router and judges answer in JSON, create_plan returns --plan-steps steps naming the tool of each step,
+  select_tool calls that tool, and the other nodes stream --answer-words words.
+* TavilySearchAPIRetriever and arxiv.Client return --search-results documents of --search-chars characters.
+* The embedding model is DeterministicFakeEmbedding with the dimension of the FAISS index, so search_rag
+  searches the real index.
+* Every fake waits a fixed latency (no jitter), so two runs with the same settings do the same work.
+* tiktoken is not faked: the server loads its encodings from the cache (TIKTOKEN_CACHE_DIR) at startup and never downloads them.
+  Without them, the tokens are estimated.
+
+install() must be called before the modules of src.routers are imported (they create the models and load the index at import).
+Needs no network access or API key.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import ensure_config
+
+TOOL_NAMES = ["ans_tavily", "ans_arxiv", "search_rag", "ans_llm_base"]
+# Steps of the fake plans, cycled. Each step names its tool, which select_tool calls.
+PLAN_STEPS = [
+    "Search the web for the latest news on plant-based protein [ans_tavily]",
+    "Search the internal documents of Fic-NextFood for its products [search_rag]",
+    "Search arXiv for papers on fermentation of plant protein [ans_arxiv]",
+    "Summarize the research results [ans_llm_base]",
+]
+WORDS = "the research results show that Fic-NextFood develops plant-based protein products in three countries".split()
+
+# Environment needed to import the server without a .env file. LangSmith is disabled so that nothing is sent.
+OFFLINE_ENV = {
+    "SESSION_SECRET_KEY": "offline-benchmark",
+    "CORS_ORIGINS": '"http://127.0.0.1:8000"',
+    "TAVILY_API_KEY": "offline",
+    "TAVILY_MAX_RESULTS": "3",
+    "TAVILY_SEARCH_DEPTH": "basic",
+    "HUG_EMBE_MODEL_NAME": "offline",
+    "AZURE_OPENAI_CHATGPT_DEPLOYMENT_NAME": "fake-large",
+    "AZURE_OPENAI_SMALL_DEPLOYMENT_NAME": "fake-small",
+    "ENABLE_LOG_DEV": "False",
+}
+
+
+@dataclass
+class FakeSettings:
+    """Latency and output size of the fakes."""
+
+    # Time to the first token of an LLM call (seconds)
+    llm_latency: float = 0.2
+    # Time between two streamed tokens (seconds)
+    token_interval: float = 0.005
+    # Words of the free-text answers (final answer, ans_llm_base, ...)
+    answer_words: int = 200
+    # Steps of the plans
+    plan_steps: int = 3
+    # judge_replan asks for a new plan (up to MAX_TURN)
+    replan: bool = False
+    # Latency of a search request (seconds)
+    search_latency: float = 0.3
+    # Documents per search
+    search_results: int = 3
+    # Characters per document
+    search_chars: int = 2000
+
+
+settings = FakeSettings()
+
+
+def make_text(words: int) -> str:
+    return " ".join(WORDS[i % len(WORDS)] for i in range(words))
+
+
+def get_instructions(messages: List[BaseMessage]) -> str:
+    text = "\n".join(
+        message.content if isinstance(message.content, str) else ""
+        for message in messages
+    )
+    # The plan of select_tool comes before the notes and the tool information
+    return re.split(r"#\s*(Notes|注意)", text)[0]
+
+
+def respond(node: str, messages: List[BaseMessage], tools: list) -> AIMessage:
+    """Answer of the fake model for a node."""
+    if tools:
+        match = re.search(
+            r"\[(%s)\]" % "|".join(TOOL_NAMES), get_instructions(messages)
+        )
+        name = match.group(1) if match else "ans_llm_base"
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": name, "args": {}, "id": f"call_{name}"}],
+        )
+    if node == "check_request":
+        content = {
+            "agent_name": "auto_research",
+            "reason_sel": "The request needs research.",
+            "revised_request": "Tell me about Fic-NextFood and the plant-based protein market.",
+            "revised_reason": "The request is clear.",
+        }
+    elif node in ("create_plan", "create_revised_plan"):
+        plan = [
+            PLAN_STEPS[i % len(PLAN_STEPS)] for i in range(max(settings.plan_steps, 1))
+        ]
+        content = {"type": "plan", "plan": plan, "plan_status": ["open"] * len(plan)}
+    elif node == "judge_replan":
+        content = {
+            "is_included": "no" if settings.replan else "yes",
+            "reason": "Fake verdict.",
+        }
+    elif node == "judge_sufficiency":
+        content = {"is_sufficient": "no", "confidence": 0.5, "reason": "Fake verdict."}
+    else:
+        return AIMessage(content=make_text(settings.answer_words))
+    return AIMessage(content=json.dumps(content))
+
+
+def split_tokens(message: AIMessage) -> list:
+    """Chunks of a message as streamed by the model: one per word, or one with the tool calls."""
+    if message.tool_calls:
+        return [
+            AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {
+                        "name": tool_call["name"],
+                        "args": json.dumps(tool_call["args"]),
+                        "id": tool_call["id"],
+                        "index": index,
+                    }
+                    for index, tool_call in enumerate(message.tool_calls)
+                ],
+            )
+        ]
+    # JSON answers are streamed in pieces of 16 characters, like the tokens of a model
+    if message.content.startswith("{"):
+        return [
+            AIMessageChunk(content=message.content[i : i + 16])
+            for i in range(0, len(message.content), 16)
+        ]
+    words = message.content.split(" ")
+    return [
+        AIMessageChunk(content=word if i == 0 else " " + word)
+        for i, word in enumerate(words)
+    ]
+
+
+def get_node() -> str:
+    # The streamed calls get no run manager, so the node is read from the config of the current run
+    return ensure_config().get("metadata", {}).get("langgraph_node", "")
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering from respond() after the latency of FakeSettings."""
+
+    deployment_name: str = "fake"
+    max_tokens: Optional[int] = None
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.deployment_name
+        return params
+
+    def bind_tools(self, tools, **kwargs):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = respond(get_node(), messages, kwargs.get("tools"))
+        time.sleep(
+            settings.llm_latency + settings.token_interval * len(split_tokens(message))
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = respond(get_node(), messages, kwargs.get("tools"))
+        await asyncio.sleep(
+            settings.llm_latency + settings.token_interval * len(split_tokens(message))
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = respond(get_node(), messages, kwargs.get("tools"))
+        time.sleep(settings.llm_latency)
+        for chunk in split_tokens(message):
+            time.sleep(settings.token_interval)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = respond(get_node(), messages, kwargs.get("tools"))
+        await asyncio.sleep(settings.llm_latency)
+        for chunk in split_tokens(message):
+            await asyncio.sleep(settings.token_interval)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
+
+
+def make_chat_model(**kwargs) -> FakeChatModel:
+    """Same arguments as AzureChatOpenAI in get_gpt_model()."""
+    return FakeChatModel(
+        deployment_name=kwargs.get("deployment_name") or "fake",
+        max_tokens=kwargs.get("max_tokens"),
+    )
+
+
+def fake_tavily_documents(self, query: str, *, run_manager=None) -> list:
+    time.sleep(settings.search_latency)
+    content = (f"Result about {query}. " + make_text(50) + " ") * (
+        settings.search_chars // 300 + 1
+    )
+    return [
+        Document(
+            page_content=content[: settings.search_chars],
+            metadata={"title": f"Result {i + 1}", "source": f"https://example.com/{i}"},
+        )
+        for i in range(settings.search_results)
+    ]
+
+
+class FakeArxivResult:
+    def __init__(self, index: int, query: str):
+        self.title = f"Paper {index + 1} on {query}"
+        self.published = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        summary = (make_text(50) + " ") * (settings.search_chars // 300 + 1)
+        self.summary = summary[: settings.search_chars]
+        self.entry_id = f"http://arxiv.org/abs/0000.{index:05d}"
+
+
+class FakeArxivClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def results(self, search) -> Iterator[FakeArxivResult]:
+        time.sleep(settings.search_latency)
+        for index in range(settings.search_results):
+            yield FakeArxivResult(index, search.query)
+
+
+def get_index_dimension() -> int:
+    """Dimension of the FAISS index of RAG_INDEX_LANG."""
+    import faiss
+
+    lang = "ja" if os.environ.get("RAG_INDEX_LANG", "en").lower() == "ja" else "en"
+    index = faiss.read_index(f"src/routers/agentic_rag/index/{lang}/index.faiss")
+    return index.d
+
+
+def install(fake_settings: FakeSettings | None = None) -> FakeSettings:
+    """
+    Replace the external services by the fakes
+
+    Args:
+      fake_settings: Latency and output size of the fakes. None: defaults.
+
+    Returns:
+      FakeSettings: settings used by the fakes (can be changed between runs)
+    """
+    global settings
+    if fake_settings is not None:
+        settings = fake_settings
+    for key, value in OFFLINE_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["LANGSMITH_TRACING"] = "false"
+
+    import arxiv
+    from langchain_community.retrievers import TavilySearchAPIRetriever
+
+    import src.routers.agentic_rag.param_embedding as param_embedding
+    import src.routers.agentic_rag.param_llm as param_llm
+
+    dimension = get_index_dimension()
+    param_embedding.HuggingFaceEmbeddings = lambda **kwargs: DeterministicFakeEmbedding(
+        size=dimension
+    )
+    param_llm.AzureChatOpenAI = make_chat_model
+    TavilySearchAPIRetriever._get_relevant_documents = fake_tavily_documents
+    arxiv.Client = FakeArxivClient
+    return settings
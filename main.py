@@ -2,6 +2,7 @@
 Configures the router, sessions.
 """
 
+import asyncio
 import json
 import os
 from contextlib import asynccontextmanager
@@ -14,10 +15,15 @@ from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
+from src.routers.agent_jobs import router as agent_jobs
 from src.routers.agentic_rag.auto_rag_agent import AutoRagAgent
+from src.routers.agentic_rag.fast_router import ENABLE_FAST_ROUTER
+from src.routers.agentic_rag.router_agent import fast_router
+from src.routers.agentic_rag.usage import load_encodings
 from src.routers.ask_agent import router as ask_agent
 from src.routers.get_chat_id import router as chat_id
 from src.routers.get_csrf import router as get_csrf
+from src.routers.get_metrics import router as get_metrics
 from src.routers.get_param import router as get_param
 from src.routers.start_chat import router as start_chat
 
@@ -28,6 +34,11 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     ar = AutoRagAgent()
     app.state.graph_app = await ar.create_graph()
+    # The encodings used to count the tokens are read from the local cache, outside of the event loop
+    await asyncio.to_thread(load_encodings)
+    if ENABLE_FAST_ROUTER.lower() == "true":
+        # The examples of the fast router are embedded before the first request, outside of the event loop
+        await asyncio.to_thread(fast_router.load_centroids)
     yield
 
 
@@ -66,7 +77,7 @@ CORS_ORIGINS = json.loads(os.getenv("CORS_ORIGINS"))
 origins = [CORS_ORIGINS]
 
 # Allowed Headers
-allowed_headers = ["Content-Type", "X-CSRF-TOKEN"]
+allowed_headers = ["Content-Type", "X-CSRF-TOKEN", "Last-Event-ID"]
 
 # Adding CORS middleware
 app.add_middleware(
@@ -76,6 +87,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST"],
     allow_headers=allowed_headers,  # Specify allowed HTTP headers
+    expose_headers=["X-Run-Id"],  # Id of the run of /api/ask_agent to reconnect to
 )
 
 app.add_middleware(CspMiddleware)
@@ -85,6 +97,10 @@ app.include_router(chat_id)
 app.include_router(get_csrf)
 app.include_router(start_chat)
 app.include_router(ask_agent)
+app.include_router(agent_jobs)
+if os.getenv("ENABLE_METRICS_ENDPOINT", "False").lower() == "true":
+    # Before the catch-all route of the Vue Router
+    app.include_router(get_metrics)
 
 if os.path.exists("dist"):
     # If you mount dist/, you will get a 404 when accessing the Vue Router path. So you should not mount it.
@@ -0,0 +1,195 @@
+"""Background jobs of the agent: submit a request, then poll or stream its progress and result"""
+
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from src.schemas.app_schemas import JobRequest, JobStatus
+
+from .ask_agent import (
+    DISCONNECT_POLL_INTERVAL,
+    admission,
+    exec_graph_stream,
+    get_last_event_id,
+    run_registry,
+)
+from .utils.constants import REST_API_404_ERROR, REST_API_500_ERROR
+from .utils.csrf_utils import check_csrf
+from .utils.job_scheduler import Job, JobScheduler, QueueFullError
+from .utils.sse_encoder import SseEncoder
+
+load_dotenv()
+
+PY_FILE_NAME = "[src/routers/agent_jobs.py]: "
+router = APIRouter()
+job_scheduler = JobScheduler()
+# Time after which a client whose job was rejected may submit again (seconds)
+RETRY_AFTER = 30
+
+
+def get_job_status(job: Job) -> JobStatus:
+    """
+    Get the status of a job
+
+    Args:
+      job (Job): The job.
+
+    Returns:
+      JobStatus: Status, position in the queue, progress, result and usage of the job
+    """
+    return JobStatus(
+        job_id=job.job_id,
+        status=job.status,
+        queue_position=job_scheduler.get_position(job),
+        progress=job.progress,
+        result=job.result,
+        usage=job.usage,
+    )
+
+
+def get_job(job_id: str, req: Request) -> Job:
+    """
+    Get a job of the request after checking the session
+
+    Args:
+      job_id (str): Job ID.
+      req (Request): The current request object.
+
+    Returns:
+      Job: The job
+
+    Raises:
+      HTTPException: Returns 404 if the job is unknown or expired.
+    """
+    try:
+        check_csrf(req)
+    except Exception as err:
+        print(f"{PY_FILE_NAME}{err}")
+        raise err
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=REST_API_404_ERROR)
+    return job
+
+
+async def stream_job(job: Job, req: Request):
+    """
+    Stream the events of a job, waiting for it to start if it is queued
+
+    Args:
+      job (Job): The job.
+      req (Request): The current request object.
+
+    Yields:
+      str: Frames
+    """
+    while not job.started.is_set():
+        try:
+            await asyncio.wait_for(job.started.wait(), DISCONNECT_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            if await req.is_disconnected():
+                return
+    if job.run is None:
+        return
+    async for frame in run_registry.subscribe(
+        job.run,
+        get_last_event_id(req),
+        is_disconnected=req.is_disconnected,
+        poll_interval=DISCONNECT_POLL_INTERVAL,
+    ):
+        yield frame
+
+
+@router.post("/api/agent_jobs", status_code=202)
+async def submit_job(request: JobRequest, req: Request) -> JobStatus:
+    """
+    Submit a request to run in the background
+
+    The job runs when the scheduler has room (JOB_MAX_CONCURRENCY), higher priority first,
+    and keeps running without a connected client.
+    Like the runs of /api/ask_agent, it starts after the previous run of its chat and takes a slot of the admission control,
+    so that MAX_CONCURRENT_RUNS bounds all the runs of the process. The job is queued until then.
+
+    Args:
+      request (JobRequest): The request and its priority.
+      req (Request): The current request object.
+
+    Returns:
+      JobStatus: Status of the job. Its job_id is used to poll or stream the job.
+
+    Raises:
+      HTTPException: Returns 503 with Retry-After if the queue is full.
+    """
+    try:
+        check_csrf(req)
+    except Exception as err:
+        print(f"{PY_FILE_NAME}{err}")
+        raise err
+
+    def start(job: Job):
+        encoder = SseEncoder()
+        return run_registry.start(
+            request.chat_id,
+            request.user_request,
+            admission.admit(
+                exec_graph_stream(request, req, encoder, on_event=job.on_event),
+                on_start=job.on_run_start,
+            ),
+            lambda: encoder.event_id,
+            keep_alive=True,
+        )
+
+    try:
+        job = job_scheduler.submit(start, request.priority)
+    except QueueFullError as err:
+        logging.warning(f"Warning: [/api/agent_jobs] {err}. Job rejected.")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many jobs are waiting.",
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+    except Exception as err:
+        logging.error(f"Error: [/api/agent_jobs] {err} Internal server error.")
+        raise HTTPException(status_code=500, detail=REST_API_500_ERROR)
+    return get_job_status(job)
+
+
+@router.get("/api/agent_jobs/{job_id}")
+async def poll_job(job_id: str, req: Request) -> JobStatus:
+    """
+    Get the status, progress and result of a job
+
+    Args:
+      job_id (str): Job ID.
+      req (Request): The current request object.
+
+    Returns:
+      JobStatus: Status of the job
+    """
+    return get_job_status(get_job(job_id, req))
+
+
+@router.get("/api/agent_jobs/{job_id}/events")
+async def stream_job_events(job_id: str, req: Request):
+    """
+    Stream the events of a job, from the event after Last-Event-ID
+
+    The same events as /api/ask_agent. A queued job is streamed once it starts.
+
+    Args:
+      job_id (str): Job ID.
+      req (Request): The current request object.
+
+    Returns:
+      StreamingResponse: Stream of the events
+    """
+    job = get_job(job_id, req)
+    # Proxies must not buffer or cache the stream
+    return StreamingResponse(
+        stream_job(job, req),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
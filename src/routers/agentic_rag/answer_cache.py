@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage, ToolMessage
+
+from src.routers.agentic_rag.param_embedding import QUERY_PREFIX, get_embedding_model
+
+load_dotenv()
+
+# Answer the same (or almost the same) question from a cache of previous answers (True: enabled, False: disabled)
+ENABLE_ANSWER_CACHE = os.environ.get("ENABLE_ANSWER_CACHE", "False")
+# Cosine similarity (0-1) of the revised requests from which a cached answer is used
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+# Lifetime of a cached answer (seconds)
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 3600))
+# Maximum number of cached answers. The least recently used answer is removed first.
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 256))
+
+RAG_INDEX_LANG = os.environ.get("RAG_INDEX_LANG", "en")
+# Pieces of a cached answer streamed as messages (a word and the spaces after it)
+STREAM_PIECE = re.compile(r"\S+\s*|\s+")
+
+
+class AnswerCache:
+    """
+    AnswerCache is a singleton class that keeps the final answers of previous requests, keyed on the embedding of the revised request.
+
+    Only the first request of a conversation is cached, because the answers to later requests also depend on the conversation history.
+    Answers that used the vector store (search_rag) also record the version of the index and are not used after the index changes.
+    lookup and add run the embedding and the search in a worker thread, so the event loop is not blocked during the inference.
+    """
+
+    _instance = None  # Singleton instance storage
+
+    def __new__(cls):
+        # Create a new instance only if one does not exist.
+        if cls._instance is None:
+            cls._instance = super(AnswerCache, cls).__new__(cls)
+            cls._instance.entries = OrderedDict()
+            cls._instance.lock = threading.Lock()
+            cls._instance.embed = lru_cache(maxsize=128)(cls._instance._embed)
+        return cls._instance
+
+    def _embed(self, text: str) -> np.ndarray:
+        """
+        Embeds a revised request (normalized to unit length)
+        """
+        vector = np.array(get_embedding_model().embed_query(QUERY_PREFIX + text))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get_index_version(self) -> str:
+        """
+        Returns the version of the vector store index, computed from the size and the modification time of its files
+
+        Returns:
+          str: Version of the index
+        """
+        index_lang = "ja" if RAG_INDEX_LANG.lower() == "ja" else "en"
+        index_dir = Path("src/routers/agentic_rag/index") / index_lang
+        digest = hashlib.sha1()
+        for path in sorted(index_dir.glob("index.*")):
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def is_cacheable(self, messages: list) -> bool:
+        """
+        Checks whether the answer to the latest request can be cached or taken from the cache
+
+        Args:
+          messages (list): Messages of the state.
+
+        Returns:
+          bool: True if enabled and the latest request is the first one of the conversation.
+        """
+        if ENABLE_ANSWER_CACHE.lower() != "true":
+            return False
+        return sum(1 for msg in messages if isinstance(msg, HumanMessage)) == 1
+
+    def uses_rag(self, messages: list) -> bool:
+        """
+        Checks whether the answer to the latest request used the vector store
+
+        Args:
+          messages (list): Messages of the state.
+
+        Returns:
+          bool: True if search_rag was called after the latest HumanMessage.
+        """
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                return False
+            if isinstance(msg, ToolMessage) and msg.name == "search_rag":
+                return True
+        return False
+
+    async def lookup(self, rev_request: str, agent_name: str):
+        """
+        Finds the cached answer of the most similar request
+
+        Args:
+          rev_request (str): Revised request.
+          agent_name (str): Agent selected for the request. Answers of another agent are not used.
+
+        Returns:
+          str or None: Cached answer, None if not present
+        """
+        return await asyncio.to_thread(self._lookup, rev_request, agent_name)
+
+    def _lookup(self, rev_request: str, agent_name: str):
+        vector = self.embed(rev_request)
+        now = time.time()
+        with self.lock:
+            # Remove expired answers
+            for key in [k for k, e in self.entries.items() if e["expires"] <= now]:
+                del self.entries[key]
+            best_key = None
+            best_sim = ANSWER_CACHE_THRESHOLD
+            for key, entry in self.entries.items():
+                if entry["agent_name"] != agent_name:
+                    continue
+                sim = float(entry["vector"] @ vector)
+                if sim >= best_sim:
+                    best_key = key
+                    best_sim = sim
+            if best_key is None:
+                return None
+            entry = self.entries[best_key]
+            if entry["index_version"] is not None:
+                if entry["index_version"] != self.get_index_version():
+                    # The index has changed since the answer was created
+                    del self.entries[best_key]
+                    return None
+            self.entries.move_to_end(best_key)
+            return entry["answer"]
+
+    async def add(self, rev_request: str, agent_name: str, answer: str, uses_rag: bool):
+        """
+        Adds an answer to the cache
+
+        Args:
+          rev_request (str): Revised request.
+          agent_name (str): Agent that created the answer.
+          answer (str): Final answer.
+          uses_rag (bool): True if the answer used the vector store.
+        """
+        await asyncio.to_thread(self._add, rev_request, agent_name, answer, uses_rag)
+
+    def _add(self, rev_request: str, agent_name: str, answer: str, uses_rag: bool):
+        entry = {
+            "vector": self.embed(rev_request),
+            "agent_name": agent_name,
+            "answer": answer,
+            "index_version": self.get_index_version() if uses_rag else None,
+            "expires": time.time() + ANSWER_CACHE_TTL,
+        }
+        with self.lock:
+            self.entries[uuid.uuid4().hex] = entry
+            while len(self.entries) > ANSWER_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def split_for_stream(self, answer: str) -> list:
+        """
+        Splits a cached answer into pieces streamed like the tokens of the LLM
+
+        Args:
+          answer (str): Cached answer.
+
+        Returns:
+          list: Pieces whose concatenation is the answer.
+        """
+        return STREAM_PIECE.findall(answer)
+
+
+__all__ = ["AnswerCache"]
@@ -2,14 +2,14 @@ import datetime
 import json
 
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
 from langchain_core.messages import AIMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import InjectedState
 from typing_extensions import Annotated
 
+from src.routers.agentic_rag.answer_cache import AnswerCache
+from src.routers.agentic_rag.deadline import bind_deadline
 from src.routers.agentic_rag.message_utils import MsgUtils
 from src.routers.agentic_rag.param_llm import get_gpt_model
 from src.routers.agentic_rag.state import State
@@ -20,10 +20,10 @@ from src.routers.utils.prompt_manager import PromptManager
 log = LogDev()
 load_dotenv()
 
-model = get_gpt_model()
 msg_util = MsgUtils()
 prompt_mgr = PromptManager()
 agent_msg_mgr = AgentMsgManager()
+answer_cache = AnswerCache()
 
 
 class AnswerLlmAgent:
@@ -35,7 +35,7 @@ class AnswerLlmAgent:
     def __init__(self):
         pass
 
-    def ans_llm_solo(
+    async def ans_llm_solo(
         self, state: Annotated[State, InjectedState], config: RunnableConfig
     ) -> dict:
         """
@@ -50,11 +50,7 @@ class AnswerLlmAgent:
         log.print("- Start: ans_llm_solo")
         messages = state["messages"]
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("ans_llm_solo")
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["request", "msg_history", "date_time"],
-        )
+        prompt = prompt_mgr.get_chat_prompt("ans_llm_solo")
         msg_history = msg_util.get_pure_msg(messages)
         # Latest Question and Request from Users (Updated)
         rev_request = state["rev_request"]
@@ -67,11 +63,17 @@ class AnswerLlmAgent:
             "msg_history": msg_history,
             "date_time": date_time,
         }
+        model = bind_deadline(get_gpt_model("ans_llm_solo"), config)
         chain_llm = prompt | model | StrOutputParser()
-        answer_txt = chain_llm.invoke(input_data, config=config)
+        answer_txt = await chain_llm.ainvoke(input_data, config=config)
         answer = AIMessage(
             content=json.dumps(answer_txt, ensure_ascii=False), additional_kwargs={}
         )
+        # Keep the answer for the same question asked again
+        if answer_cache.is_cacheable(messages):
+            await answer_cache.add(
+                rev_request, "answer_llm", answer_txt, uses_rag=False
+            )
         # Show logs
         msg = agent_msg_mgr.get_msg("ans_llm_solo", content=answer_txt)
         log.print(msg + "\n")
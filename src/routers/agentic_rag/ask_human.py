@@ -1,15 +1,14 @@
 import json
 
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
 from langchain_core.messages import AIMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import InjectedState
 from langgraph.types import StreamWriter
 from typing_extensions import Annotated
 
+from src.routers.agentic_rag.deadline import bind_deadline
 from src.routers.agentic_rag.message_utils import MsgUtils
 from src.routers.agentic_rag.param_llm import get_gpt_model
 from src.routers.agentic_rag.state import State
@@ -20,7 +19,6 @@ from src.routers.utils.prompt_manager import PromptManager
 log = LogDev()
 load_dotenv()
 
-model = get_gpt_model()
 msg_util = MsgUtils()
 prompt_mgr = PromptManager()
 agent_msg_mgr = AgentMsgManager()
@@ -35,7 +33,7 @@ class AskHumanAgent:
     def __init__(self):
         pass
 
-    def ask_human(
+    async def ask_human(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
@@ -52,18 +50,16 @@ class AskHumanAgent:
         """
 
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("ask_human")
+        prompt = prompt_mgr.get_chat_prompt("ask_human")
         messages = state["messages"]
         # Latest Question and Request from Users (Updated)
         rev_request = state["rev_request"]
-        prompt = PromptTemplate(
-            template=prompt_template, input_variables=["rev_request", "msg_history"]
-        )
         msg_history = msg_util.get_pure_msg(messages)
         rev_request = state["rev_request"]
         input_data = {"rev_request": rev_request, "msg_history": msg_history}
+        model = bind_deadline(get_gpt_model("ask_human"), config)
         chain_llm = prompt | model | StrOutputParser()
-        answer_txt = chain_llm.invoke(input_data, config=config)
+        answer_txt = await chain_llm.ainvoke(input_data, config=config)
         answer = AIMessage(
             content=json.dumps(answer_txt, ensure_ascii=False), additional_kwargs={}
         )
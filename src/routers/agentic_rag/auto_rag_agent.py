@@ -1,24 +1,40 @@
+import asyncio
+import json
 import os
 import time
-from typing import Annotated
+from typing import Annotated, Literal
 
 from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, START, StateGraph
 from langgraph.prebuilt import InjectedState, ToolNode
-from langgraph.types import StreamWriter
+from langgraph.types import Command, StreamWriter
 from pydantic.errors import PydanticInvalidForJsonSchema
 
+from src.routers.agentic_rag.answer_cache import AnswerCache
 from src.routers.agentic_rag.answer_llm import AnswerLlmAgent
 from src.routers.agentic_rag.ask_human import AskHumanAgent
-from src.routers.agentic_rag.auto_research import AutoResearchAgent, tool_info
+from src.routers.agentic_rag.auto_research import (
+    ENABLE_MULTI_TOOL,
+    AutoResearchAgent,
+    tool_info,
+)
+from src.routers.agentic_rag.deadline import (
+    DEADLINE_ANSWER_RESERVE,
+    bind_deadline,
+    get_call_timeout,
+    set_tool_timeout,
+)
 from src.routers.agentic_rag.message_utils import MsgUtils
 from src.routers.agentic_rag.param_llm import get_gpt_model
 from src.routers.agentic_rag.router_agent import RouterAgent
 from src.routers.agentic_rag.state import State
+from src.routers.agentic_rag.step_memo import StepMemo
 from src.routers.utils.agent_msg_manager import AgentMsgManager
 from src.routers.utils.log_dev import LogDev
+from src.routers.utils.metrics import Metrics
 from src.routers.utils.prompt_manager import PromptManager
 
 log = LogDev()
@@ -27,12 +43,27 @@ load_dotenv()
 agent_msg_mgr = AgentMsgManager()
 prompt_mgr = PromptManager()
 msg_util = MsgUtils()
+step_memo = StepMemo()
+metrics = Metrics()
+answer_cache = AnswerCache()
 
-# LangSmith
-LANGSMITH_TRACING = True
-LANGSMITH_ENDPOINT = os.getenv("LANGSMITH_ENDPOINT")
-LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
-LANGSMITH_PROJECT = os.getenv("LANGSMITH_PROJECT")
+# Execute the first step of the plan while the rest of the plan is still being generated (True: enabled, False: disabled)
+ENABLE_PLAN_PREFETCH = os.environ.get("ENABLE_PLAN_PREFETCH", "False")
+
+# Time limit of a tool call (seconds)
+TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", 120))
+# Time limits of specific tools, overriding TOOL_TIMEOUT (e.g. ans_tavily:30,ans_arxiv:60)
+TOOL_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        item.split(":")
+        for item in os.environ.get("TOOL_TIMEOUTS", "").split(",")
+        if item.strip()
+    )
+}
+
+# Tracing: the spans of each run are recorded locally by RunTracer (ENABLE_RUN_TRACING, see tracing.py).
+# LangSmith is optional; LangChain reads LANGSMITH_TRACING and the other LANGSMITH_* variables from the environment.
 
 
 class AutoRagAgent:
@@ -52,6 +83,9 @@ class AutoRagAgent:
             self._ar.ans_llm_base,
             self._ar.search_rag,
         ]
+        self._tool_node = ToolNode(self._tools)
+        # First steps started while the plan is being created, per thread_id
+        self._prefetches = {}
 
     def _extract_plan(self, state: State) -> str:
         """
@@ -86,28 +120,167 @@ class AutoRagAgent:
         plan = plan_arr[index]
         return plan
 
-    def _select_tool(
+    async def _create_plan(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
         writer: StreamWriter,
     ) -> dict:
         """
-        Select the tool to call with Function calling
-        the user asks questions like "What does XYZ mean?" or other queries based on general knowledge.
+        Create the plan (create_plan)
+
+        When plan prefetch is enabled, the first step of the plan is executed (tool selection and tool call) as soon as it is complete,
+        while the rest of the plan is still being generated. select_tool uses its result if the final plan starts with the same step.
 
         Args:
-          state: State:
+          state: State
           config: RunnableConfig
 
         Returns:
-          dict: messages
+          dict: Output of create_plan
         """
-        log.print("\n<<Start: select_tool>>")
-        # Extract a plan to execute
-        plan = self._extract_plan(state)
-        plan_exec = {"plan_exec": plan}
-        model = get_gpt_model()
+        thread_id = config["configurable"]["thread_id"]
+        # Cancel a first step left by a request that ended with an error
+        stale = self._prefetches.pop(thread_id, None)
+        if stale is not None:
+            stale["task"].cancel()
+        if ENABLE_PLAN_PREFETCH.lower() != "true":
+            return await self._ar.create_plan(state, config, writer)
+
+        def on_first_step(step: str, messages: list):
+            step_state = {
+                **state,
+                "messages": messages,
+                "plan_exec": {"plan_exec": step},
+            }
+            # A first step launched before a retry of the plan generation is replaced
+            previous = self._prefetches.pop(thread_id, None)
+            if previous is not None:
+                previous["task"].cancel()
+                metrics.inc("plan_prefetch_total", outcome="discarded")
+            self._prefetches[thread_id] = {
+                "plan": step,
+                "task": asyncio.create_task(self._execute_step(step_state, config)),
+            }
+            metrics.inc("plan_prefetch_total", outcome="launched")
+
+        try:
+            return await self._ar.create_plan(
+                state, config, writer, on_first_step=on_first_step
+            )
+        except BaseException:
+            prefetch = self._prefetches.pop(thread_id, None)
+            if prefetch is not None:
+                prefetch["task"].cancel()
+            raise
+
+    async def _execute_step(
+        self, state: Annotated[State, InjectedState], config: RunnableConfig
+    ) -> tuple:
+        """
+        Select the tool of a plan step and call it (first step executed while the plan is being created)
+
+        Args:
+          state: State of the step (messages of the turn and plan_exec)
+          config: RunnableConfig
+
+        Returns:
+          tuple: (response with the tool calls, tool names, ToolMessages)
+        """
+        response, tool_name = await self._choose_tool(
+            state["plan_exec"]["plan_exec"], config
+        )
+        result = await self._run_tools(
+            {**state, "messages": state["messages"] + [response]}, config
+        )
+        return response, tool_name, result["messages"]
+
+    async def _run_tools(
+        self, state: Annotated[State, InjectedState], config: RunnableConfig
+    ) -> dict:
+        """
+        Run the tool calls of the latest AIMessage
+
+        Each tool call runs concurrently with its own time limit (TOOL_TIMEOUT / TOOL_TIMEOUTS),
+        shortened so that the time kept for the final answer remains before the deadline of the request.
+        A slow source therefore does not hold back the results of the others or the answer.
+
+        Args:
+          state: State
+          config: RunnableConfig
+
+        Returns:
+          dict: messages (ToolMessage of every tool call)
+        """
+        tool_calls = state["messages"][-1].tool_calls
+        results = await asyncio.gather(
+            *(self._run_tool_call(state, tool_call, config) for tool_call in tool_calls)
+        )
+        return {"messages": [msg for tool_msgs in results for msg in tool_msgs]}
+
+    async def _run_tool_call(
+        self,
+        state: Annotated[State, InjectedState],
+        tool_call: dict,
+        config: RunnableConfig,
+    ) -> list:
+        """
+        Run one tool call with its time limit
+
+        Args:
+          state: State
+          tool_call: Tool call of the latest AIMessage
+          config: RunnableConfig
+
+        Returns:
+          list: ToolMessages of the tool call (an error message if the time limit is exceeded)
+        """
+        own_timeout = TOOL_TIMEOUTS.get(tool_call["name"], TOOL_TIMEOUT)
+        timeout = get_call_timeout(config, own_timeout, reserve=DEADLINE_ANSWER_RESERVE)
+        call_msg = AIMessage(content="", tool_calls=[tool_call])
+        call_state = {**state, "messages": state["messages"][:-1] + [call_msg]}
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                self._tool_node.ainvoke(call_state, set_tool_timeout(config, timeout)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            # The tools are synchronous and run in a worker thread, which finishes in the background.
+            metrics.inc("tool_timeouts_total", tool=tool_call["name"])
+            metrics.inc("tool_errors_total", tool=tool_call["name"], reason="timeout")
+            if timeout < own_timeout:
+                metrics.inc("deadline_hits_total", node="call_tool")
+            return [
+                ToolMessage(
+                    content=f"Error: Timeout: {tool_call['name']} did not finish within {timeout:.0f} seconds.",
+                    name=tool_call["name"],
+                    tool_call_id=tool_call["id"],
+                    status="error",
+                )
+            ]
+        finally:
+            metrics.observe(
+                "tool_duration_seconds",
+                time.perf_counter() - start,
+                tool=tool_call["name"],
+            )
+        if any(getattr(msg, "status", "") == "error" for msg in result["messages"]):
+            metrics.inc("tool_errors_total", tool=tool_call["name"], reason="error")
+        return result["messages"]
+
+    async def _choose_tool(self, plan: str, config: RunnableConfig) -> tuple:
+        """
+        Select the tool to call for a plan with Function calling
+
+        Args:
+          plan: Plan to execute
+          config: RunnableConfig
+
+        Returns:
+          tuple: (response with the tool calls, tool names)
+        """
+        model = get_gpt_model("select_tool")
         max_retries = 1
         for attempt in range(max_retries + 1):
             try:
@@ -122,13 +295,14 @@ class AutoRagAgent:
                     print(
                         f"Select the tool to call(bind): Attempt {attempt + 1} failed, retrying..."
                     )
-                    time.sleep(1)  # Adjust the wait time as needed
+                    await asyncio.sleep(1)  # Adjust the wait time as needed
         config["tool_choice"] = "required"
         for attempt in range(max_retries):
             # Prompt
-            prompt_template = prompt_mgr.get_prompt("select_tool")
-            prompt = prompt_template.format(plan=plan, tool_info=tool_info)
-            response = chain.invoke(prompt, config=config)
+            prompt = prompt_mgr.get_chat_prompt("select_tool").invoke(
+                {"plan": plan, "tool_info": tool_info}
+            )
+            response = await bind_deadline(chain, config).ainvoke(prompt, config=config)
             tool_name = msg_util.get_tool_names(response)
             if tool_name:
                 # If tool_name is not False, exit the loop.
@@ -141,12 +315,215 @@ class AutoRagAgent:
             # If tool_name is False after 1 retry
             print("Warning: Even after one retry, tool_name could not be obtained.")
             tool_name = ["N/A"]
+        return response, tool_name
+
+    async def _select_tool(
+        self,
+        state: Annotated[State, InjectedState],
+        config: RunnableConfig,
+        writer: StreamWriter,
+    ) -> Command[Literal["call_tool", "update_plan_status"]]:
+        """
+        Select the tool to call with Function calling
+        the user asks questions like "What does XYZ mean?" or other queries based on general knowledge.
+        If the same plan was already executed for this request (e.g. before a replan, or while the plan was being created), its result is reused without calling the tool again.
+        A result memoized before a replan is reused only when the same tool is selected for the plan.
+
+        Args:
+          state: State:
+          config: RunnableConfig
+
+        Returns:
+          Command: messages, go to call_tool (or update_plan_status when the result is reused)
+        """
+        log.print("\n<<Start: select_tool>>")
+        # Extract a plan to execute
+        plan = self._extract_plan(state)
+        plan_exec = {"plan_exec": plan}
+        prefetch = self._prefetches.pop(config["configurable"]["thread_id"], None)
+        if prefetch is not None:
+            if prefetch["plan"] == plan:
+                command = await self._use_prefetch(plan, prefetch, writer)
+                if command is not None:
+                    return command
+            else:
+                # The final plan does not start with the executed step (e.g. plans over max_plan)
+                prefetch["task"].cancel()
+                metrics.inc("plan_prefetch_total", outcome="discarded")
+        response, tool_name = await self._choose_tool(plan, config)
+        if len(response.tool_calls) == 1:
+            memo_entry = step_memo.find(
+                state.get("step_memo"), plan, response.tool_calls[0]["name"]
+            )
+            if memo_entry is not None:
+                return self._reuse_step(plan, response, memo_entry, writer)
         # Show logs
         msg = agent_msg_mgr.get_msg("select_tool", plan=plan, tool_name=tool_name)
         log.print(msg + "\n")
         # Streaming custom message
         writer(msg)
-        return {"messages": [response], "plan_exec": plan_exec}
+        return Command(
+            update={"messages": [response], "plan_exec": plan_exec}, goto="call_tool"
+        )
+
+    async def _use_prefetch(self, plan: str, prefetch: dict, writer: StreamWriter):
+        """
+        Satisfy a plan from the step executed while the plan was being created
+
+        Args:
+          plan: Plan to execute
+          prefetch: Step started by create_plan ({"plan", "task"})
+          writer: StreamWriter
+
+        Returns:
+          Command or None: messages, go to update_plan_status. None if the step failed and has to be executed again.
+        """
+        try:
+            response, tool_name, tool_msgs = await prefetch["task"]
+        except Exception as err:
+            print(f"plan prefetch: {err}")
+            metrics.inc("plan_prefetch_total", outcome="discarded")
+            return None
+        metrics.inc("plan_prefetch_total", outcome="used")
+        # Show logs
+        msg = agent_msg_mgr.get_msg(
+            "select_tool_prefetch", plan=plan, tool_name=tool_name
+        )
+        log.print(msg + "\n")
+        # Streaming custom message
+        writer(msg)
+        return Command(
+            update={
+                "messages": [response, *tool_msgs],
+                "plan_exec": {"plan_exec": plan},
+            },
+            goto="update_plan_status",
+        )
+
+    def _reuse_step(
+        self, plan: str, response: AIMessage, memo_entry: dict, writer: StreamWriter
+    ) -> Command:
+        """
+        Satisfy a plan from the memoized result of an identical (or similar) completed plan that used the same tool
+
+        The memoized result is recorded as the ToolMessage of the selected tool call, so get_history and update_plan_status work unchanged.
+
+        Args:
+          plan: Plan to execute
+          response: Response of select_tool with one tool call
+          memo_entry: Entry of step_memo
+          writer: StreamWriter
+
+        Returns:
+          Command: messages, go to update_plan_status
+        """
+        tool_name = memo_entry["tool"]
+        tool_call_id = response.tool_calls[0]["id"]
+        tool_msg = ToolMessage(
+            content=memo_entry["content"], name=tool_name, tool_call_id=tool_call_id
+        )
+        # Show logs
+        msg = agent_msg_mgr.get_msg("select_tool_memo", plan=plan, tool_name=tool_name)
+        log.print(msg + "\n")
+        # Streaming custom message
+        writer(msg)
+        return Command(
+            update={"messages": [response, tool_msg], "plan_exec": {"plan_exec": plan}},
+            goto="update_plan_status",
+        )
+
+    async def _call_tool(
+        self,
+        state: Annotated[State, InjectedState],
+        config: RunnableConfig,
+        writer: StreamWriter,
+    ) -> dict:
+        """
+        Call the tools selected by select_tool (concurrently, each with a time limit)
+
+        When early stop is enabled, the sufficiency of the research results gathered so far is judged while the tools run.
+        If they already answer the request, the tools are cancelled and the remaining plans are skipped.
+
+        Args:
+          state: State
+          config: RunnableConfig
+
+        Returns:
+          dict: messages (ToolMessage), stop_reason
+        """
+        tool_task = asyncio.create_task(self._run_tools(state, config))
+        if not self._ar.needs_sufficiency_check(state):
+            return await tool_task
+        judge_task = asyncio.create_task(self._ar.judge_sufficiency(state, config))
+        await asyncio.wait({tool_task, judge_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not judge_task.done():
+            # The tools finished first. Still wait for the judgment to know whether the remaining plans are needed.
+            await asyncio.wait({judge_task})
+        try:
+            judgment = judge_task.result()
+        except Exception as err:
+            # The early stop is an optimization. Continue the research if the judgment fails.
+            print(f"judge_sufficiency: {err}")
+            return await tool_task
+        if not judgment["is_sufficient"]:
+            return await tool_task
+        metrics.inc("early_stop_total")
+        # Show logs
+        msg = agent_msg_mgr.get_msg(
+            "early_stop",
+            confidence=judgment["confidence"],
+            reason=judgment["reason"],
+        )
+        log.print(msg + "\n")
+        # Streaming custom message
+        writer(msg)
+        if tool_task.done():
+            result = tool_task.result()
+            result["stop_reason"] = "sufficient"
+            return result
+        tool_task.cancel()
+        # Answer the tool calls so that every tool call keeps its ToolMessage
+        tool_msgs = [
+            ToolMessage(
+                content="Cancelled: The research results gathered so far are sufficient.",
+                name=tool_call["name"],
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+            for tool_call in state["messages"][-1].tool_calls
+        ]
+        return {"messages": tool_msgs, "stop_reason": "sufficient"}
+
+    def _ans_cache(
+        self,
+        state: Annotated[State, InjectedState],
+        writer: StreamWriter,
+    ) -> dict:
+        """
+        Answer with the cached answer found by check_request
+
+        The answer is streamed in pieces as messages, in the same way as the answers created by the LLM.
+
+        Args:
+          state: State
+          writer: StreamWriter
+
+        Returns:
+          dict: messages, cached_answer
+        """
+        log.print("\n<<Start: ans_cache>>")
+        cached_answer = state["cached_answer"]
+        # Show logs
+        msg = agent_msg_mgr.get_msg("ans_cache")
+        log.print(msg + "\n")
+        # Streaming custom message
+        writer(msg)
+        for piece in answer_cache.split_for_stream(cached_answer):
+            writer({"type": "msg", "content": piece})
+        answer = AIMessage(
+            content=json.dumps(cached_answer, ensure_ascii=False), additional_kwargs={}
+        )
+        return {"messages": [answer], "cached_answer": ""}
 
     async def create_graph(self):
         """
@@ -156,22 +533,23 @@ class AutoRagAgent:
           CompiledStateGraph: app
         """
         try:
-            tool_node = ToolNode(self._tools)
             # ---- Define the Graph ----
             workflow = StateGraph(state_schema=State)
 
             # ---- Define the node. ----
             # -- Parent Agent --
-            # Decide which of ans_llm_solo, create_plan, or ask_human you want to execute and use Command to transition.
+            # Decide which of ans_llm_solo, create_plan, ask_human or ans_cache you want to execute and use Command to transition.
             workflow.add_node("check_request", self._rt.check_request)
             # -- Answer solo agent.(Answer solo with llm base knowledge) --
             workflow.add_node("ans_llm_solo", self._al.ans_llm_solo)
             # -- Ask human agent. --
             workflow.add_node("ask_human", self._ah.ask_human)
+            # -- Answer from the answer cache. --
+            workflow.add_node("ans_cache", self._ans_cache)
             # -- Auto Research Agent --
-            workflow.add_node("create_plan", self._ar.create_plan)
+            workflow.add_node("create_plan", self._create_plan)
             workflow.add_node("select_tool", self._select_tool)
-            workflow.add_node("call_tool", tool_node)
+            workflow.add_node("call_tool", self._call_tool)
             workflow.add_node("update_plan_status", self._ar.update_plan_status)
             workflow.add_node("judge_replan", self._ar.judge_replan)
             workflow.add_node("create_final_answer", self._ar.create_final_answer)
@@ -184,9 +562,11 @@ class AutoRagAgent:
             workflow.add_edge("ans_llm_solo", END)
             # -- Ask human --
             workflow.add_edge("ask_human", END)
+            # -- Answer cache --
+            workflow.add_edge("ans_cache", END)
             # -- Auto research --
             workflow.add_edge("create_plan", "select_tool")
-            workflow.add_edge("select_tool", "call_tool")
+            # select_tool goes to call_tool, or directly to update_plan_status when the result of a completed plan is reused (Command)
             # There is a process to detect errors that occur in the tool at the first process of node:update_plan_status
             workflow.add_edge("call_tool", "update_plan_status")
             workflow.add_edge("create_revised_plan", "select_tool")
@@ -1,31 +1,50 @@
+import asyncio
 import datetime
 import json
+import math
 import os
-import time
 from pathlib import Path
 
 import arxiv
+import requests
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
 from langchain_community.retrievers import TavilySearchAPIRetriever
 from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.callbacks.manager import adispatch_custom_event
 from langchain_core.exceptions import OutputParserException
 from langchain_core.messages import AIMessage
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.outputs import Generation
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.utils.json import parse_json_markdown
 from langgraph.config import get_stream_writer
 from langgraph.prebuilt import InjectedState
 from langgraph.types import Command, StreamWriter
 from typing_extensions import Annotated
 
+from src.routers.agentic_rag.answer_cache import AnswerCache
+from src.routers.agentic_rag.deadline import (
+    bind_deadline,
+    get_tool_timeout,
+    is_near_deadline,
+)
+from src.routers.agentic_rag.hedge import HedgePolicy
 from src.routers.agentic_rag.message_utils import MsgUtils
+from src.routers.agentic_rag.param_embedding import get_embedding_model
 from src.routers.agentic_rag.param_llm import get_gpt_model
+from src.routers.agentic_rag.passage_dedup import ENABLE_SEARCH_DEDUP, PassageDeduper
 from src.routers.agentic_rag.search_answer import SearchAnswerEngine
+from src.routers.agentic_rag.speculative_answer import (
+    ENABLE_SPECULATIVE_ANSWER,
+    SpeculativeAnswer,
+)
 from src.routers.agentic_rag.state import State
+from src.routers.agentic_rag.step_memo import StepMemo
+from src.routers.agentic_rag.usage import is_over_token_budget
 from src.routers.utils.agent_msg_manager import AgentMsgManager
 from src.routers.utils.log_dev import LogDev
+from src.routers.utils.metrics import Metrics
 from src.routers.utils.prompt_manager import PromptManager
 
 log = LogDev()
@@ -34,6 +53,11 @@ load_dotenv()
 prompt_mgr = PromptManager()
 agent_msg_mgr = AgentMsgManager()
 msg_util = MsgUtils()
+deduper = PassageDeduper()
+step_memo = StepMemo()
+hedge_policy = HedgePolicy()
+metrics = Metrics()
+answer_cache = AnswerCache()
 
 AGENT_THOUGHT_LANG = os.environ.get("AGENT_THOUGHT_LANG", "en")
 RAG_INDEX_LANG = os.environ.get("RAG_INDEX_LANG", "en")
@@ -44,15 +68,19 @@ max_plan = int(os.environ.get("MAX_PLAN", 5))
 max_turn = int(os.environ.get("MAX_TURN", 2))
 # Max search text
 max_search_txt = int(os.environ.get("MAX_SEARCH_TXT", 10000))
+# Check whether the research results are already sufficient while the next plan is executed (True: enabled, False: disabled)
+ENABLE_EARLY_STOP = os.environ.get("ENABLE_EARLY_STOP", "False")
+# Confidence (0-1) from which the remaining plans are skipped
+early_stop_confidence = float(os.environ.get("EARLY_STOP_CONFIDENCE", 0.8))
+# Let one plan call several tools at once, executed concurrently by call_tool (True: enabled, False: disabled)
+ENABLE_MULTI_TOOL = os.environ.get("ENABLE_MULTI_TOOL", "False")
 
 # get_stream_writer manual: [How to stream data from within a tool](https://langchain-ai.github.io/langgraph/how-tos/streaming-events-from-within-tools/)
-model = get_gpt_model()
 # To clearly communicate the information contained in the vector database and to prevent it from being used for other purposes
 vector_db_info = "Internal company information for the fictional companies Fic-GreenLife, Fic-NextFood, and Fic-TechFrontier"
 
 # Get vector store
-HUG_EMBE_MODEL_NAME = os.getenv("HUG_EMBE_MODEL_NAME")
-embeddings = HuggingFaceEmbeddings(model_name=HUG_EMBE_MODEL_NAME)
+embeddings = get_embedding_model()
 if RAG_INDEX_LANG.lower() == "ja":
     index_path = Path("src/routers/agentic_rag/index/ja").resolve()
 else:
@@ -65,6 +93,48 @@ vector_store = FAISS.load_local(
 os.environ["TAVILY_API_KEY"] = os.getenv("TAVILY_API_KEY")
 TAVILY_MAX_RESULTS = os.getenv("TAVILY_MAX_RESULTS")
 TAVILY_SEARCH_DEPTH = os.getenv("TAVILY_SEARCH_DEPTH")
+# Number of times a failed arXiv request is retried (the arxiv package retries 3 times by default)
+ARXIV_NUM_RETRIES = int(os.environ.get("ARXIV_NUM_RETRIES", 1))
+# Wait between arXiv requests, as asked by the arXiv API (seconds)
+ARXIV_DELAY_SECONDS = 3.0
+
+
+class TimeoutSession(requests.Session):
+    """
+    TimeoutSession
+    requests session giving every request a time limit, for clients which do not take one (e.g. arxiv.Client)
+    """
+
+    def __init__(self, timeout: float = None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_arxiv_client(timeout: float = None) -> arxiv.Client:
+    """
+    Create an arxiv client whose requests, retries included, end within the time limit of the tool call
+
+    Args:
+      timeout (float): Time limit of the search in seconds. None: no limit.
+
+    Returns:
+      arxiv.Client: client
+    """
+    client = arxiv.Client(
+        delay_seconds=ARXIV_DELAY_SECONDS, num_retries=ARXIV_NUM_RETRIES
+    )
+    if timeout is not None:
+        # The time limit is shared by the first request and the retries, which wait ARXIV_DELAY_SECONDS each
+        attempt_timeout = (timeout - ARXIV_DELAY_SECONDS * ARXIV_NUM_RETRIES) / (
+            ARXIV_NUM_RETRIES + 1
+        )
+        client._session = TimeoutSession(max(attempt_timeout, 1.0))
+    return client
+
 
 # Write tool information. LLM read it and select tools to call.
 tool_info = """
@@ -78,6 +148,11 @@ The following tools are capable of searching only. Please do not call them for a
 ## Tools for LLM-Generated Responses
 - **ans_llm_base**: Provides answers based on the LLM's own knowledge. It is capable of answering questions, summarizing, taking action on research findings, analyzing, extracting keywords, computing, offering opinions and insights, reasoning, and listing results.
 """
+if ENABLE_MULTI_TOOL.lower() == "true":
+    tool_info += """
+## Searching Several Sources in One Plan
+A single plan can search several sources about the same subject (e.g. news on the web and papers on arXiv). Call all the search tools such a plan needs at once; they are executed in parallel. Do not split it into separate plans, and call each tool at most once per plan.
+"""
 
 
 class SearchError(Exception):
@@ -86,6 +161,35 @@ class SearchError(Exception):
     pass
 
 
+def dedup_search_results(passages: list, messages: list) -> str:
+    """
+    Join the passages of a search result, omitting the ones already retrieved in the current turn
+
+    Mirrored articles and the same RAG chunks are often returned again by later plans and replans.
+    They are replaced by a reference to the first result so that res_history and the checkpoint do not grow with copies.
+
+    Args:
+      passages (list): Passages of the search result, each starting with "## Title:"
+      messages (list): Messages of the state
+
+    Returns:
+      str: answer
+    """
+    if ENABLE_SEARCH_DEDUP.lower() != "true":
+        return "".join(passages)
+    seen_results = msg_util.get_turn_tool_msgs(messages)
+    passages, num_removed, saved_chars = deduper.dedup(passages, seen_results)
+    if num_removed > 0:
+        msg = agent_msg_mgr.get_msg(
+            "dedup_search_results", num_removed=num_removed, saved_chars=saved_chars
+        )
+        log.print(msg + "\n")
+        # Streaming custom message
+        writer = get_stream_writer()
+        writer(msg)
+    return "".join(passages)
+
+
 class AutoResearchAgent:
     """
     AutoResearchAgent
@@ -93,34 +197,78 @@ class AutoResearchAgent:
     """
 
     def __init__(self):
-        pass
+        # Final answers started by judge_replan, per thread_id
+        self._speculations = {}
 
-    def invoke_with_retry(self, chain, input_data, config, max_retries=3, sleep_time=1):
+    async def astream_plan_with_retry(
+        self, chain, input_data, config, on_first_step=None, max_retries=3, sleep_time=1
+    ):
         """
-        This function executes chain.invoke and retries if an OutputParserException occurs.
+        This function streams the plan of chain.astream, parsing the JSON incrementally, and retries if the plan cannot be parsed.
+
+        As soon as the first step of the plan is complete (the second step has started), on_first_step is called with it,
+        so that the first step can be executed while the rest of the plan is still being generated.
+        When the stream ends, the whole text is parsed strictly: a truncated or inconsistent plan is retried like before streaming.
 
         Parameters:
-          chain: Chain to be executed
-          input_data: Input data to be passed to chain.invoke
-          config: Settings to be passed to chain.invoke
+          chain: Chain to be executed (yields the message chunks of the model, e.g. prompt | model)
+          input_data: Input data to be passed to chain.astream
+          config: Settings to be passed to chain.astream
+          on_first_step: Function called with the text of the first step once it is complete (optional)
           max_retries (int): Maximum number of retries (default is 3)
           sleep_time (int or float): Wait time before retrying (seconds, default is 1 second)
 
         Returns:
-          plan_json: Result of successful execution of chain.invoke
+          plan_json: Plan of the successful execution
 
         Raises:
           Exception: Raised when the maximum number of retries is exceeded
         """
+        partial_parser = JsonOutputParser()
         for attempt in range(max_retries):
+            text = ""
+            first_step = None
             try:
-                plan_json = chain.invoke(input_data, config=config)
-                return plan_json  # If successful, return the result
+                async for chunk in chain.astream(input_data, config=config):
+                    text += chunk.content if isinstance(chunk.content, str) else ""
+                    if first_step is not None:
+                        continue
+                    partial_json = partial_parser.parse_result(
+                        [Generation(text=text)], partial=True
+                    )
+                    steps = (
+                        partial_json.get("plan")
+                        if isinstance(partial_json, dict)
+                        else None
+                    )
+                    if isinstance(steps, list) and len(steps) > 1:
+                        first_step = steps[0]
+                        if on_first_step is not None and isinstance(first_step, str):
+                            on_first_step(first_step)
+                try:
+                    plan_json = parse_json_markdown(text, parser=json.loads)
+                except ValueError as err:
+                    raise OutputParserException(f"Invalid json output: {text}") from err
+                if not (
+                    isinstance(plan_json, dict)
+                    and isinstance(plan_json.get("plan"), list)
+                    and isinstance(plan_json.get("plan_status"), list)
+                    and len(plan_json["plan"]) == len(plan_json["plan_status"]) > 0
+                ):
+                    raise OutputParserException(f"Invalid plan: {plan_json}")
+                return plan_json
             except OutputParserException as e:
                 print(
                     f"OutputParserException occurred: {e}. Retrying ({attempt+1}/{max_retries})"
                 )
-                time.sleep(sleep_time)
+                metrics.inc("llm_retries_total", reason="output_parser")
+                # Recorded in the span of the node by the run tracer
+                await adispatch_custom_event(
+                    "retry",
+                    {"reason": "output_parser", "attempt": attempt + 1},
+                    config=config,
+                )
+                await asyncio.sleep(sleep_time)
         raise Exception("Error: LLM call retry limit reached.")
 
     @staticmethod
@@ -149,11 +297,7 @@ class AutoResearchAgent:
         # Get survey results (starting from type:start_turn)
         res_history = msg_util.get_history(messages)
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("ans_llm_base")
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["question", "res_history", "date_time"],
-        )
+        prompt = prompt_mgr.get_chat_prompt("ans_llm_base")
         question = state["plan_exec"]["plan_exec"]
         # Get the current date and time
         now = datetime.datetime.now()
@@ -164,6 +308,7 @@ class AutoResearchAgent:
             "res_history": res_history,
             "date_time": date_time,
         }
+        model = bind_deadline(get_gpt_model("ans_llm_base"), config)
         chain_llm = prompt | model | StrOutputParser()
         answer = chain_llm.invoke(input_data, config=config)
         return answer
@@ -196,12 +341,13 @@ class AutoResearchAgent:
                 question, k=top_k, filter=None
             )
             doc_cnt = 1
-            answer = ""
+            passages = []
             for result in results:
                 title = result[0].metadata["title"]
                 content = result[0].page_content
-                answer += f"## Title: {title}\n{content}\n\n"
+                passages.append(f"## Title: {title}\n{content}\n\n")
                 doc_cnt += 1
+            answer = dedup_search_results(passages, state["messages"])
         except Exception as err:
             err_str = f"Error: A problem occurred while searching. {err}"
             raise SearchError(err_str) from err
@@ -233,29 +379,34 @@ class AutoResearchAgent:
         try:
             top_k = TAVILY_MAX_RESULTS
             log.print("\n<<Start: ans_tavily>>")
+            messages = state["messages"]
             question = state["plan_exec"]["plan_exec"]
             if question == None:
                 raise ValueError("Error: There are no questions for tavily search.")
             sa_ins = SearchAnswerEngine()
+            # Time limit of the HTTP request, so that the worker thread does not outlive the tool call
+            timeout = get_tool_timeout(config)
             retriever = TavilySearchAPIRetriever(
                 k=top_k,
                 search_depth=TAVILY_SEARCH_DEPTH,
                 include_answer=True,
                 include_raw_content=False,
+                kwargs={} if timeout is None else {"timeout": math.ceil(timeout)},
             )
-            results = retriever.invoke(question)
+            results = hedge_policy.call("ans_tavily", retriever.invoke, question)
             doc_cnt = 1
-            answer = ""
+            passages = []
             for result in results:
                 title = sa_ins.repair_enc_univ(result.metadata["title"])
                 content = sa_ins.repair_enc_univ(
                     sa_ins.truncate_text(result.page_content, max_search_txt)
                 )
                 url = result.metadata["source"]
-                answer += (
+                passages.append(
                     f"## Title: {title}\n### URL:{url}\n### Content:\n{content}\n\n"
                 )
                 doc_cnt += 1
+            answer = dedup_search_results(passages, messages)
         except Exception as err:
             err_str = f"Error: A problem occurred while searching. {err}"
             raise SearchError(err_str) from err
@@ -295,11 +446,9 @@ class AutoResearchAgent:
         question = state["plan_exec"]["plan_exec"]
         # Create query of arxiv
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("ans_arxiv")
-        prompt = PromptTemplate(
-            template=prompt_template, input_variables=["question", "res_history"]
-        )
+        prompt = prompt_mgr.get_chat_prompt("ans_arxiv")
         input_data = {"question": question, "res_history": res_history}
+        model = bind_deadline(get_gpt_model("ans_arxiv"), config)
         chain_llm = prompt | model | StrOutputParser()
         query = chain_llm.invoke(input_data, config=config)
         writer(f"[arxiv query]\n{query}")
@@ -307,19 +456,24 @@ class AutoResearchAgent:
             search = arxiv.Search(
                 query=query, max_results=5, sort_by=arxiv.SortCriterion.SubmittedDate
             )
-            # Create a Client object and pass in the Search object
-            client = arxiv.Client()
-            results = client.results(search)
+            # Create a Client object and pass in the Search object (a new one for a duplicate request)
+            timeout = get_tool_timeout(config)
+            results = hedge_policy.call(
+                "ans_arxiv", lambda: list(get_arxiv_client(timeout).results(search))
+            )
 
             doc_cnt = 1
-            answer = ""
+            passages = []
             for result in results:
                 title = result.title
                 published = result.published
                 summary = result.summary
                 url = result.entry_id
-                answer += f"## Title: {title}, Published: {published}, Url: {url} \n{summary}\n\n"
+                passages.append(
+                    f"## Title: {title}, Published: {published}, Url: {url} \n{summary}\n\n"
+                )
                 doc_cnt += 1
+            answer = dedup_search_results(passages, messages)
         except Exception as err:
             err_str = f"Error: A problem occurred while searching. {err}"
             raise SearchError(err_str) from err
@@ -331,18 +485,22 @@ class AutoResearchAgent:
 
     # --- Agent functions ---
 
-    def create_plan(
+    async def create_plan(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
         writer: StreamWriter,
+        on_first_step=None,
     ) -> dict:
         """
         Develop a work plan to achieve the objectives of users in response to their questions and requests
 
+        The plan is generated in JSON mode and parsed while it is streamed.
+
         Args:
           state: Annotated[State, InjectedState]
           config: RunnableConfig
+          on_first_step: Function called with the first step and the messages of the turn once the first step is complete (optional)
 
         Returns:
           dict: messages
@@ -357,18 +515,7 @@ class AutoResearchAgent:
         )
         turn = 1
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("create_plan")
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=[
-                "max_plan",
-                "rev_request",
-                "msg_history",
-                "vector_db_info",
-                "date_time",
-                "tool_info",
-            ],
-        )
+        prompt = prompt_mgr.get_chat_prompt("create_plan")
         msg_history = msg_util.get_pure_msg(messages)
         rev_request = state["rev_request"]
         # Get the current date and time
@@ -383,8 +530,22 @@ class AutoResearchAgent:
             "date_time": date_time,
             "tool_info": tool_info,
         }
-        chain = prompt | model | JsonOutputParser()
-        plan_json = self.invoke_with_retry(chain, input_data, config=config)
+        # JSON mode of the provider, so that the plan rarely needs to be requested again
+        model = bind_deadline(
+            get_gpt_model("create_plan").bind(response_format={"type": "json_object"}),
+            config,
+        )
+        # The text of the plan is parsed by astream_plan_with_retry (incrementally, then strictly)
+        chain = prompt | model
+        first_step_hook = None
+        if on_first_step is not None:
+
+            def first_step_hook(step: str):
+                on_first_step(step, messages + [start_turn])
+
+        plan_json = await self.astream_plan_with_retry(
+            chain, input_data, config=config, on_first_step=first_step_hook
+        )
         # Get plan_status
         plan_status = plan_json.get("plan_status")
         num_plans = len(plan_json.get("plan"))
@@ -416,16 +577,29 @@ class AutoResearchAgent:
             "plan_over": plan_over,
         }
 
-    def update_plan_status(self, state: Annotated[State, InjectedState]) -> dict:
+    def update_plan_status(
+        self,
+        state: Annotated[State, InjectedState],
+        config: RunnableConfig,
+        writer: StreamWriter,
+    ) -> dict:
         """
         Update the plan status, changing the first occurrence of open to done.
+
+        When only the time kept for the final answer remains before the deadline of the request, or when the run has used its token budget,
+        the remaining plans are skipped.
         """
         log.print("\n<<Start: update_plan_status>>")
         # Detects errors caused by tool calling and returns an exception if an error occurs.
+        # When the plan called several tools, the research continues as long as one of them succeeded.
         messages = state["messages"]
-        latest_tool_msg = msg_util.get_latest_ai_tool_msg(messages)
-        if latest_tool_msg.startswith("Error: SearchError"):
-            raise SearchError(latest_tool_msg)
+        step_tool_msgs = msg_util.get_step_tool_msgs(messages)
+        if step_tool_msgs and all(
+            isinstance(msg.content, str)
+            and msg.content.startswith("Error: SearchError")
+            for msg in step_tool_msgs
+        ):
+            raise SearchError(step_tool_msgs[-1].content)
         plan_status = state["plan_status"]
         # Update status
         # Since the plan is executed in order from the top, the first open value found is changed to done.
@@ -433,12 +607,49 @@ class AutoResearchAgent:
             if status == "open":
                 plan_status[index] = "done"
                 break
+        # When the research was stopped early, the remaining plans are skipped.
+        stop_reason = state.get("stop_reason")
+        if not stop_reason and is_near_deadline(config):
+            stop_reason = "deadline"
+            metrics.inc("deadline_hits_total", node="update_plan_status")
+            msg = agent_msg_mgr.get_msg("deadline_stop")
+            log.print(msg + "\n")
+            # Streaming custom message
+            writer(msg)
+        if not stop_reason and is_over_token_budget(config):
+            stop_reason = "token_budget"
+            metrics.inc("token_budget_hits_total")
+            msg = agent_msg_mgr.get_msg("token_budget_stop")
+            log.print(msg + "\n")
+            # Streaming custom message
+            writer(msg)
+        if stop_reason:
+            num_skipped = plan_status.count("open")
+            plan_status = ["skipped" if st == "open" else st for st in plan_status]
+            metrics.inc("plan_steps_skipped_total", num_skipped, reason=stop_reason)
+        # Memoize the result of the executed plan so that a revised plan containing the same step can reuse it
+        # A plan that called several tools is not memoized, because a memo entry holds the result of one tool.
+        memo = state.get("step_memo") or []
+        tool_msg = step_tool_msgs[0] if len(step_tool_msgs) == 1 else None
+        if (
+            tool_msg is not None
+            and tool_msg.status != "error"
+            and isinstance(tool_msg.content, str)
+            and not tool_msg.content.startswith("Error")
+            # Passages omitted by dedup refer to results that are not carried over to the next turn
+            and not deduper.has_references(tool_msg.content)
+        ):
+            memo = step_memo.add(
+                memo, state["plan_exec"]["plan_exec"], tool_msg.name, tool_msg.content
+            )
         # Show logs
         num_plans = len(plan_status)
         plan_st_txt = ""
         for i, status in enumerate(plan_status, start=1):
             if status == "done":
                 status_show = "Done"
+            elif status == "skipped":
+                status_show = "Skipped"
             else:
                 status_show = "Open"
             plan_st_txt += f"- Plan{i}: {status_show}"
@@ -446,7 +657,11 @@ class AutoResearchAgent:
                 plan_st_txt += "\n"
         msg = agent_msg_mgr.get_msg("update_plan_status", plan_status=plan_st_txt)
         log.print(msg + "\n")
-        return {"plan_status": plan_status}
+        return {
+            "plan_status": plan_status,
+            "step_memo": memo,
+            "stop_reason": stop_reason,
+        }
 
     def check_open_plan(self, state: Annotated[State, InjectedState]) -> bool:
         """
@@ -478,29 +693,24 @@ class AutoResearchAgent:
             log.print("There is an open plan.")
         return result
 
-    def create_final_answer(
+    def get_final_answer_chain(
         self, state: Annotated[State, InjectedState], config: RunnableConfig
-    ) -> str:
+    ) -> tuple:
         """
-        Creating a final answer
+        Create the chain and the input data of the final answer
 
         Args:
           state: Annotated[State, InjectedState]
-          config: RunnableConfig
+          config: RunnableConfig (the model gets the remaining time of the request)
 
         Returns:
-          dict: messages
+          tuple: (chain, input_data)
         """
-        log.print("\n<<Start: create_final_answer>>")
         messages = state["messages"]
         # Get survey results (starting from type:start_turn)
         res_history = msg_util.get_history(messages)
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("create_final_answer")
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["request", "res_history", "msg_history", "date_time"],
-        )
+        prompt = prompt_mgr.get_chat_prompt("create_final_answer")
         msg_history = msg_util.get_pure_msg(messages)
         # Get the current date and time
         now = datetime.datetime.now()
@@ -514,14 +724,125 @@ class AutoResearchAgent:
             "msg_history": msg_history,
             "date_time": date_time,
         }
+        model = bind_deadline(get_gpt_model("create_final_answer"), config)
         chain = prompt | model | StrOutputParser()
-        answer_llm = chain.invoke(input_data, config=config)
+        return chain, input_data
+
+    async def create_final_answer(
+        self,
+        state: Annotated[State, InjectedState],
+        config: RunnableConfig,
+        writer: StreamWriter,
+    ) -> str:
+        """
+        Creating a final answer
+
+        When judge_replan has already started the answer speculatively, its tokens are streamed instead of calling the LLM again.
+
+        Args:
+          state: Annotated[State, InjectedState]
+          config: RunnableConfig
+
+        Returns:
+          dict: messages
+        """
+        log.print("\n<<Start: create_final_answer>>")
+        speculation = self._speculations.pop(
+            config["configurable"].get("thread_id"), None
+        )
+        if speculation is not None:
+            answer_llm = ""
+            try:
+                async for token in speculation.tokens():
+                    answer_llm += token
+                    # Streaming the buffered tokens as messages of the final answer
+                    writer({"type": "msg", "content": token})
+            except BaseException:
+                # Stop the generation when the run is cancelled (e.g. the client disconnected)
+                speculation.cancel()
+                raise
+        else:
+            chain, input_data = self.get_final_answer_chain(state, config)
+            answer_llm = await chain.ainvoke(input_data, config=config)
+        # Keep the answer for the same question asked again
+        messages = state["messages"]
+        if answer_cache.is_cacheable(messages):
+            await answer_cache.add(
+                state["rev_request"],
+                "auto_research",
+                answer_llm,
+                uses_rag=answer_cache.uses_rag(messages),
+            )
         answer = AIMessage(
             content=json.dumps(answer_llm, ensure_ascii=False), additional_kwargs={}
         )
         return {"messages": [answer]}
 
-    def judge_replan(
+    def needs_sufficiency_check(self, state: Annotated[State, InjectedState]) -> bool:
+        """
+        Decide whether to check the sufficiency of the research results while the current plan is executed
+
+        The check is done only when early stop is enabled and at least one plan of the current turn has produced results.
+
+        Returns:
+          boolean: True: Check, False: Do not check
+        """
+        if ENABLE_EARLY_STOP.lower() != "true" or state.get("stop_reason"):
+            return False
+        return len(msg_util.get_turn_tool_msgs(state["messages"])) > 0
+
+    async def judge_sufficiency(
+        self, state: Annotated[State, InjectedState], config: RunnableConfig
+    ) -> dict:
+        """
+        Judge whether the research results gathered so far already answer the request, so that the remaining plans can be skipped
+
+        Args:
+          state: Annotated[State, InjectedState]
+          config: RunnableConfig
+
+        Returns:
+          dict: is_sufficient (bool), confidence (float), reason (str)
+        """
+        log.print("- Start: judge_sufficiency")
+        messages = state["messages"]
+        metrics.inc("early_stop_checks_total")
+        # Get survey results (starting from type:start_turn)
+        res_history = msg_util.get_history(messages)
+        # The plan being executed and the ones after it
+        plan_arr = state["plan"]["plan"]
+        remaining_plans = "\n".join(
+            f"- {plan}"
+            for plan, status in zip(plan_arr, state["plan_status"])
+            if status == "open"
+        )
+        # Prompt
+        prompt = prompt_mgr.get_chat_prompt("judge_sufficiency")
+        input_data = {
+            "rev_request": state["rev_request"],
+            "remaining_plans": remaining_plans,
+            "res_history": res_history,
+        }
+        model = bind_deadline(get_gpt_model("judge_sufficiency"), config)
+        chain = prompt | model | JsonOutputParser()
+        try:
+            answer_json = await chain.ainvoke(input_data, config=config)
+            confidence = float(answer_json.get("confidence", 0))
+        except (OutputParserException, TypeError, ValueError) as err:
+            # Continue the research when the judgment cannot be read
+            print(f"judge_sufficiency: {err}")
+            return {"is_sufficient": False, "confidence": 0.0, "reason": str(err)}
+        is_sufficient = (
+            answer_json.get("is_sufficient") == "yes"
+            and confidence >= early_stop_confidence
+        )
+        return {
+            "is_sufficient": is_sufficient,
+            "confidence": confidence,
+            "reason": answer_json.get("reason", ""),
+        }
+
+    async def judge_replan(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
@@ -530,6 +851,9 @@ class AutoResearchAgent:
         """
         Decide whether to replan
 
+        When speculative answers are enabled, the final answer is started while the LLM judges, so that it is ready (or already streaming) when no replan is needed.
+        It is cancelled if a replan is needed.
+
         Returns:
           boolean: True: Re-plan, False: Do not re-plan
         """
@@ -540,8 +864,16 @@ class AutoResearchAgent:
             answer = "Error: The number of turns is 0."
             print(answer)
             raise ValueError(answer)
+        # A final answer left by an interrupted run must not be used for this one
+        stale = self._speculations.pop(config["configurable"].get("thread_id"), None)
+        if stale is not None:
+            stale.cancel()
         judge = True
-        if turn >= max_turn:
+        stop_reason = state.get("stop_reason")
+        if stop_reason:
+            # Do not re-plan (the research was stopped early)
+            judge = False
+        elif turn >= max_turn:
             # Do not re-plan (the limit has been exceeded)
             judge = False
         else:
@@ -549,11 +881,7 @@ class AutoResearchAgent:
             # Get survey results (starting from type:start_turn)
             res_history = msg_util.get_history(messages)
             # Prompt
-            prompt_template = prompt_mgr.get_prompt("judge_replan")
-            prompt = PromptTemplate(
-                template=prompt_template,
-                input_variables=["request", "res_history", "msg_history", "date_time"],
-            )
+            prompt = prompt_mgr.get_chat_prompt("judge_replan")
             # Latest Questions and Requests from Users (Updated)
             rev_request = state["rev_request"]
             msg_history = msg_util.get_pure_msg(messages)
@@ -567,8 +895,19 @@ class AutoResearchAgent:
                 "msg_history": msg_history,
                 "date_time": date_time,
             }
+            model = bind_deadline(get_gpt_model("judge_replan"), config)
             chain = prompt | model | JsonOutputParser()
-            answer_json = chain.invoke(input_data, config=config)
+            speculation = None
+            if ENABLE_SPECULATIVE_ANSWER.lower() == "true":
+                final_chain, final_input = self.get_final_answer_chain(state, config)
+                speculation = SpeculativeAnswer(final_chain, final_input, config)
+            try:
+                answer_json = await chain.ainvoke(input_data, config=config)
+            except BaseException:
+                # Also when the run is cancelled (e.g. the client disconnected)
+                if speculation is not None:
+                    speculation.cancel()
+                raise
             value = answer_json.get("is_included")
             if value == "yes":
                 # Do not replan if answer is included
@@ -576,6 +915,13 @@ class AutoResearchAgent:
             else:
                 # Otherwise, replan.
                 judge = True
+            if speculation is not None:
+                if judge:
+                    speculation.cancel()
+                else:
+                    # Handed over to create_final_answer
+                    thread_id = config["configurable"].get("thread_id")
+                    self._speculations[thread_id] = speculation
         goto = ""
         if judge == True:
             # Replan
@@ -584,6 +930,13 @@ class AutoResearchAgent:
                 judge_msg = f"判定: 再プランを行います。回答が見つからないため。"
             else:
                 judge_msg = f"Verdict: Perform replanning because no answer was found."
+        elif stop_reason == "sufficient":
+            # Final answer (the research results were judged sufficient before all plans were executed)
+            goto = "create_final_answer"
+            if AGENT_THOUGHT_LANG.lower() == "ja":
+                judge_msg = f"判定: 再プランを行いません。調査結果で回答できるため、残りのプランを省略しました。"
+            else:
+                judge_msg = f"Verdict: Do not perform replanning. The remaining plans were skipped because the research results are sufficient."
         else:
             # Final answer
             goto = "create_final_answer"
@@ -599,7 +952,7 @@ class AutoResearchAgent:
         writer(msg)
         return Command(goto=goto)
 
-    def create_revised_plan(
+    async def create_revised_plan(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
@@ -631,19 +984,8 @@ class AutoResearchAgent:
             raise ValueError(answer)
         turn += 1
         # Prompt
-        prompt_template = prompt_mgr.get_prompt("create_revised_plan")
+        prompt = prompt_mgr.get_chat_prompt("create_revised_plan")
         plan = state["plan"]
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=[
-                "max_plan",
-                "vector_db_info",
-                "plan",
-                "date_time",
-                "tool_info",
-                "rev_request",
-            ],
-        )
         rev_request = state["rev_request"]
         # Get the current date and time
         now = datetime.datetime.now()
@@ -657,8 +999,9 @@ class AutoResearchAgent:
             "tool_info": tool_info,
             "rev_request": rev_request,
         }
+        model = bind_deadline(get_gpt_model("create_revised_plan"), config)
         chain_llm = prompt | model | JsonOutputParser()
-        replan_json = chain_llm.invoke(input_data, config=config)
+        replan_json = await chain_llm.ainvoke(input_data, config=config)
         # Get plan_status
         plan_status = replan_json.get("plan_status")
 
@@ -0,0 +1,204 @@
+import os
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# End-to-end time limit of a request (seconds, 0: no limit)
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 0))
+# Time kept for the final answer. The research stops when less time remains (seconds)
+DEADLINE_ANSWER_RESERVE = float(os.environ.get("DEADLINE_ANSWER_RESERVE", 30))
+# Shortest time limit given to a call, so that a call started just before the deadline can still answer (seconds)
+MIN_CALL_TIMEOUT = 5.0
+
+
+def set_deadline(config: RunnableConfig, seconds: float = REQUEST_DEADLINE) -> dict:
+    """
+    Set the deadline of a request in the graph config, from which every node and tool reads it
+
+    Args:
+      config (RunnableConfig): Config passed to the graph.
+      seconds (float): Time limit of the request. 0: no limit.
+
+    Returns:
+      dict: config
+    """
+    if seconds > 0:
+        config.setdefault("configurable", {})["deadline"] = time.time() + seconds
+    return config
+
+
+def get_remaining(config: RunnableConfig):
+    """
+    Get the time remaining until the deadline of the request
+
+    Args:
+      config (RunnableConfig): Config of the node or tool.
+
+    Returns:
+      float or None: Remaining seconds (negative when passed), None if the request has no deadline
+    """
+    deadline = (config or {}).get("configurable", {}).get("deadline")
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def is_near_deadline(config: RunnableConfig) -> bool:
+    """
+    Check whether only the time kept for the final answer remains
+
+    Args:
+      config (RunnableConfig): Config of the node.
+
+    Returns:
+      bool: True if the research has to stop
+    """
+    remaining = get_remaining(config)
+    return remaining is not None and remaining <= DEADLINE_ANSWER_RESERVE
+
+
+def get_call_timeout(config: RunnableConfig, timeout: float = None, reserve: float = 0):
+    """
+    Get the time limit of a call: its own limit, shortened to the remaining budget of the request
+
+    Args:
+      config (RunnableConfig): Config of the node or tool.
+      timeout (float): Own time limit of the call. None: no own limit.
+      reserve (float): Time of the budget kept for later calls (e.g. DEADLINE_ANSWER_RESERVE for research).
+
+    Returns:
+      float or None: Time limit in seconds, None if there is no limit
+    """
+    remaining = get_remaining(config)
+    if remaining is None:
+        return timeout
+    budget = max(remaining - reserve, MIN_CALL_TIMEOUT)
+    return budget if timeout is None else min(timeout, budget)
+
+
+def set_tool_timeout(config: RunnableConfig, timeout: float) -> RunnableConfig:
+    """
+    Set the end of the time limit of a tool call in a copy of the config, so that the tool can pass the time left to its HTTP requests
+
+    Args:
+      config (RunnableConfig): Config of the node running the tool.
+      timeout (float): Time limit of the tool call in seconds.
+
+    Returns:
+      RunnableConfig: config of the tool call
+    """
+    configurable = {
+        **config.get("configurable", {}),
+        "tool_deadline": time.time() + timeout,
+    }
+    return {**config, "configurable": configurable}
+
+
+def get_tool_timeout(config: RunnableConfig):
+    """
+    Get the time left for the HTTP requests of a tool until the end of the time limit of the tool call
+
+    Args:
+      config (RunnableConfig): Config of the tool.
+
+    Returns:
+      float or None: Time limit in seconds (at least MIN_CALL_TIMEOUT), None if the tool call has no limit
+    """
+    tool_deadline = (config or {}).get("configurable", {}).get("tool_deadline")
+    if tool_deadline is None:
+        return None
+    return max(tool_deadline - time.time(), MIN_CALL_TIMEOUT)
+
+
+def bind_deadline(model, config: RunnableConfig):
+    """
+    Bind the remaining budget of the request as the timeout of the LLM request
+
+    Args:
+      model: Chat model (or a binding of it, e.g. with tools)
+      config (RunnableConfig): Config of the node or tool.
+
+    Returns:
+      Runnable: model with timeout, or the model itself if the request has no deadline
+    """
+    timeout = get_call_timeout(config)
+    if timeout is None:
+        return model
+    return model.bind(timeout=timeout)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """
+    NodeTimer
+    Callback handler measuring the time of each graph node of a request
+
+    The times are added to the metrics (node_duration_seconds histogram) and kept per request in seconds.
+    """
+
+    # Only reads the clock, so it runs in the event loop instead of a worker thread
+    run_inline = True
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self._started = {}
+        self.current_node = None
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        # The run of the node itself, not the runnables inside it (which may have the same name)
+        if node is None or kwargs.get("name") != node or parent_run_id in self._started:
+            return
+        self._started[run_id] = (node, time.perf_counter())
+        self.current_node = node
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        node, start = started
+        elapsed = time.perf_counter() - start
+        self.seconds[node] += elapsed
+        metrics.observe("node_duration_seconds", elapsed, node=node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def get_report(self) -> str:
+        """
+        Get the time of each node of the request, longest first
+
+        Returns:
+          str: One line per node
+        """
+        return "\n".join(
+            f"- {node}: {seconds:.1f}(s)"
+            for node, seconds in sorted(
+                self.seconds.items(), key=lambda item: item[1], reverse=True
+            )
+        )
+
+
+__all__ = [
+    "NodeTimer",
+    "bind_deadline",
+    "get_call_timeout",
+    "get_remaining",
+    "get_tool_timeout",
+    "is_near_deadline",
+    "set_deadline",
+    "set_tool_timeout",
+]
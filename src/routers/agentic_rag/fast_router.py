@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import yaml
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage
+
+from src.routers.agentic_rag.param_embedding import QUERY_PREFIX, get_embedding_model
+from src.routers.utils.agent_msg_manager import AgentMsgManager
+
+load_dotenv()
+
+agent_msg_mgr = AgentMsgManager()
+
+# Route obvious requests locally with the embedding model instead of calling the LLM in check_request (True: enabled, False: disabled)
+ENABLE_FAST_ROUTER = os.environ.get("ENABLE_FAST_ROUTER", "False")
+# Confidence (0-1) from which the request is routed locally. Below it, the LLM router decides.
+FAST_ROUTER_CONFIDENCE = float(os.environ.get("FAST_ROUTER_CONFIDENCE", 0.9))
+
+examples_file = "router_examples.yaml"
+
+
+class FastRouter:
+    """
+    FastRouter
+    Nearest-centroid classifier of user requests over the labeled examples of router_examples.yaml
+
+    The embedding model already loaded for the vector store is reused, so a decision costs one local embedding instead of an LLM call.
+    The embeddings run in a worker thread, so the event loop (and the other streams) is not blocked during the inference.
+    """
+
+    def __init__(
+        self, confidence: float = FAST_ROUTER_CONFIDENCE, temperature: float = 0.02
+    ):
+        """
+        Constructor of FastRouter class
+
+        Args:
+          confidence (float): Confidence from which the request is routed locally.
+          temperature (float): Temperature of the softmax turning the similarities to the centroids into a confidence.
+        """
+        self.confidence = confidence
+        self.temperature = temperature
+        self._labels = None
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def load_centroids(self):
+        """
+        Embeds the labeled examples and computes the centroid of each agent (only once, at startup when the fast router is enabled)
+        """
+        with self._lock:
+            if self._centroids is not None:
+                return
+            file_path = str(Path.cwd() / "src" / "routers" / "utils" / examples_file)
+            with open(file_path, "r", encoding="utf-8") as file:
+                examples = yaml.safe_load(file)
+            embeddings = get_embedding_model()
+            labels = []
+            centroids = []
+            for agent_name, texts in examples.items():
+                vectors = self._normalize(
+                    np.array(
+                        embeddings.embed_documents(
+                            [QUERY_PREFIX + text for text in texts]
+                        )
+                    )
+                )
+                labels.append(agent_name)
+                centroids.append(vectors.mean(axis=0))
+            self._labels = labels
+            self._centroids = self._normalize(np.array(centroids))
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Normalizes vectors to unit length (the last axis)
+        """
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def classify(self, request: str) -> tuple:
+        """
+        Classifies a user request
+
+        Args:
+          request (str): User question or request.
+
+        Returns:
+          tuple: (agent_name, confidence) of the closest centroid
+        """
+        if self._centroids is None:
+            self.load_centroids()
+        vector = self._normalize(
+            np.array(get_embedding_model().embed_query(QUERY_PREFIX + request))
+        )
+        similarities = self._centroids @ vector
+        weights = np.exp((similarities - similarities.max()) / self.temperature)
+        probabilities = weights / weights.sum()
+        best = int(np.argmax(probabilities))
+        return self._labels[best], float(probabilities[best])
+
+    async def route(self, request: str, messages: list):
+        """
+        Routes a request locally if the decision is obvious
+
+        Only the first request of a conversation is routed locally, because later requests may need to be rewritten with the conversation history (e.g. pronouns).
+
+        Args:
+          request (str): Latest user question or request.
+          messages (list): Messages of the state.
+
+        Returns:
+          tuple or None: (agent_name, confidence), None if the LLM router has to decide
+        """
+        if ENABLE_FAST_ROUTER.lower() != "true" or request is None:
+            return None
+        if sum(1 for msg in messages if isinstance(msg, HumanMessage)) > 1:
+            return None
+        agent_name, confidence = await asyncio.to_thread(self.classify, request)
+        if confidence < self.confidence:
+            return None
+        return agent_name, confidence
+
+    def get_router_json(self, request: str, agent_name: str, confidence: float) -> dict:
+        """
+        Creates the same output as the LLM router for a request routed locally
+
+        Args:
+          request (str): User question or request.
+          agent_name (str): Agent selected by the fast router.
+          confidence (float): Confidence of the selection.
+
+        Returns:
+          dict: agent_name, reason_sel, revised_request, revised_reason
+        """
+        if agent_name == "ask_human":
+            # ask_human asks the user the revised request, so it must be a question to the user
+            revised_request = agent_msg_mgr.get_msg("fast_router_ask_human")
+        else:
+            revised_request = request
+        return {
+            "agent_name": agent_name,
+            "reason_sel": agent_msg_mgr.get_msg(
+                "fast_router_reason", confidence=f"{confidence:.2f}"
+            ),
+            "revised_request": revised_request,
+            "revised_reason": agent_msg_mgr.get_msg("fast_router_revised_reason"),
+        }
+
+
+__all__ = ["FastRouter"]
@@ -0,0 +1,160 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Send a duplicate search request when the first one is slower than usual, and use the first response (True: enabled, False: disabled)
+ENABLE_HEDGED_SEARCH = os.environ.get("ENABLE_HEDGED_SEARCH", "False")
+# Percentile (0-1) of the latencies of the tool after which the duplicate request is sent
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 0.9))
+# Maximum share of calls that send a duplicate request (0-1), limiting the extra load on the search services
+HEDGE_MAX_EXTRA_RATIO = float(os.environ.get("HEDGE_MAX_EXTRA_RATIO", 0.1))
+# Number of latencies of the tool observed before duplicate requests are sent
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+
+
+class HedgePolicy:
+    """
+    HedgePolicy
+    Hedged requests for the search tools: when a call runs past the usual latency of the tool (e.g. p90),
+    a duplicate request is sent and the first successful response wins.
+
+    The latencies are observed per tool over a sliding window.
+    The requests run in worker threads; a request that lost the race finishes in the background and is still observed.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = ENABLE_HEDGED_SEARCH.lower() == "true",
+        percentile: float = HEDGE_PERCENTILE,
+        max_extra_ratio: float = HEDGE_MAX_EXTRA_RATIO,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        window: int = 200,
+    ):
+        """
+        Constructor of HedgePolicy class
+
+        Args:
+          enabled (bool): True to send duplicate requests. False calls the function directly.
+          percentile (float): Percentile of the observed latencies after which the duplicate request is sent.
+          max_extra_ratio (float): Maximum share of calls that send a duplicate request.
+          min_samples (int): Number of observed latencies required before duplicate requests are sent.
+          window (int): Number of latest latencies kept per tool.
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._calls = defaultdict(int)
+        self._hedges = defaultdict(int)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(thread_name_prefix="hedge")
+
+    def get_delay(self, name: str):
+        """
+        Get the time after which a duplicate request is sent
+
+        Args:
+          name (str): Name of the tool.
+
+        Returns:
+          float or None: Seconds, None if not enough latencies have been observed
+        """
+        with self._lock:
+            samples = sorted(self._latencies[name])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+
+    def _reserve_hedge(self, name: str) -> bool:
+        """
+        Count a duplicate request if the share of duplicate requests stays within max_extra_ratio
+        """
+        with self._lock:
+            if self._hedges[name] + 1 > self._calls[name] * self.max_extra_ratio:
+                return False
+            self._hedges[name] += 1
+            return True
+
+    def _submit(self, name: str, fn, args, kwargs):
+        """
+        Run the function in a worker thread (with the context of the caller, e.g. for tracing), observing its latency if it succeeds
+        """
+
+        def timed():
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            with self._lock:
+                self._latencies[name].append(time.perf_counter() - start)
+            return result
+
+        return self._executor.submit(contextvars.copy_context().run, timed)
+
+    def call(self, name: str, fn, *args, **kwargs):
+        """
+        Call a function (a search request), sending a duplicate request if it is slower than usual
+
+        Args:
+          name (str): Name of the tool, used to observe its latencies.
+          fn: Function sending the request. It must be safe to call twice.
+          *args, **kwargs: Arguments of the function.
+
+        Returns:
+          Result of the first successful request
+
+        Raises:
+          Exception: Error of the last request if every request failed
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        delay = self.get_delay(name)
+        with self._lock:
+            self._calls[name] += 1
+        primary = self._submit(name, fn, args, kwargs)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve_hedge(name):
+            return primary.result()
+        metrics.inc("hedged_requests_total", tool=name, result="fired")
+        hedge = self._submit(name, fn, args, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        metrics.inc("hedged_requests_total", tool=name, result="won")
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def get_stats(self, name: str) -> dict:
+        """
+        Get the number of calls and duplicate requests of a tool
+
+        Args:
+          name (str): Name of the tool.
+
+        Returns:
+          dict: calls, hedges
+        """
+        with self._lock:
+            return {"calls": self._calls[name], "hedges": self._hedges[name]}
+
+
+__all__ = ["HedgePolicy"]
@@ -0,0 +1,425 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    message_chunk_to_message,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Reuse the completion of an identical prompt instead of calling the LLM again (True: enabled, False: disabled)
+ENABLE_LLM_CACHE = os.environ.get("ENABLE_LLM_CACHE", "False")
+# Storage of the cached completions (memory: per process, sqlite: file shared by processes and restarts)
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+# SQLite file of the cache (LLM_CACHE_BACKEND=sqlite)
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+# Maximum number of cached completions. The least recently used completion is removed first.
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1024))
+# Lifetime of a cached completion (seconds, 0: no limit)
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 0))
+# Precision of the date and time in the prompts used for the key (none: as is, minute, hour, day)
+LLM_CACHE_TIME_GRANULARITY = os.environ.get("LLM_CACHE_TIME_GRANULARITY", "none")
+
+# Date and time written in the prompts (e.g. 2025-03-26 15:30:00)
+DATE_TIME = re.compile(r"(\d{4}-\d{2}-\d{2}) (\d{2}):(\d{2}):(\d{2})")
+TIME_GRANULARITY = {
+    "minute": r"\1 \2:\3",
+    "hour": r"\1 \2",
+    "day": r"\1",
+}
+# Number of characters of the chunks streamed when a cached completion is replayed
+REPLAY_CHUNK_CHARS = 16
+# Generation info of the completions answered from the cache
+CACHED_GENERATION_INFO = {"cached": True}
+
+
+class MemoryLlmCache:
+    """
+    MemoryLlmCache
+    In-process storage of the cached completions (LRU)
+    """
+
+    def __init__(
+        self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: int = LLM_CACHE_TTL
+    ):
+        """
+        Constructor of MemoryLlmCache class
+
+        Args:
+          max_entries (int): Maximum number of completions.
+          ttl (int): Lifetime of a completion (seconds, 0: no limit).
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Returns the cached completion (serialized message), None if not present
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if self.ttl and created + self.ttl <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        """
+        Stores a completion (serialized message)
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteLlmCache:
+    """
+    SqliteLlmCache
+    Storage of the cached completions in a SQLite file, kept across restarts (e.g. for load tests and regression runs)
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl: int = LLM_CACHE_TTL,
+    ):
+        """
+        Constructor of SqliteLlmCache class
+
+        Args:
+          path (str): Path of the SQLite file.
+          max_entries (int): Maximum number of completions.
+          ttl (int): Lifetime of a completion (seconds, 0: no limit).
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        """
+        Returns the cached completion (serialized message), None if not present
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and created + self.ttl <= now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET used = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        """
+        Stores a completion (serialized message)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key NOT IN "
+                "(SELECT key FROM llm_cache ORDER BY used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Get the storage of the cached completions selected by LLM_CACHE_BACKEND (created once)
+
+    Returns:
+      MemoryLlmCache or SqliteLlmCache: cache
+    """
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            if LLM_CACHE_BACKEND.lower() == "sqlite":
+                _llm_cache = SqliteLlmCache()
+            else:
+                _llm_cache = MemoryLlmCache()
+        return _llm_cache
+
+
+class CachedChatModel(BaseChatModel):
+    """
+    CachedChatModel
+    Chat model that answers identical prompts from a cache and calls the wrapped model otherwise
+
+    The key is a hash of the model settings, the call parameters (e.g. bound tools) and the messages.
+    A cached completion is replayed in chunks when the caller streams, so the tokens still reach the UI through the callbacks.
+    Cached generations are marked with generation_info={"cached": True}, so that they are not metered as calls of the model.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: BaseChatModel
+    response_cache: Any
+    time_granularity: str = LLM_CACHE_TIME_GRANULARITY
+
+    @property
+    def _llm_type(self) -> str:
+        return "cached-" + self.model._llm_type
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        # Model of the wrapped model in the metadata of the callbacks (e.g. to meter the tokens)
+        return self.model._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        """
+        Binds tools in the format of the wrapped model, so that the tools are part of the key and passed to the wrapped model
+        """
+        binding = self.model.bind_tools(tools, **kwargs)
+        return self.bind(**binding.kwargs)
+
+    def get_key(
+        self, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs
+    ) -> str:
+        """
+        Creates the key of a call
+
+        Args:
+          messages (list): Messages sent to the model.
+          stop (list): Stop words.
+          **kwargs: Call parameters (e.g. tools).
+
+        Returns:
+          str: SHA-256 of the canonical JSON of the model settings, the parameters and the messages
+        """
+        # The time limit of the request does not change the completion
+        kwargs.pop("timeout", None)
+        llm_string = self.model._get_llm_string(stop=stop, **kwargs)
+        messages_json = json.dumps(
+            [message_to_dict(message) for message in messages],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        replacement = TIME_GRANULARITY.get(self.time_granularity.lower())
+        if replacement is not None:
+            messages_json = DATE_TIME.sub(replacement, messages_json)
+        return hashlib.sha256(
+            (llm_string + "\n" + messages_json).encode("utf-8")
+        ).hexdigest()
+
+    def _lookup(self, key: str):
+        value = self.response_cache.get(key)
+        if value is None:
+            metrics.inc("llm_cache_total", result="miss")
+            return None
+        metrics.inc("llm_cache_total", result="hit")
+        message = messages_from_dict([json.loads(value)])[0]
+        # No tokens were used by this call
+        message.usage_metadata = None
+        return message
+
+    def _update(self, key: str, message: BaseMessage):
+        message = AIMessage(
+            content=message.content,
+            tool_calls=getattr(message, "tool_calls", []),
+            additional_kwargs=message.additional_kwargs,
+        )
+        self.response_cache.set(key, json.dumps(message_to_dict(message)))
+
+    def _replay_chunks(self, message: AIMessage) -> list:
+        """
+        Splits a cached completion into chunks as if it were streamed by the model
+        """
+        content = message.content if isinstance(message.content, str) else ""
+        chunks = [
+            ChatGenerationChunk(
+                message=AIMessageChunk(content=content[i : i + REPLAY_CHUNK_CHARS]),
+                generation_info=CACHED_GENERATION_INFO,
+            )
+            for i in range(0, len(content), REPLAY_CHUNK_CHARS)
+        ]
+        if message.tool_calls:
+            tool_call_chunks = [
+                {
+                    "name": tool_call["name"],
+                    "args": json.dumps(tool_call["args"], ensure_ascii=False),
+                    "id": tool_call["id"],
+                    "index": index,
+                }
+                for index, tool_call in enumerate(message.tool_calls)
+            ]
+            chunks.append(
+                ChatGenerationChunk(
+                    message=AIMessageChunk(
+                        content="", tool_call_chunks=tool_call_chunks
+                    ),
+                    generation_info=CACHED_GENERATION_INFO,
+                )
+            )
+        return chunks or [
+            ChatGenerationChunk(
+                message=AIMessageChunk(content=""),
+                generation_info=CACHED_GENERATION_INFO,
+            )
+        ]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self.get_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            if run_manager:
+                # The chunks and the message share the id, so that the message is not streamed twice
+                cached.id = f"run-{run_manager.run_id}"
+                for chunk in self._replay_chunks(cached):
+                    chunk.message.id = cached.id
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            return ChatResult(
+                generations=[
+                    ChatGeneration(
+                        message=cached, generation_info=CACHED_GENERATION_INFO
+                    )
+                ]
+            )
+        result = self.model._generate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+        self._update(key, result.generations[0].message)
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self.get_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            if run_manager:
+                # The chunks and the message share the id, so that the message is not streamed twice
+                cached.id = f"run-{run_manager.run_id}"
+                for chunk in self._replay_chunks(cached):
+                    chunk.message.id = cached.id
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            return ChatResult(
+                generations=[
+                    ChatGeneration(
+                        message=cached, generation_info=CACHED_GENERATION_INFO
+                    )
+                ]
+            )
+        result = await self.model._agenerate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+        self._update(key, result.generations[0].message)
+        return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        key = self.get_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            for chunk in self._replay_chunks(cached):
+                # Same as the chat models of LangChain: only notify the tokens when a run manager is passed
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+            return
+        final = None
+        for chunk in self.model._stream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            final = chunk if final is None else final + chunk
+            yield chunk
+        # Only completed streams are cached
+        if final is not None:
+            self._update(key, message_chunk_to_message(final.message))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        key = self.get_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            for chunk in self._replay_chunks(cached):
+                # Same as the chat models of LangChain: only notify the tokens when a run manager is passed
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+            return
+        final = None
+        async for chunk in self.model._astream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            final = chunk if final is None else final + chunk
+            yield chunk
+        # Only completed streams are cached
+        if final is not None:
+            self._update(key, message_chunk_to_message(final.message))
+
+
+__all__ = ["CachedChatModel", "get_llm_cache"]
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Requests per minute sent to Azure OpenAI by this process (0: no limit)
+LLM_RPM_LIMIT = int(os.environ.get("LLM_RPM_LIMIT", 0))
+# Tokens per minute sent to Azure OpenAI by this process, prompt and max_tokens as estimated by Azure (0: no limit)
+LLM_TPM_LIMIT = int(os.environ.get("LLM_TPM_LIMIT", 0))
+# Approximate number of characters per token, used to estimate the tokens of a prompt
+CHARS_PER_TOKEN = 4
+
+
+class TokenBucket:
+    """
+    TokenBucket
+    Budget refilled continuously up to its capacity (e.g. 60 requests per minute is one request per second, with bursts of 60)
+
+    A call reserves its cost at once and waits until the budget covers it, so the calls are served in order.
+    The budget can go below zero; the following calls wait until it is refilled.
+    """
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        """
+        Constructor of TokenBucket class
+
+        Args:
+          per_minute (float): Capacity and refill of the budget per minute.
+          clock: Function returning the current time in seconds.
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.clock = clock
+        self._level = per_minute
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float) -> float:
+        """
+        Reserve the cost of a call
+
+        Args:
+          cost (float): Cost of the call. A cost above the capacity is counted as the capacity.
+
+        Returns:
+          float: Seconds to wait before the call
+        """
+        with self._lock:
+            now = self.clock()
+            self._level = min(
+                self.capacity, self._level + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._level -= min(cost, self.capacity)
+            return max(0.0, -self._level / self.rate)
+
+    def refund(self, cost: float):
+        """
+        Give back the cost of a call that was not sent (e.g. cancelled while waiting)
+
+        Args:
+          cost (float): Cost reserved by the call.
+        """
+        with self._lock:
+            self._level = min(self.capacity, self._level + min(cost, self.capacity))
+
+
+class LlmLimiter:
+    """
+    LlmLimiter
+    Limits the requests and tokens per minute sent to Azure OpenAI by all the nodes of the process
+
+    Without it, a burst of requests hits the limits of the deployment at once and every call is retried after a 429.
+    With it, the calls over the budget wait in order before they are sent.
+    """
+
+    def __init__(self, rpm: int = LLM_RPM_LIMIT, tpm: int = LLM_TPM_LIMIT):
+        """
+        Constructor of LlmLimiter class
+
+        Args:
+          rpm (int): Requests per minute (0: no limit).
+          tpm (int): Tokens per minute (0: no limit).
+        """
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.waiting = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _reserve(self, tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def _refund(self, tokens: int):
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(tokens)
+
+    def _record_wait(self, delay: float):
+        metrics.inc("llm_limiter_calls_total", waited=str(delay > 0).lower())
+        metrics.inc("llm_limiter_wait_seconds_total", delay)
+
+    def acquire(self, tokens: int):
+        """
+        Wait until the budget covers a call (synchronous calls)
+
+        Args:
+          tokens (int): Estimated tokens of the call.
+        """
+        delay = self._reserve(tokens)
+        self._record_wait(delay)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: int):
+        """
+        Wait until the budget covers a call (asynchronous calls)
+
+        Args:
+          tokens (int): Estimated tokens of the call.
+        """
+        delay = self._reserve(tokens)
+        self._record_wait(delay)
+        if delay <= 0:
+            return
+        self.waiting += 1
+        metrics.set("llm_limiter_waiting", self.waiting)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # The call is not sent
+            self._refund(tokens)
+            raise
+        finally:
+            self.waiting -= 1
+            metrics.set("llm_limiter_waiting", self.waiting)
+
+
+_llm_limiter = None
+_llm_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter() -> LlmLimiter:
+    """
+    Get the limiter shared by all the models of the process (created once)
+
+    Returns:
+      LlmLimiter: limiter
+    """
+    global _llm_limiter
+    with _llm_limiter_lock:
+        if _llm_limiter is None:
+            _llm_limiter = LlmLimiter()
+        return _llm_limiter
+
+
+def estimate_tokens(messages: List[BaseMessage], max_tokens: int = None) -> int:
+    """
+    Estimate the tokens counted against the tokens per minute of a call, as Azure OpenAI does: the prompt and max_tokens
+
+    Args:
+      messages (list): Messages sent to the model.
+      max_tokens (int): Maximum tokens of the completion.
+
+    Returns:
+      int: Estimated tokens
+    """
+    chars = sum(
+        len(message.content if isinstance(message.content, str) else str(message))
+        for message in messages
+    )
+    return chars // CHARS_PER_TOKEN + (max_tokens or 0)
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """
+    RateLimitedChatModel
+    Chat model that waits for the budget of the limiter before calling the wrapped model
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: BaseChatModel
+    limiter: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    def _get_llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        # Same settings as the wrapped model (e.g. for the key of the LLM cache)
+        return self.model._get_llm_string(stop=stop, **kwargs)
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        # Model of the wrapped model in the metadata of the callbacks (e.g. to meter the tokens)
+        return self.model._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        """
+        Binds tools in the format of the wrapped model
+        """
+        binding = self.model.bind_tools(tools, **kwargs)
+        return self.bind(**binding.kwargs)
+
+    def _estimate(self, messages: List[BaseMessage], **kwargs: Any) -> int:
+        return estimate_tokens(
+            messages, kwargs.get("max_tokens", getattr(self.model, "max_tokens", None))
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.limiter.acquire(self._estimate(messages, **kwargs))
+        return self.model._generate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await self.limiter.aacquire(self._estimate(messages, **kwargs))
+        return await self.model._agenerate(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        self.limiter.acquire(self._estimate(messages, **kwargs))
+        yield from self.model._stream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await self.limiter.aacquire(self._estimate(messages, **kwargs))
+        async for chunk in self.model._astream(
+            messages, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            yield chunk
+
+
+__all__ = ["LlmLimiter", "RateLimitedChatModel", "TokenBucket", "get_llm_limiter"]
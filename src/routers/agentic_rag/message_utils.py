@@ -113,19 +113,16 @@ class MsgUtils:
             return ", ".join(f"'{name}'" for name in unique_names)
         return False
 
-    def get_history(self, messages):
+    def _get_turn_start_index(self, messages):
         """
-        Get conversation history
-
-        (Trace backwards from the most recent message until "type": "start_turn" is found, and extract the ToolMessage and the AIMessage immediately preceding it (with "type" set to "plan_exec"))
+        Gets the index of the most recent AIMessage with "type": "start_turn"
 
         Parameters:
           messages (list): List of message objects
 
         Returns:
-          str: Extracted conversation history, sorted by oldest
+          int: Index of the start of the current turn, 0 if not present
         """
-        start_index = None
         for i in range(len(messages) - 1, -1, -1):
             msg = messages[i]
             if type(msg).__name__ == "AIMessage":
@@ -134,14 +131,63 @@ class MsgUtils:
                 except json.JSONDecodeError:
                     data = {}
                 if data.get("type") == "start_turn":
-                    start_index = i
-                    break
-        if start_index is None:
-            start_index = 0
-        conv_history = messages[start_index:]
+                    return i
+        return 0
+
+    def get_turn_tool_msgs(self, messages):
+        """
+        Gets the text content of the ToolMessages of the current turn (starting from "type": "start_turn")
+
+        Parameters:
+          messages (list): List of message objects
+
+        Returns:
+          list: Text of the ToolMessages, sorted by oldest
+        """
+        return [
+            msg.content
+            for msg in messages[self._get_turn_start_index(messages) :]
+            if isinstance(msg, ToolMessage) and isinstance(msg.content, str)
+        ]
+
+    def get_step_tool_msgs(self, messages):
+        """
+        Gets the ToolMessages of the latest plan (after the most recent AIMessage with tool calls)
+
+        Parameters:
+          messages (list): List of message objects
+
+        Returns:
+          list: ToolMessages of the latest plan, sorted by oldest
+        """
+        tool_msgs = []
+        for msg in reversed(messages):
+            if isinstance(msg, ToolMessage):
+                tool_msgs.append(msg)
+            elif isinstance(msg, AIMessage) and msg.tool_calls:
+                break
+        return tool_msgs[::-1]
+
+    def get_history(self, messages):
+        """
+        Get conversation history
+
+        (Trace backwards from the most recent message until "type": "start_turn" is found, and extract the ToolMessage and the AIMessage immediately preceding it (with "type" set to "plan_exec"))
+        Consecutive ToolMessages (several tools called by one plan) are merged into one record.
+
+        Parameters:
+          messages (list): List of message objects
+
+        Returns:
+          str: Extracted conversation history, sorted by oldest
+        """
+        conv_history = messages[self._get_turn_start_index(messages) :]
         result_lines = []
         for idx, msg in enumerate(conv_history):
             if type(msg).__name__ == "ToolMessage":
+                if idx > 0 and type(conv_history[idx - 1]).__name__ == "ToolMessage":
+                    result_lines[-1] += "\n" + msg.content
+                    continue
                 plan_exec_value = ""
                 for j in range(idx - 1, -1, -1):
                     prev_msg = conv_history[j]
@@ -0,0 +1,26 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from langchain_huggingface import HuggingFaceEmbeddings
+
+load_dotenv()
+
+# Prefix of the queries of the E5 embedding models (used for the texts compared with each other, not for the vector store)
+QUERY_PREFIX = "query: "
+
+
+@lru_cache(maxsize=1)
+def get_embedding_model():
+    """
+    Get the embedding model
+
+    The model is loaded once and shared by the vector store and the other users of embeddings (e.g. the fast router).
+
+    Returns:
+      HuggingFaceEmbeddings: embeddings
+    """
+    # Get the model name set in the environment variable
+    HUG_EMBE_MODEL_NAME = os.getenv("HUG_EMBE_MODEL_NAME")
+    embeddings = HuggingFaceEmbeddings(model_name=HUG_EMBE_MODEL_NAME)
+    return embeddings
@@ -1,33 +1,118 @@
 import os
+from functools import lru_cache
+from pathlib import Path
 
+import yaml
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
 
+from src.routers.agentic_rag.llm_cache import (
+    ENABLE_LLM_CACHE,
+    CachedChatModel,
+    get_llm_cache,
+)
+from src.routers.agentic_rag.llm_limiter import RateLimitedChatModel, get_llm_limiter
+
 load_dotenv()
 
+# Profile of model_tiers.yaml that selects the model of each node (large, tiered, small)
+MODEL_TIER_PROFILE = os.environ.get("MODEL_TIER_PROFILE", "large")
+
+tiers_file = "model_tiers.yaml"
 
-def get_gpt_model():
+
+@lru_cache(maxsize=1)
+def load_model_tiers() -> dict:
     """
-    Get the GPT model
+    Load the model tiers of model_tiers.yaml (only once)
 
     Returns:
-      AzureChatOpenAI: model
+      dict: tiers and profiles
     """
+    file_path = str(Path.cwd() / "src" / "routers" / "utils" / tiers_file)
+    with open(file_path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def get_model_settings(node: str = None) -> dict:
+    """
+    Get the model settings of a node
+
+    Args:
+      node (str): Name of the graph node (or tool). None: default of the profile.
+
+    Returns:
+      dict: deployment, max_tokens, timeout, temperature
+    """
+    model_tiers = load_model_tiers()
+    profile = model_tiers["profiles"][MODEL_TIER_PROFILE]
+    tier = model_tiers["tiers"][profile.get(node, profile["default"])]
     # Get the deployment name set in the environment variable
-    CHAT_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_CHATGPT_DEPLOYMENT_NAME")
+    deployment = os.getenv(tier["deployment_env"]) or os.getenv(
+        "AZURE_OPENAI_CHATGPT_DEPLOYMENT_NAME"
+    )
+    return {
+        "deployment": deployment,
+        "max_tokens": tier["max_tokens"],
+        "timeout": tier["timeout"],
+        "temperature": tier["temperature"],
+    }
+
+
+@lru_cache(maxsize=1)
+def get_token_prices() -> dict:
+    """
+    Get the token prices of the deployments of the tiers
+
+    Returns:
+      dict: deployment: (price per 1M prompt tokens, price per 1M completion tokens) in USD
+    """
+    prices = {}
+    for tier in load_model_tiers()["tiers"].values():
+        deployment = os.getenv(tier["deployment_env"]) or os.getenv(
+            "AZURE_OPENAI_CHATGPT_DEPLOYMENT_NAME"
+        )
+        prices.setdefault(
+            deployment, (tier.get("input_price", 0), tier.get("output_price", 0))
+        )
+    return prices
+
+
+@lru_cache(maxsize=None)
+def get_gpt_model(node: str = None):
+    """
+    Get the GPT model of a node
+
+    The deployment, max_tokens, timeout and temperature of each node are set in model_tiers.yaml, so that short decisions can use a faster model.
+    The model is created once per node and shared by the following calls.
+    When LLM_RPM_LIMIT or LLM_TPM_LIMIT is set, the model waits for the budget shared by all the nodes before each request.
+    When the LLM cache is enabled, the model is wrapped so that identical prompts are answered from the cache (without using the budget).
+
+    Args:
+      node (str): Name of the graph node (or tool). None: default of the profile.
+
+    Returns:
+      AzureChatOpenAI, RateLimitedChatModel or CachedChatModel: model
+    """
+    settings = get_model_settings(node)
     AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
     OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
     OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION")
 
     model = AzureChatOpenAI(
-        deployment_name=CHAT_DEPLOYMENT_NAME,
+        deployment_name=settings["deployment"],
         azure_endpoint=AZURE_OPENAI_ENDPOINT,
         openai_api_key=OPENAI_API_KEY,
         openai_api_version=OPENAI_API_VERSION,
-        request_timeout=300,
-        temperature=0,
+        request_timeout=settings["timeout"],
+        temperature=settings["temperature"],
         logprobs=None,
-        max_tokens=16384,
+        max_tokens=settings["max_tokens"],
         streaming=True,
     )
+    limiter = get_llm_limiter()
+    if limiter.enabled:
+        model = RateLimitedChatModel(model=model, limiter=limiter)
+    if ENABLE_LLM_CACHE.lower() == "true":
+        model = CachedChatModel(model=model, response_cache=get_llm_cache())
     return model
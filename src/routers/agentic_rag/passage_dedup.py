@@ -0,0 +1,182 @@
+import heapq
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from src.routers.utils.agent_msg_manager import AgentMsgManager
+
+load_dotenv()
+
+agent_msg_mgr = AgentMsgManager()
+
+# Remove search passages that are (nearly) identical to one already retrieved in the current turn (True: enabled, False: disabled)
+ENABLE_SEARCH_DEDUP = os.environ.get("ENABLE_SEARCH_DEDUP", "False")
+# Estimated Jaccard similarity from which two passages are treated as duplicates
+SEARCH_DEDUP_THRESHOLD = float(os.environ.get("SEARCH_DEDUP_THRESHOLD", 0.85))
+
+# Passages are separated by "## Title: " headings in the results of the search tools
+PASSAGE_HEAD = re.compile(r"^## Title: ?(.*)$", re.MULTILINE)
+# Heading lines (title, URL) are not part of the fingerprint, so mirrored articles with different titles still match
+HEADING_LINE = re.compile(r"^#.*$", re.MULTILINE)
+SPACES = re.compile(r"\s+")
+# Note written instead of an omitted passage (in the language of the agent messages)
+REFERENCE_NOTE = agent_msg_mgr.get_msg("search_dedup_reference")
+REFERENCE_LINE = re.compile(
+    "^" + re.escape(REFERENCE_NOTE).replace(re.escape("{title}"), ".*") + "$",
+    re.MULTILINE,
+)
+
+
+class PassageDeduper:
+    """
+    PassageDeduper
+    Detects near-duplicate search passages with MinHash fingerprints (bottom-k sketch of character shingles)
+
+    Character shingles are used instead of word shingles so that Japanese text without spaces is handled the same way as English.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEARCH_DEDUP_THRESHOLD,
+        shingle_size: int = 5,
+        sketch_size: int = 128,
+        min_length: int = 100,
+    ):
+        """
+        Constructor of PassageDeduper class
+
+        Args:
+          threshold (float): Estimated Jaccard similarity from which two passages are duplicates.
+          shingle_size (int): Number of characters of a shingle.
+          sketch_size (int): Number of minimum hashes kept in a fingerprint.
+          min_length (int): Passages shorter than this (after normalization) are always kept.
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.sketch_size = sketch_size
+        self.min_length = min_length
+        self.fingerprint = lru_cache(maxsize=512)(self._fingerprint)
+
+    def _fingerprint(self, text: str) -> frozenset:
+        """
+        Creates the MinHash fingerprint of a passage
+
+        Args:
+          text (str): Passage including its "## Title:" heading.
+
+        Returns:
+          frozenset: The smallest hashes of the shingles of the passage. Empty if the passage is too short to compare.
+        """
+        body = HEADING_LINE.sub("", text)
+        body = SPACES.sub(" ", unicodedata.normalize("NFKC", body)).strip().casefold()
+        if len(body) < self.min_length:
+            return frozenset()
+        size = self.shingle_size
+        hashes = {hash(body[i : i + size]) for i in range(len(body) - size + 1)}
+        return frozenset(heapq.nsmallest(self.sketch_size, hashes))
+
+    def similarity(self, fp_a: frozenset, fp_b: frozenset) -> float:
+        """
+        Estimates the Jaccard similarity of two passages from their fingerprints
+
+        Args:
+          fp_a (frozenset): Fingerprint of the first passage.
+          fp_b (frozenset): Fingerprint of the second passage.
+
+        Returns:
+          float: Estimated similarity between 0 and 1.
+        """
+        if not fp_a or not fp_b:
+            return 0.0
+        union_sketch = heapq.nsmallest(self.sketch_size, fp_a | fp_b)
+        both = sum(1 for h in union_sketch if h in fp_a and h in fp_b)
+        return both / len(union_sketch)
+
+    def split_passages(self, text: str) -> list:
+        """
+        Splits a search result into passages, each starting with its "## Title:" heading
+
+        Args:
+          text (str): Search result (content of a ToolMessage).
+
+        Returns:
+          list: Passages. Text before the first heading is ignored.
+        """
+        starts = [m.start() for m in PASSAGE_HEAD.finditer(text)]
+        return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+
+    def dedup(self, passages: list, seen_results: list) -> tuple:
+        """
+        Replaces passages that duplicate a passage already retrieved (or an earlier passage of the same list) by a short reference
+
+        Args:
+          passages (list): New passages, each starting with its "## Title:" heading.
+          seen_results (list): Search results already in the current turn (contents of ToolMessages).
+
+        Returns:
+          tuple: (kept passages, number of passages replaced, number of characters saved)
+        """
+        seen = [
+            (fp, self._get_title(passage))
+            for result in seen_results
+            for passage in self.split_passages(result)
+            if (fp := self.fingerprint(passage))
+        ]
+        kept = []
+        num_removed = 0
+        saved_chars = 0
+        for passage in passages:
+            fp = self.fingerprint(passage)
+            dup_title = next(
+                (
+                    title
+                    for seen_fp, title in seen
+                    if self.similarity(fp, seen_fp) >= self.threshold
+                ),
+                None,
+            )
+            if dup_title is None:
+                kept.append(passage)
+                if fp:
+                    seen.append((fp, self._get_title(passage)))
+                continue
+            note = agent_msg_mgr.get_msg("search_dedup_reference", title=dup_title)
+            reference = f"## Title: {self._get_title(passage)}\n{note}\n\n"
+            if len(reference) >= len(passage):
+                kept.append(passage)
+                continue
+            kept.append(reference)
+            num_removed += 1
+            saved_chars += len(passage) - len(reference)
+        return kept, num_removed, saved_chars
+
+    def has_references(self, text: str) -> bool:
+        """
+        Checks whether a search result contains passages omitted by dedup
+
+        Args:
+          text (str): Search result (content of a ToolMessage).
+
+        Returns:
+          bool: True if some passages only refer to another search result.
+        """
+        return REFERENCE_LINE.search(text) is not None
+
+    def _get_title(self, passage: str) -> str:
+        """
+        Gets the title of a passage
+
+        Args:
+          passage (str): Passage starting with its "## Title:" heading.
+
+        Returns:
+          str: Title of the passage.
+        """
+        match = PASSAGE_HEAD.search(passage)
+        return match.group(1).strip() if match else ""
+
+
+__all__ = ["PassageDeduper"]
@@ -1,18 +1,21 @@
 import datetime
 
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import InjectedState
 from langgraph.types import Command, StreamWriter
 from typing_extensions import Annotated
 
+from src.routers.agentic_rag.answer_cache import AnswerCache
+from src.routers.agentic_rag.deadline import bind_deadline
+from src.routers.agentic_rag.fast_router import FastRouter
 from src.routers.agentic_rag.message_utils import MsgUtils
 from src.routers.agentic_rag.param_llm import get_gpt_model
 from src.routers.agentic_rag.state import State
 from src.routers.utils.agent_msg_manager import AgentMsgManager
 from src.routers.utils.log_dev import LogDev
+from src.routers.utils.metrics import Metrics
 from src.routers.utils.prompt_manager import PromptManager
 
 agent_msg_mgr = AgentMsgManager()
@@ -20,9 +23,11 @@ agent_msg_mgr = AgentMsgManager()
 log = LogDev()
 load_dotenv()
 
-model = get_gpt_model()
 prompt_mgr = PromptManager()
 msg_util = MsgUtils()
+fast_router = FastRouter()
+answer_cache = AnswerCache()
+metrics = Metrics()
 
 
 class RouterAgent:
@@ -34,7 +39,7 @@ class RouterAgent:
     def __init__(self):
         pass
 
-    def check_request(
+    async def check_request(
         self,
         state: Annotated[State, InjectedState],
         config: RunnableConfig,
@@ -53,24 +58,14 @@ class RouterAgent:
         log.print("\n<<Start: route_query>>")
         messages = state["messages"]
         request = msg_util.get_latest_human_msg(messages)
-        # Prompt
-        prompt_template = prompt_mgr.get_prompt("check_request")
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["request", "msg_history", "date_time"],
-        )
-        msg_history = msg_util.get_pure_msg(messages)
-        # Get the current date and time
-        now = datetime.datetime.now()
-        # Specify the date and time format (e.g. 2025-03-26 15:30:00)
-        date_time = now.strftime("%Y-%m-%d %H:%M:%S")
-        input_data = {
-            "request": request,
-            "msg_history": msg_history,
-            "date_time": date_time,
-        }
-        chain = prompt | model | JsonOutputParser()
-        router_json = chain.invoke(input_data, config=config)
+        # Obvious requests are routed locally without calling the LLM
+        fast_route = await fast_router.route(request, messages)
+        if fast_route is not None:
+            router_json = fast_router.get_router_json(request, *fast_route)
+            metrics.inc("router_decisions_total", path="fast")
+        else:
+            router_json = await self._check_request_llm(request, messages, config)
+            metrics.inc("router_decisions_total", path="llm")
         rev_request = router_json["revised_request"]
         # Show logs
         msg = agent_msg_mgr.get_msg(
@@ -94,4 +89,47 @@ class RouterAgent:
             msg = "Error: No AI Agent to execute."
             print(msg)
             raise ValueError(msg)
+        # The same question was already answered: Answer from the cache
+        if goto != "ask_human" and answer_cache.is_cacheable(messages):
+            cached_answer = await answer_cache.lookup(
+                rev_request, router_json["agent_name"]
+            )
+            if cached_answer is not None:
+                metrics.inc("answer_cache_total", result="hit")
+                return Command(
+                    update={"rev_request": rev_request, "cached_answer": cached_answer},
+                    goto="ans_cache",
+                )
+            metrics.inc("answer_cache_total", result="miss")
         return Command(update={"rev_request": rev_request}, goto=goto)
+
+    async def _check_request_llm(
+        self, request: str, messages: list, config: RunnableConfig
+    ) -> dict:
+        """
+        Decide which Agent to call with the LLM
+
+        Args:
+          request: Latest user question or request
+          messages: Messages of the state
+          config: RunnableConfig
+
+        Returns:
+          dict: agent_name, reason_sel, revised_request, revised_reason
+        """
+        # Prompt
+        prompt = prompt_mgr.get_chat_prompt("check_request")
+        msg_history = msg_util.get_pure_msg(messages)
+        # Get the current date and time
+        now = datetime.datetime.now()
+        # Specify the date and time format (e.g. 2025-03-26 15:30:00)
+        date_time = now.strftime("%Y-%m-%d %H:%M:%S")
+        input_data = {
+            "request": request,
+            "msg_history": msg_history,
+            "date_time": date_time,
+        }
+        model = bind_deadline(get_gpt_model("check_request"), config)
+        chain = prompt | model | JsonOutputParser()
+        router_json = await chain.ainvoke(input_data, config=config)
+        return router_json
@@ -1,9 +1,38 @@
+import re
+import sys
 import unicodedata
 
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Mojibake can only come from characters in U+0080-U+00FF (they are the ones that survive the latin1 round trip as non-ASCII bytes).
+# Text without them is returned untouched by repair_enc_univ.
+SUSPECT_CHARS = re.compile("[\u0080-\u00ff]")
+# Characters counted as Japanese when scoring repair candidates (same range as the original scoring loop)
+JP_CHARS = re.compile("[\u3001-\u30fe]")
+
+
+def build_char_width_table() -> np.ndarray:
+    """
+    Builds the width of every code point: 2 if full-width ('F', 'W', 'A' in unicodedata.east_asian_width), otherwise 1
+
+    The table is computed from the unicodedata of the running Python, so it always agrees with east_asian_width.
+
+    Returns:
+      np.ndarray: Widths indexed by code point.
+    """
+    widths = bytes(
+        2 if unicodedata.east_asian_width(chr(code)) in "FWA" else 1
+        for code in range(sys.maxunicode + 1)
+    )
+    return np.frombuffer(widths, dtype=np.uint8)
+
+
+# Width of every code point, built when the module is imported at startup instead of on the first request
+CHAR_WIDTHS = build_char_width_table()
+
 
 class SearchError(Exception):
     """Exception thrown when an unknown error occurs during search processing"""
@@ -26,6 +55,7 @@ class SearchAnswerEngine:
     def truncate_text(self, text: str, max_length: int = 10000) -> str:
         """
         The specified text is truncated if the total number of characters exceeds the specified maximum length, counting full-width characters as 2 and half-width characters as 1.
+        ASCII text is sliced directly. Other text is measured at once with a precomputed table of character widths.
 
         Args:
           text (str): The string to be processed.
@@ -34,27 +64,41 @@ class SearchAnswerEngine:
         Returns:
           str: The string truncated to fit within the specified maximum length.
         """
+        if max_length < 1:
+            return ""
+        # Every character is half-width: the width equals the length
+        if text.isascii():
+            return text[:max_length]
+        # Even if every character were full-width, the text would fit
+        if len(text) * 2 <= max_length:
+            return text
+        # Each character is at least 1 wide, so no more than max_length characters can be kept
+        head = text[:max_length]
+        code_points = np.frombuffer(
+            head.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32
+        )
+        cum_widths = np.cumsum(CHAR_WIDTHS[code_points], dtype=np.int64)
+        # Number of leading characters whose total width does not exceed max_length
+        end = int(np.searchsorted(cum_widths, max_length, side="right"))
+        return head[:end]
+
+    def is_suspected_mojibake(self, text: str) -> bool:
+        """
+        Cheaply checks whether the text may be garbled and needs repair_enc_univ
 
-        def char_width(char):
-            """
-            Calculates the width of a character. If the character is full-width ('F', 'W', 'A'), use 2; otherwise use 1.
-
-            Args:
-              char (str): One character to calculate the width.
+        Every repair candidate is made from the latin1 bytes of the text. When the text has no characters in U+0080-U+00FF,
+        those bytes are pure ASCII, no candidate can contain Japanese characters and the original text is always kept.
+        So clean ASCII and well-formed Japanese text are recognized without building any candidates.
 
-            Returns:
-              int: Character width. If the character is full-width, use 2; otherwise use 1.
-            """
-            return 2 if unicodedata.east_asian_width(char) in "FWA" else 1
+        Args:
+          text (str): input text.
 
-        current_length = 0
-        result = []
-        for char in text:
-            current_length += char_width(char)
-            if current_length > max_length:
-                break
-            result.append(char)
-        return "".join(result)
+        Returns:
+          bool: True if the text may be mojibake, False if it is well-formed.
+        """
+        if not isinstance(text, str) or text.isascii():
+            return False
+        return SUSPECT_CHARS.search(text) is not None
 
     def repair_enc_univ(self, text) -> str:
         """
@@ -62,6 +106,7 @@ class SearchAnswerEngine:
         Fix garbled characters in Tavily search results
         Attempts multiple encoding conversions and returns the most Japanese-like results
         No specific mapping table is used, just a general purpose
+        Well-formed text (see is_suspected_mojibake) is returned as is without trying any conversion.
 
         Args:
           text (str): input text.
@@ -69,8 +114,10 @@ class SearchAnswerEngine:
         Returns:
           text: Fixed text.
         """
-        candidates = []
         original = text
+        if not self.is_suspected_mojibake(text):
+            return original
+        candidates = []
         # Possible intermediate encodings
         intermediate_encodings = ["latin1", "iso-8859-1"]
         # Possible original encodings
@@ -107,13 +154,14 @@ class SearchAnswerEngine:
                 continue
 
         # Evaluation of results (scoring Japanese-style)
+        # Identical candidates get identical scores, so only the first occurrence is scored (the first best one wins as before).
         best_score = -1
         best_text = original
-        for candidate in candidates:
+        for candidate in dict.fromkeys(candidates):
             # The fewer replacement characters the better
             replacement_chars = candidate.count("�") + candidate.count("?")
-            # The more Japanese characters the better
-            jp_chars = sum(1 for c in candidate if ord(c) > 0x3000 and ord(c) < 0x30FF)
+            # The more Japanese characters the better (counted by the regex engine instead of a Python loop)
+            jp_chars = len(JP_CHARS.findall(candidate))
             # # Score calculation (the more Japanese characters and the fewer replacement characters, the higher the score)
             score = jp_chars * 2 - replacement_chars * 3
             if score > best_score:
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.constants import TAG_NOSTREAM
+
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Start creating the final answer while judge_replan is deciding, and use it if no replan is needed (True: enabled, False: disabled)
+ENABLE_SPECULATIVE_ANSWER = os.environ.get("ENABLE_SPECULATIVE_ANSWER", "False")
+
+
+class SpeculativeAnswer:
+    """
+    SpeculativeAnswer
+    Generates the final answer in the background and buffers its tokens until the answer is known to be needed
+
+    The tokens are kept in a queue, so the consumer first receives the buffered tokens and then the ones still being generated.
+    The generation is attributed to the node that uses the answer (tokens, cost and spans), not to the node that started it.
+    """
+
+    def __init__(
+        self,
+        chain,
+        input_data: dict,
+        config: RunnableConfig,
+        node: str = "create_final_answer",
+    ):
+        """
+        Constructor of SpeculativeAnswer class. Starts the generation immediately.
+
+        Args:
+          chain: Chain of the final answer (prompt | model | StrOutputParser)
+          input_data (dict): Input data of the chain
+          config (RunnableConfig): Settings passed to the chain (config of the node starting the generation)
+          node (str): Node that uses the answer
+        """
+        self.start_time = time.time()
+        self._queue = asyncio.Queue()
+        config = {
+            **config,
+            "run_name": node,
+            "metadata": {**config.get("metadata", {}), "langgraph_node": node},
+            # Not streamed as messages: the consumer streams the tokens once the answer is known to be needed
+            "tags": [*config.get("tags", []), TAG_NOSTREAM],
+        }
+        self._task = asyncio.create_task(self._generate(chain, input_data, config))
+        metrics.inc("final_answer_speculation_total", outcome="launched")
+
+    async def _generate(self, chain, input_data: dict, config: RunnableConfig):
+        """
+        Generates the answer and puts its tokens in the queue. None marks the end, an exception marks a failure.
+        """
+        try:
+            async for token in chain.astream(input_data, config=config):
+                self._queue.put_nowait(token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            self._queue.put_nowait(err)
+            return
+        self._queue.put_nowait(None)
+
+    async def tokens(self):
+        """
+        Yields the tokens of the answer: the buffered ones first, then the rest as they are generated
+
+        Raises:
+          Exception: Error raised during the generation
+        """
+        metrics.inc("final_answer_speculation_total", outcome="used")
+        metrics.inc(
+            "final_answer_speculation_head_start_seconds",
+            time.time() - self.start_time,
+        )
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        """
+        Cancels the generation (the research continues with a replan)
+        """
+        self._task.cancel()
+        metrics.inc("final_answer_speculation_total", outcome="cancelled")
+
+
+__all__ = ["SpeculativeAnswer"]
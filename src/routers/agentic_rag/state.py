@@ -13,3 +13,6 @@ class State(MessagesState):
     plan_status: list
     plan_over: bool
     plan_exec: Dict[str, Any]  # Plan to execute
+    step_memo: list  # Results of the executed plans, reused by revised plans
+    stop_reason: str  # Reason why the research was stopped before all plans were executed ("" if not stopped)
+    cached_answer: str  # Answer taken from the answer cache ("" if not cached)
@@ -0,0 +1,106 @@
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Reuse the result of a completed plan when a revised plan contains the same step (True: enabled, False: disabled)
+ENABLE_STEP_MEMO = os.environ.get("ENABLE_STEP_MEMO", "False")
+# Similarity (0-1) of the normalized plan texts from which a step is reused. 1.0 reuses identical steps only.
+STEP_MEMO_SIM_THRESHOLD = float(os.environ.get("STEP_MEMO_SIM_THRESHOLD", 1.0))
+
+# Only search results are reused. ans_llm_base answers depend on the research results gathered so far.
+MEMO_TOOLS = ("ans_tavily", "ans_arxiv", "search_rag")
+
+PUNCTUATION = re.compile(r"[\s\.,!?:;'\"`()\[\]「」『』（）、。！？：；]+")
+
+
+class StepMemo:
+    """
+    StepMemo
+    Memoizes the results of executed plan steps so that replans only pay for new steps
+
+    The memo is kept in the state (step_memo) as a list of entries {"step", "tool", "content"} keyed on the normalized step and the tool.
+    It is looked up after select_tool has chosen the tool of the step, so only the tool call is saved, not the tool selection.
+    It is reset for every user request.
+    """
+
+    def __init__(self, threshold: float = STEP_MEMO_SIM_THRESHOLD):
+        """
+        Constructor of StepMemo class
+
+        Args:
+          threshold (float): Similarity of the normalized steps from which a memoized result is reused.
+        """
+        self.threshold = threshold
+
+    def normalize(self, step: str) -> str:
+        """
+        Normalizes the text of a plan step (width, case, spaces and punctuation)
+
+        Args:
+          step (str): Text of the plan step.
+
+        Returns:
+          str: Normalized text.
+        """
+        step = unicodedata.normalize("NFKC", step).casefold()
+        return PUNCTUATION.sub(" ", step).strip()
+
+    def find(self, memo: list, step: str, tool: str):
+        """
+        Finds the memoized result of a completed step identical or similar to the given step, produced by the same tool
+
+        Args:
+          memo (list): Entries of the memo (step_memo of the state).
+          step (str): Text of the plan step to execute.
+          tool (str): Name of the tool selected for the step.
+
+        Returns:
+          dict or None: Most similar entry whose similarity reaches the threshold, None if not present
+        """
+        if ENABLE_STEP_MEMO.lower() != "true" or not memo:
+            return None
+        key = self.normalize(step)
+        best_entry = None
+        best_ratio = 0.0
+        for entry in memo:
+            if entry["tool"] != tool:
+                continue
+            if entry["step"] == key:
+                return entry
+            if self.threshold >= 1.0:
+                continue
+            ratio = SequenceMatcher(None, key, entry["step"]).ratio()
+            if ratio >= self.threshold and ratio > best_ratio:
+                best_entry = entry
+                best_ratio = ratio
+        return best_entry
+
+    def add(self, memo: list, step: str, tool: str, content: str) -> list:
+        """
+        Adds the result of a completed step to the memo
+
+        Args:
+          memo (list): Entries of the memo (step_memo of the state).
+          step (str): Text of the completed plan step.
+          tool (str): Name of the tool that produced the result.
+          content (str): Result of the tool (content of the ToolMessage).
+
+        Returns:
+          list: Updated entries of the memo.
+        """
+        memo = list(memo or [])
+        if tool not in MEMO_TOOLS:
+            return memo
+        key = self.normalize(step)
+        if any(entry["step"] == key and entry["tool"] == tool for entry in memo):
+            return memo
+        memo.append({"step": key, "tool": tool, "content": content})
+        return memo
+
+
+__all__ = ["StepMemo"]
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+from src.routers.agentic_rag.usage import is_cached
+
+load_dotenv()
+
+# Record the spans of the graph runs (request, node, LLM call, tool call) in a local file (True: enabled, False: disabled)
+ENABLE_RUN_TRACING = os.environ.get("ENABLE_RUN_TRACING", "False")
+# Share of the runs recorded (0-1)
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+# JSONL file of the spans, one span per line
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+
+
+class JsonlSpanExporter:
+    """
+    JsonlSpanExporter
+    Appends spans to a JSONL file, one span per line
+
+    The fields follow the span of OpenTelemetry (OTLP JSON: traceId, spanId, parentSpanId, name,
+    startTimeUnixNano, endTimeUnixNano, attributes, status), so the file can be converted or loaded by OTLP tools.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        """
+        Constructor of JsonlSpanExporter class
+
+        Args:
+          path (str): Path of the JSONL file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: list):
+        """
+        Append the spans of a run
+
+        Args:
+          spans (list): Spans (dict).
+        """
+        lines = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(lines)
+
+
+_span_exporter = None
+_span_exporter_lock = threading.Lock()
+
+
+def get_span_exporter() -> JsonlSpanExporter:
+    """
+    Get the exporter of the spans (created once)
+
+    Returns:
+      JsonlSpanExporter: exporter
+    """
+    global _span_exporter
+    with _span_exporter_lock:
+        if _span_exporter is None:
+            _span_exporter = JsonlSpanExporter()
+        return _span_exporter
+
+
+def payload_size(value) -> int:
+    """
+    Get the size of an input or output of a call in characters
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    content = getattr(value, "content", None)
+    if isinstance(content, str):
+        return len(content)
+    return len(str(value))
+
+
+class RunTracer(BaseCallbackHandler):
+    """
+    RunTracer
+    Callback handler recording the spans of one graph run: request -> node -> LLM call / tool call
+
+    The spans hold the durations, the tokens of the LLM calls, the retries and the sizes of the inputs and outputs.
+    The tokens are the ones counted by the TokenMeter of the run, which handles each call before the tracer.
+    The spans are kept in memory during the run and written at once in a worker thread when the run finishes,
+    without any external service.
+    """
+
+    # Only records, so it runs in the event loop instead of a worker thread
+    run_inline = True
+
+    def __init__(self, name: str, token_meter, attributes: dict = None, exporter=None):
+        """
+        Constructor of RunTracer class
+
+        Args:
+          name (str): Name of the root span (e.g. the endpoint).
+          token_meter (TokenMeter): Token meter of the run, registered in the callbacks before the tracer.
+          attributes (dict): Attributes of the root span (e.g. chat_id).
+          exporter: Exporter of the spans. None: get_span_exporter().
+        """
+        self.token_meter = token_meter
+        self.exporter = exporter or get_span_exporter()
+        self.trace_id = uuid4().hex
+        self.spans = []
+        # run_id of LangChain: open span
+        self._open = {}
+        # run_id of LangChain: run_id of its parent, to find the closest recorded ancestor
+        self._parents = {}
+        self.root = self._new_span(name, None, attributes or {})
+
+    def _new_span(self, name: str, parent: dict, attributes: dict) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": uuid4().hex[:16],
+            "parentSpanId": parent["spanId"] if parent else "",
+            "name": name,
+            "startTimeUnixNano": time.time_ns(),
+            "endTimeUnixNano": 0,
+            "attributes": attributes,
+            "status": {"code": "STATUS_CODE_OK"},
+        }
+
+    def _get_parent(self, parent_run_id) -> dict:
+        while parent_run_id is not None:
+            span = self._open.get(parent_run_id)
+            if span is not None:
+                return span
+            parent_run_id = self._parents.get(parent_run_id)
+        return self.root
+
+    def _start(self, run_id, parent_run_id, name: str, attributes: dict):
+        self._parents[run_id] = parent_run_id
+        self._open[run_id] = self._new_span(
+            name, self._get_parent(parent_run_id), attributes
+        )
+
+    def _end(self, run_id, attributes: dict = None, error=None):
+        self._parents.pop(run_id, None)
+        span = self._open.pop(run_id, None)
+        if span is None:
+            return None
+        span["endTimeUnixNano"] = time.time_ns()
+        span["attributes"]["duration_ms"] = round(
+            (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e6, 1
+        )
+        span["attributes"].update(attributes or {})
+        if error is not None:
+            span["status"] = {
+                "code": "STATUS_CODE_ERROR",
+                "message": f"{type(error).__name__}: {error}"[:500],
+            }
+        self.spans.append(span)
+        return span
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        parent = self._get_parent(parent_run_id)
+        # The run of the node itself, not the runnables inside it (which may have the same name).
+        # A run started for another node (e.g. the speculative final answer in judge_replan) gets its own node span.
+        if (
+            node is None
+            or kwargs.get("name") != node
+            or (
+                parent is not self.root
+                and parent["attributes"].get("langgraph.node") in (None, node)
+            )
+        ):
+            self._parents[run_id] = parent_run_id
+            return
+        self._start(
+            run_id,
+            parent_run_id,
+            f"node {node}",
+            {"langgraph.node": node, "langgraph.step": metadata.get("langgraph_step")},
+        )
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_chat_model_start(
+        self,
+        serialized,
+        messages,
+        *,
+        run_id,
+        parent_run_id=None,
+        metadata=None,
+        **kwargs,
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            "llm",
+            {
+                "llm.model": (metadata or {}).get("ls_model_name", ""),
+                "llm.input_chars": sum(
+                    payload_size(message) for batch in messages for message in batch
+                ),
+            },
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._open.get(run_id)
+        if span is None:
+            return
+        input_tokens, output_tokens = self.token_meter.call_tokens.pop(run_id, (0, 0))
+        if is_cached(response):
+            # Answered by the LLM cache: no tokens were used
+            input_tokens, output_tokens = 0, 0
+            span["attributes"]["llm.cached"] = True
+        output_chars = sum(
+            payload_size(generation.text)
+            for generations in response.generations
+            for generation in generations
+        )
+        self._end(
+            run_id,
+            {
+                "llm.input_tokens": input_tokens,
+                "llm.output_tokens": output_tokens,
+                "llm.output_chars": output_chars,
+            },
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        # The prompt was sent
+        input_tokens, _ = self.token_meter.call_tokens.pop(run_id, (0, 0))
+        self._end(run_id, {"llm.input_tokens": input_tokens}, error=error)
+
+    def on_tool_start(
+        self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs
+    ):
+        name = (serialized or {}).get("name") or kwargs.get("name", "tool")
+        self._start(
+            run_id,
+            parent_run_id,
+            f"tool {name}",
+            {"tool.name": name, "tool.input_chars": payload_size(input_str)},
+        )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, {"tool.output_chars": payload_size(output)})
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_retry(self, retry_state, *, run_id, parent_run_id=None, **kwargs):
+        self._count_retry(run_id)
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == "retry":
+            self._count_retry(run_id)
+
+    def _count_retry(self, run_id):
+        # The span of the run that retried, or its closest recorded ancestor
+        span = self._get_parent(run_id)
+        span["attributes"]["retries"] = span["attributes"].get("retries", 0) + 1
+
+    def finish(self, attributes: dict = None, error=None):
+        """
+        End the root span and write the spans of the run in a worker thread, so that the file is not written in the event loop
+
+        Args:
+          attributes (dict): Attributes added to the root span (e.g. stop reason).
+          error: Error of the run, None if it succeeded.
+        """
+        # Spans still open were interrupted (e.g. the run was cancelled)
+        for run_id in list(self._open):
+            self._end(run_id, {"interrupted": True})
+        root = self.root
+        root["endTimeUnixNano"] = time.time_ns()
+        root["attributes"]["duration_ms"] = round(
+            (root["endTimeUnixNano"] - root["startTimeUnixNano"]) / 1e6, 1
+        )
+        root["attributes"]["llm.input_tokens"] = sum(
+            span["attributes"].get("llm.input_tokens", 0) for span in self.spans
+        )
+        root["attributes"]["llm.output_tokens"] = sum(
+            span["attributes"].get("llm.output_tokens", 0) for span in self.spans
+        )
+        root["attributes"].update(attributes or {})
+        if error is not None:
+            root["status"] = {
+                "code": "STATUS_CODE_ERROR",
+                "message": f"{type(error).__name__}: {error}"[:500],
+            }
+        spans = self.spans + [root]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.exporter.export(spans)
+            return
+        future = loop.run_in_executor(None, self.exporter.export, spans)
+        future.add_done_callback(log_export_error)
+
+
+def log_export_error(future: asyncio.Future):
+    """
+    Log the error of a background export of spans (the run itself is not affected)
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Error: [tracing] {future.exception()}")
+
+
+def start_trace(name: str, token_meter, attributes: dict = None):
+    """
+    Start the trace of a run, if tracing is enabled and the run is sampled
+
+    Args:
+      name (str): Name of the root span.
+      token_meter (TokenMeter): Token meter of the run, whose token counts are recorded in the spans.
+      attributes (dict): Attributes of the root span.
+
+    Returns:
+      RunTracer or None: Callback handler to add to the config of the run, None if the run is not recorded
+    """
+    if ENABLE_RUN_TRACING.lower() != "true" or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    return RunTracer(name, token_meter, attributes)
+
+
+__all__ = ["JsonlSpanExporter", "RunTracer", "get_span_exporter", "start_trace"]
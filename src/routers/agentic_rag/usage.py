@@ -0,0 +1,447 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+import tiktoken
+import tiktoken.load
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+
+from src.routers.agentic_rag.llm_limiter import CHARS_PER_TOKEN
+from src.routers.agentic_rag.param_llm import get_token_prices
+from src.routers.utils.metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Tokens (prompt and completion) of a run from which no further research step is executed (0: no limit)
+RUN_TOKEN_BUDGET = int(os.environ.get("RUN_TOKEN_BUDGET", 0))
+# Number of chats whose token usage is kept, the least recently used chats are forgotten first
+USAGE_MAX_CHATS = int(os.environ.get("USAGE_MAX_CHATS", 10000))
+# Encoding used when the encoding of the model (deployment name) is unknown
+DEFAULT_ENCODING = "o200k_base"
+# Tokens added by the chat format to each message, and to the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+# Buckets of the run_tokens histogram
+TOKEN_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+
+# Encodings of tiktoken loaded at startup by load_encodings (encoding name: Encoding)
+encodings = {}
+
+
+def read_cached_file(blobpath: str) -> bytes:
+    """
+    Read a file of tiktoken that is not in its cache: only local files are read, URLs are never downloaded
+
+    Args:
+      blobpath (str): Path or URL of the file.
+
+    Returns:
+      bytes: Contents of the file
+    """
+    if "://" in blobpath:
+        raise FileNotFoundError(f"{blobpath} is not in the cache of tiktoken")
+    with open(blobpath, "rb") as file:
+        return file.read()
+
+
+def load_encodings() -> list:
+    """
+    Load the tiktoken encodings of the deployments and DEFAULT_ENCODING from the cache of tiktoken (TIKTOKEN_CACHE_DIR)
+
+    Called once at startup, outside of the event loop. The encoding files are never downloaded:
+    an encoding that is not in the cache is not loaded and its tokens are estimated from the characters (CHARS_PER_TOKEN).
+
+    Returns:
+      list: Names of the loaded encodings
+    """
+    names = {DEFAULT_ENCODING}
+    for model in get_token_prices():
+        try:
+            names.add(tiktoken.encoding_name_for_model(model or ""))
+        except KeyError:
+            pass
+    read_file = tiktoken.load.read_file
+    tiktoken.load.read_file = read_cached_file
+    try:
+        for name in sorted(names):
+            try:
+                encodings[name] = tiktoken.get_encoding(name)
+            except Exception as err:
+                logging.warning(
+                    f"Warning: [usage] tiktoken: {err}. Tokens are estimated."
+                )
+    finally:
+        tiktoken.load.read_file = read_file
+    get_encoding.cache_clear()
+    return sorted(encodings)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = ""):
+    """
+    Get the tiktoken encoding of a model among the encodings loaded at startup (never loads an encoding)
+
+    Args:
+      model (str): Model or deployment name.
+
+    Returns:
+      Encoding or None: encoding (DEFAULT_ENCODING if the model is unknown), None if it was not loaded
+    """
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = DEFAULT_ENCODING
+    return encodings.get(name)
+
+
+def count_text_tokens(text: str, model: str = "") -> int:
+    """
+    Count the tokens of a text with tiktoken, or estimate them from its characters
+
+    Args:
+      text (str): Text.
+      model (str): Model or deployment name.
+
+    Returns:
+      int: tokens
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list, model: str = "") -> int:
+    """
+    Count the tokens of the prompt of a chat model call
+
+    Args:
+      messages (list): Messages sent to the model.
+      model (str): Model or deployment name.
+
+    Returns:
+      int: tokens
+    """
+    tokens = TOKENS_PER_REPLY
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else ""
+        # The arguments of the tool calls are part of the prompt
+        tool_calls = getattr(message, "tool_calls", None)
+        tokens += TOKENS_PER_MESSAGE + count_text_tokens(
+            content + (str(tool_calls) if tool_calls else ""), model
+        )
+    return tokens
+
+
+def count_tokens(response, input_tokens: int, model: str = "") -> tuple:
+    """
+    Count the tokens of an LLM call from the usage reported by the model, or count them with tiktoken
+
+    Args:
+      response (LLMResult): Result of the call.
+      input_tokens (int): Tokens of the prompt counted before the call.
+      model (str): Model or deployment name.
+
+    Returns:
+      tuple: (input tokens, output tokens)
+    """
+    output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(
+                getattr(generation, "message", None), "usage_metadata", None
+            )
+            if usage:
+                input_tokens = usage["input_tokens"]
+                output_tokens += usage["output_tokens"]
+            else:
+                # Streamed completions carry no usage. The arguments of the tool calls are also generated
+                text = generation.text or str(
+                    getattr(generation.message, "tool_calls", "")
+                )
+                output_tokens += count_text_tokens(text, model)
+    return input_tokens, output_tokens
+
+
+def is_cached(response) -> bool:
+    """
+    Check whether an LLM call was answered by the LLM cache (CachedChatModel) without calling the model
+
+    Args:
+      response (LLMResult): Result of the call.
+
+    Returns:
+      bool: True if every generation comes from the cache
+    """
+    generations = [
+        generation for generations in response.generations for generation in generations
+    ]
+    return bool(generations) and all(
+        (generation.generation_info or {}).get("cached") for generation in generations
+    )
+
+
+def get_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Get the cost of the tokens of a call from the prices of model_tiers.yaml
+
+    Args:
+      model (str): Deployment name.
+      input_tokens (int): Tokens of the prompt.
+      output_tokens (int): Tokens of the completion.
+
+    Returns:
+      float: Cost (USD), 0 if the deployment has no price
+    """
+    input_price, output_price = get_token_prices().get(model, (0, 0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class ChatUsage:
+    """
+    ChatUsage
+    Tokens and cost of the chats, added at the end of each run (in memory, USAGE_MAX_CHATS chats)
+    """
+
+    def __init__(self, max_chats: int = USAGE_MAX_CHATS):
+        """
+        Constructor of ChatUsage class
+
+        Args:
+          max_chats (int): Number of chats kept.
+        """
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: str, usage: dict) -> dict:
+        """
+        Add the usage of a run to its chat
+
+        Args:
+          chat_id (str): Chat ID.
+          usage (dict): input, output, cost of the run.
+
+        Returns:
+          dict: input, output, cost and runs of the chat
+        """
+        with self._lock:
+            total = self._chats.pop(chat_id, None) or {
+                "input": 0,
+                "output": 0,
+                "cost": 0.0,
+                "runs": 0,
+            }
+            total = {
+                "input": total["input"] + usage["input"],
+                "output": total["output"] + usage["output"],
+                "cost": round(total["cost"] + usage["cost"], 6),
+                "runs": total["runs"] + 1,
+            }
+            self._chats[chat_id] = total
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+            return dict(total)
+
+
+chat_usage = ChatUsage()
+
+
+class TokenMeter(BaseCallbackHandler):
+    """
+    TokenMeter
+    Callback handler counting the LLM tokens and their cost for each graph node of a run
+
+    The usage reported by the model is used when present. Streamed completions carry no usage,
+    so their tokens are counted with tiktoken (or estimated from the characters when its encoding is not available).
+    The tokens are added to the metrics (llm_tokens_total, llm_cost_usd_total) and kept per run.
+    Calls answered by the LLM cache use no tokens (neither cost nor budget), they are counted in llm_cache_saved_tokens_total.
+    Only the start and the end of each call are handled, never the streamed tokens.
+    """
+
+    # Only counts, so it runs in the event loop instead of a worker thread
+    run_inline = True
+
+    def __init__(self, budget: int = RUN_TOKEN_BUDGET):
+        """
+        Constructor of TokenMeter class
+
+        Args:
+          budget (int): Tokens of the run from which no further research step is executed (0: no limit).
+        """
+        self.budget = budget
+        self.tokens = defaultdict(lambda: {"input": 0, "output": 0, "cost": 0.0})
+        self._calls = {}
+        # run_id of LangChain: (input tokens, output tokens) of each LLM call, also read by the tracer of the run
+        self.call_tokens = {}
+        # Tokens of the interrupted runs whose steps this run resumes instead of executing them again
+        self.saved_by_resume = 0
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, metadata=None, **kwargs
+    ):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node", "none")
+        model = metadata.get("ls_model_name", "")
+        input_tokens = sum(count_message_tokens(batch, model) for batch in messages)
+        self._calls[run_id] = (node, model, input_tokens)
+        self.call_tokens[run_id] = (input_tokens, 0)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        node, model, input_tokens = call
+        input_tokens, output_tokens = count_tokens(response, input_tokens, model)
+        self.call_tokens[run_id] = (input_tokens, output_tokens)
+        if is_cached(response):
+            # Answered by the LLM cache: nothing was sent to the model, the tokens are only counted as saved
+            metrics.inc(
+                "llm_cache_saved_tokens_total",
+                input_tokens,
+                node=node,
+                direction="input",
+            )
+            metrics.inc(
+                "llm_cache_saved_tokens_total",
+                output_tokens,
+                node=node,
+                direction="output",
+            )
+            return
+        self._add(node, model, input_tokens, output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is not None:
+            # The prompt was sent
+            self._add(call[0], call[1], call[2], 0)
+
+    def _add(self, node: str, model: str, input_tokens: int, output_tokens: int):
+        cost = get_cost(model, input_tokens, output_tokens)
+        self.tokens[node]["input"] += input_tokens
+        self.tokens[node]["output"] += output_tokens
+        self.tokens[node]["cost"] += cost
+        metrics.inc("llm_tokens_total", input_tokens, node=node, direction="input")
+        metrics.inc("llm_tokens_total", output_tokens, node=node, direction="output")
+        if cost:
+            metrics.inc("llm_cost_usd_total", cost, node=node)
+
+    @property
+    def total(self) -> int:
+        """
+        Tokens of the run (prompt and completion)
+        """
+        return sum(
+            tokens["input"] + tokens["output"] for tokens in self.tokens.values()
+        )
+
+    def is_over_budget(self) -> bool:
+        """
+        Check whether the run has used its token budget
+
+        Returns:
+          bool: True if no further research step has to be executed
+        """
+        return self.budget > 0 and self.total >= self.budget
+
+    def get_usage(self) -> dict:
+        """
+        Get the tokens and cost of the run and of each of its nodes
+
+        Returns:
+          dict: input, output, cost, budget, saved_by_resume and nodes (input, output, cost per node)
+        """
+        nodes = {
+            node: {**tokens, "cost": round(tokens["cost"], 6)}
+            for node, tokens in self.tokens.items()
+        }
+        return {
+            "input": sum(tokens["input"] for tokens in nodes.values()),
+            "output": sum(tokens["output"] for tokens in nodes.values()),
+            "cost": round(sum(tokens["cost"] for tokens in nodes.values()), 6),
+            "budget": self.budget,
+            "saved_by_resume": self.saved_by_resume,
+            "nodes": nodes,
+        }
+
+    def finish(self, chat_id: str) -> dict:
+        """
+        Record the usage of the finished run in the metrics and in the usage of its chat
+
+        Args:
+          chat_id (str): Chat ID.
+
+        Returns:
+          dict: Usage of the run (get_usage) with the usage of the chat ("chat")
+        """
+        usage = self.get_usage()
+        metrics.observe(
+            "run_tokens", usage["input"] + usage["output"], buckets=TOKEN_BUCKETS
+        )
+        usage["chat"] = chat_usage.add(chat_id, usage)
+        return usage
+
+    def get_report(self) -> str:
+        """
+        Get the tokens of each node of the run
+
+        Returns:
+          str: One line per node
+        """
+        return "\n".join(
+            f"- {node}: in {tokens['input']}, out {tokens['output']}, ${tokens['cost']:.4f}"
+            for node, tokens in self.tokens.items()
+        )
+
+
+def set_token_meter(config: RunnableConfig, token_meter: TokenMeter) -> dict:
+    """
+    Set the token meter of a run in the graph config, from which the nodes check the token budget
+
+    Args:
+      config (RunnableConfig): Config passed to the graph.
+      token_meter (TokenMeter): Token meter of the run, also registered in the callbacks.
+
+    Returns:
+      dict: config
+    """
+    config.setdefault("configurable", {})["token_meter"] = token_meter
+    return config
+
+
+def is_over_token_budget(config: RunnableConfig) -> bool:
+    """
+    Check whether the run has used its token budget
+
+    Args:
+      config (RunnableConfig): Config of the node.
+
+    Returns:
+      bool: True if the research has to stop
+    """
+    token_meter = (config or {}).get("configurable", {}).get("token_meter")
+    return token_meter is not None and token_meter.is_over_budget()
+
+
+__all__ = [
+    "ChatUsage",
+    "TokenMeter",
+    "count_message_tokens",
+    "count_text_tokens",
+    "count_tokens",
+    "get_cost",
+    "is_cached",
+    "is_over_token_budget",
+    "load_encodings",
+    "set_token_meter",
+]
@@ -1,7 +1,8 @@
 """Agentic RAG agent"""
 
-import json
+import asyncio
 import logging
+import math
 import os
 import time
 
@@ -10,12 +11,19 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from langchain_core.messages import HumanMessage
 
+from src.routers.agentic_rag.deadline import NodeTimer, set_deadline
 from src.routers.agentic_rag.message_utils import MsgUtils
+from src.routers.agentic_rag.tracing import start_trace
+from src.routers.agentic_rag.usage import TokenMeter, set_token_meter
 from src.schemas.app_schemas import ChatModel
 
-from .utils.constants import REST_API_500_ERROR
+from .utils.admission import AdmissionController, AdmissionRejectedError
+from .utils.constants import REST_API_404_ERROR, REST_API_500_ERROR
 from .utils.csrf_utils import check_csrf
 from .utils.log_dev import LogDev
+from .utils.metrics import Metrics
+from .utils.run_registry import RunRegistry, RunStream
+from .utils.sse_encoder import SseEncoder
 
 load_dotenv()
 log = LogDev()
@@ -24,6 +32,16 @@ msg_util = MsgUtils()
 PY_FILE_NAME = "[src/routers/ask_agent.py]: "
 router = APIRouter()
 ENABLE_LOG_DEV = os.getenv("ENABLE_LOG_DEV")
+metrics = Metrics()
+# Interval of the checks whether the client of a stream is still connected (seconds)
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", 1.0))
+# Runs of the streamed requests, to which a client can reconnect
+run_registry = RunRegistry()
+# Bounds the runs in flight, rejecting a request early when the queue is too long
+admission = AdmissionController()
+# Chats whose last run was cancelled because no client was connected (only these runs are resumed),
+# with the tokens used by the cancelled run and the runs it resumed
+cancelled_threads = {}
 
 # https://langchain-ai.github.io/langgraph/concepts/streaming/#streaming-graph-outputs-stream-and-astream
 # https://langchain-ai.github.io/langgraph/how-tos/streaming-specific-nodes/
@@ -49,8 +67,22 @@ async def exec_graph(request: ChatModel, req: Request):
         "plan_status": [],
         "plan_over": False,
         "plan_exec": "",
+        "step_memo": [],
+        "stop_reason": "",
+        "cached_answer": "",
     }
     config = {"recursion_limit": 400, "configurable": {"thread_id": request.chat_id}}
+    # The deadline of the request is passed to every node and tool through the config
+    set_deadline(config)
+    node_timer = NodeTimer()
+    token_meter = TokenMeter()
+    config["callbacks"] = [node_timer, token_meter]
+    # The nodes stop the research when the run has used its token budget
+    set_token_meter(config, token_meter)
+    # Spans of the run (request -> node -> LLM call / tool call), if the run is sampled
+    tracer = start_trace("exec_graph", token_meter, {"chat_id": request.chat_id})
+    if tracer is not None:
+        config["callbacks"].append(tracer)
     # Record the start time
     start_time = time.time()
     # Agent responds
@@ -59,11 +91,18 @@ async def exec_graph(request: ChatModel, req: Request):
         answer = await graph_app.ainvoke(input_data, config=config)
     except Exception as err:
         print(err)
+        token_meter.finish(request.chat_id)
+        if tracer is not None:
+            tracer.finish(error=err)
         raise Exception(err)
+    usage = token_meter.finish(request.chat_id)
+    if tracer is not None:
+        tracer.finish({"stop_reason": answer.get("stop_reason", "")})
     # Record the end time of the process
     end_time = time.time()
     # Calculate elapsed time
     elapsed_time = end_time - start_time
+    metrics.observe("request_duration_seconds", elapsed_time)
     log.print("\n===== Final answer =====")
     log.print("-- **Conversation hisory** --")
     msg_history = msg_util.get_pure_msg(answer["messages"])
@@ -73,16 +112,122 @@ async def exec_graph(request: ChatModel, req: Request):
     log.print(latest_ai_msg)
     log.print("-- Elapsed time --")
     log.print("{:.1f}".format(elapsed_time))
+    log.print("-- Time per node --")
+    log.print(node_timer.get_report())
+    log.print("-- Tokens per node --")
+    log.print(token_meter.get_report())
+    log.print(
+        f"Run: in {usage['input']}, out {usage['output']}, ${usage['cost']:.4f} / Chat: in {usage['chat']['input']}, out {usage['chat']['output']}, ${usage['chat']['cost']:.4f}"
+    )
     return answer
 
 
-async def exec_graph_stream(request: ChatModel, req: Request):
+async def get_resume_input(
+    graph_app, request: ChatModel, input_data: dict, token_meter: TokenMeter
+):
+    """
+    Get the input of the graph, resuming an interrupted run from its checkpoint
+
+    When the previous run of the chat was cancelled because the client disconnected and the same request is sent again,
+    the run continues from the last checkpoint instead of starting over. The steps already executed are not executed again.
+    A run that ended with an error is not resumed (it would fail again from the same checkpoint): the request starts a new run.
+    The tokens used by the interrupted run are reported as saved (resumed_tokens_saved_total and the usage of the run).
+    They include the LLM calls cut off by the cancellation, which are executed again.
+
+    Args:
+      graph_app: Compiled graph.
+      request (ChatModel): The current ChatModel object.
+      input_data (dict): Input of a new run.
+      token_meter (TokenMeter): Token meter of the new run.
+
+    Returns:
+      dict or None: input_data, None to resume from the checkpoint
+    """
+    if request.chat_id not in cancelled_threads:
+        return input_data
+    cancelled_tokens = cancelled_threads.pop(request.chat_id)
+    snapshot = await graph_app.aget_state(
+        {"configurable": {"thread_id": request.chat_id}}
+    )
+    if not snapshot.next:
+        return input_data
+    messages = snapshot.values.get("messages", [])
+    if msg_util.get_latest_human_msg(messages) != request.user_request.strip("\n\r"):
+        return input_data
+    metrics.inc("resumed_runs_total")
+    metrics.inc("resumed_tokens_saved_total", cancelled_tokens)
+    token_meter.saved_by_resume = cancelled_tokens
+    log.print(
+        f"\n-- Resume the interrupted run from: {', '.join(snapshot.next)} ({cancelled_tokens} tokens saved) --"
+    )
+    return None
+
+
+async def run_graph(
+    graph_app,
+    input_data,
+    config: dict,
+    events: asyncio.Queue,
+    node_timer: NodeTimer,
+    token_meter: TokenMeter,
+):
+    """
+    Run the graph and put its stream events in the queue
+
+    None marks the end, an exception marks a failure.
+    When the run is cancelled (no client is connected), the cancellation is recorded.
+    The checkpoint of the last completed step is kept, so that the run can be resumed by the same request.
+
+    Args:
+      graph_app: Compiled graph.
+      input_data (dict or None): Input of the graph, None to resume from the checkpoint.
+      config (dict): Config of the run.
+      events (asyncio.Queue): Queue of the (mode, chunk) stream events.
+      node_timer (NodeTimer): Callback handler of the run.
+      token_meter (TokenMeter): Token meter of the run.
+    """
+    try:
+        async for event in graph_app.astream(
+            input_data, config, stream_mode=["messages", "custom"]
+        ):
+            events.put_nowait(event)
+    except asyncio.CancelledError:
+        cancelled_threads[config["configurable"]["thread_id"]] = (
+            token_meter.saved_by_resume + token_meter.total
+        )
+        snapshot = await graph_app.aget_state(
+            {"configurable": {"thread_id": config["configurable"]["thread_id"]}}
+        )
+        open_steps = (snapshot.values.get("plan_status") or []).count("open")
+        metrics.inc("cancelled_runs_total", node=node_timer.current_node or "none")
+        metrics.inc("cancelled_plan_steps_total", open_steps)
+        log.print(
+            f"\n-- Client disconnected: cancelled at {node_timer.current_node}, {open_steps} plan steps not executed --"
+        )
+        raise
+    except Exception as err:
+        events.put_nowait(err)
+        return
+    events.put_nowait(None)
+
+
+async def exec_graph_stream(
+    request: ChatModel, req: Request, encoder: SseEncoder, on_event=None
+):
     """
     Execute graph of Langgraph in stream mode
 
+    The graph runs in its own task. When the stream is closed before the end (no client is connected),
+    the task is cancelled, and the in-flight LLM calls with it.
+
     Args:
       request (ChatModel): The current ChatModel object.
       request (Request): The current request object.
+      encoder (SseEncoder): Encoder of the events of the run.
+      on_event: Function called with each event other than the tokens of the answer (e.g. to record the result of a job).
+
+    The last events are the usage of the run ({"type": "usage"}: tokens and cost of the run, of each node and of the chat)
+    and the elapsed time.
     """
 
     input_data = {
@@ -94,17 +239,67 @@ async def exec_graph_stream(request: ChatModel, req: Request):
         "plan_status": [],
         "plan_over": False,
         "plan_exec": "",
+        "step_memo": [],
+        "stop_reason": "",
+        "cached_answer": "",
     }
 
     config = {"recursion_limit": 400, "configurable": {"thread_id": request.chat_id}}
+    # The deadline of the request is passed to every node and tool through the config
+    set_deadline(config)
+    node_timer = NodeTimer()
+    token_meter = TokenMeter()
+    config["callbacks"] = [node_timer, token_meter]
+    # The nodes stop the research when the run has used its token budget
+    set_token_meter(config, token_meter)
+    # Spans of the run (request -> node -> LLM call / tool call), if the run is sampled
+    tracer = start_trace(
+        "ask_agent",
+        token_meter,
+        {"chat_id": request.chat_id, "request_chars": len(request.user_request)},
+    )
+    if tracer is not None:
+        config["callbacks"].append(tracer)
+    run_error = None
     start_time = time.time()
+
+    # Time to the first token of the answer (held by the encoder at most SSE_FLUSH_INTERVAL more)
+    first_token_sent = False
+
+    def observe_first_token(token: str):
+        nonlocal first_token_sent
+        if token and not first_token_sent:
+            first_token_sent = True
+            metrics.observe("time_to_first_token_seconds", time.time() - start_time)
+
+    def encode_event(data: dict) -> str:
+        if on_event is not None:
+            on_event(data)
+        return encoder.add_event(data)
+
     # The complete message is stored at the end of the Streaming messages
     last_comp_message = ""
+    graph_app = req.app.state.graph_app
+    input_data = await get_resume_input(graph_app, request, input_data, token_meter)
+    events = asyncio.Queue()
+    graph_task = asyncio.create_task(
+        run_graph(graph_app, input_data, config, events, node_timer, token_meter)
+    )
     try:
-        graph_app = req.app.state.graph_app
-        async for mode, chunk in graph_app.astream(
-            input_data, config, stream_mode=["messages", "custom", "updates"]
-        ):
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), encoder.get_flush_delay())
+            except asyncio.TimeoutError:
+                # No token followed the held ones within SSE_FLUSH_INTERVAL
+                frame = encoder.flush()
+                if frame:
+                    yield frame
+                continue
+            if event is None:
+                break
+            if isinstance(event, Exception):
+                raise event
+            mode, chunk = event
             if mode == "messages":
                 message, meta = chunk
                 # Stream messages.
@@ -116,34 +311,130 @@ async def exec_graph_stream(request: ChatModel, req: Request):
                 ):
                     if ENABLE_LOG_DEV == True:
                         print(message.content, end="", flush=True)
-                    data = {"type": "msg", "content": message.content}
-                    yield f"{json.dumps(data)}\n\n"
-            elif mode == "updates":
-                pass
+                    observe_first_token(message.content)
+                    frame = encoder.add_token(message.content)
+                    if frame:
+                        yield frame
             elif mode == "custom":
                 custom_event = chunk
-                data = {"type": "custom", "content": custom_event}
-                yield f"{json.dumps(data)}\n\n"
+                if isinstance(custom_event, dict) and custom_event.get("type") == "msg":
+                    # Messages of the answer streamed by the node itself (e.g. speculative final answer)
+                    if ENABLE_LOG_DEV == True:
+                        print(custom_event["content"], end="", flush=True)
+                    observe_first_token(custom_event["content"])
+                    frame = encoder.add_token(custom_event["content"])
+                    if frame:
+                        yield frame
+                else:
+                    yield encode_event({"type": "custom", "content": custom_event})
         # Get the complete message stored at the end of messages
         last_comp_message = message.content[1:-1]
         sanitized_answer = last_comp_message
-        data = {"type": "final_msg", "content": sanitized_answer}
-        yield f"{json.dumps(data)}\n\n"
+        yield encode_event({"type": "final_msg", "content": sanitized_answer})
     except Exception as err:
+        run_error = err
         print(err)
         data = {
             "type": "error",
             "content": "Error: An error occurred while running the Agent.",
         }
-        yield f"{json.dumps(data)}\n\n"
+        yield encode_event(data)
         raise Exception(err)
+    finally:
+        # The stream was closed before the end of the run
+        interrupted = not graph_task.done()
+        graph_task.cancel()
+        # The tokens of interrupted and failed runs are also counted in the usage of the chat
+        usage = token_meter.finish(request.chat_id)
+        if tracer is not None:
+            tracer.finish(
+                {"answer_chars": len(last_comp_message), "interrupted": interrupted},
+                error=run_error,
+            )
     end_time = time.time()
     elapsed_time = end_time - start_time
+    metrics.observe("request_duration_seconds", elapsed_time)
     log.print("\n-- Elapsed time --")
     elapsed_str = f"Elapsed time:" + "{:.1f}".format(elapsed_time) + "(s)"
     log.print(elapsed_str)
-    data = {"type": "custom", "content": elapsed_str}
-    yield f"{json.dumps(data)}\n\n"
+    log.print("-- Time per node --")
+    log.print(node_timer.get_report())
+    log.print("-- Tokens per node --")
+    log.print(token_meter.get_report())
+    # Tokens and cost of the run, of each node and of the chat
+    yield encode_event({"type": "usage", "content": usage})
+    yield encode_event({"type": "custom", "content": elapsed_str})
+
+
+def get_last_event_id(req: Request) -> int:
+    """
+    Get the id of the last event received by the client (Last-Event-ID header of a reconnection)
+
+    Args:
+      req (Request): The current request object.
+
+    Returns:
+      int: Event id, 0 if the client received none
+    """
+    try:
+        return int(req.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        return 0
+
+
+def stream_run(run: RunStream, req: Request) -> StreamingResponse:
+    """
+    Stream the events of a run to the client, from the event after Last-Event-ID
+
+    Args:
+      run (RunStream): The run.
+      req (Request): The current request object.
+
+    Returns:
+      StreamingResponse: Stream of the events. The X-Run-Id header is the id to reconnect to the run.
+    """
+    # No "await" because of an asynchronous generator.
+    generator = run_registry.subscribe(
+        run,
+        get_last_event_id(req),
+        is_disconnected=req.is_disconnected,
+        poll_interval=DISCONNECT_POLL_INTERVAL,
+    )
+    # Proxies must not buffer or cache the stream
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Run-Id": run.run_id,
+        },
+    )
+
+
+def start_run(request: ChatModel, req: Request) -> RunStream:
+    """
+    Start the run of a request, which waits for a slot of the admission control once the previous run of its chat has finished
+
+    Args:
+      request (ChatModel): The current ChatModel object.
+      req (Request): The current request object.
+
+    Returns:
+      RunStream: The run
+
+    Raises:
+      AdmissionRejectedError: The request would wait too long in the admission queue.
+    """
+    admission.check()
+    # Tokens of the answer are coalesced into fewer events
+    encoder = SseEncoder()
+    return run_registry.start(
+        request.chat_id,
+        request.user_request,
+        admission.admit(exec_graph_stream(request, req, encoder)),
+        lambda: encoder.event_id,
+    )
 
 
 @router.post("/api/ask_agent")
@@ -154,9 +445,53 @@ async def ask_agent(request: ChatModel, req: Request):
         print(f"{PY_FILE_NAME}{err}")
         raise err
     try:
-        # No "await" because of an asynchronous generator.
-        generator = exec_graph_stream(request, req)
-        return StreamingResponse(generator, media_type="text/event-stream")
+        async with run_registry.lock_chat(request.chat_id):
+            # The same request sent again while its run is live (e.g. double-click, retry after the connection dropped)
+            # attaches to the run, and its events are sent to both streams
+            run = run_registry.find_live(request.chat_id, request.user_request)
+            if run is not None:
+                metrics.inc("run_reattached_total")
+            else:
+                # Another request of the chat runs after the live run of the chat
+                run = start_run(request, req)
+        return stream_run(run, req)
+    except AdmissionRejectedError as err:
+        logging.warning(f"Warning: [/api/ask_agent] {err}. Request rejected.")
+        raise HTTPException(
+            status_code=503,
+            detail="The agent is busy.",
+            headers={"Retry-After": str(math.ceil(err.retry_after))},
+        )
     except Exception as err:
         logging.error(f"Error: [/api/ask_agent] {err} Internal server error.")
         raise HTTPException(status_code=500, detail=REST_API_500_ERROR)
+
+
+@router.get("/api/ask_agent/runs/{run_id}")
+async def reconnect_run(run_id: str, req: Request):
+    """
+    Reconnect to a run of /api/ask_agent
+
+    The events after Last-Event-ID are sent again, then the live events until the end of the run.
+    Runs are kept RUN_RETENTION seconds after their end.
+
+    Args:
+      run_id (str): Run ID (X-Run-Id header of the response of /api/ask_agent).
+      req (Request): The current request object.
+
+    Returns:
+      StreamingResponse: Stream of the events
+
+    Raises:
+      HTTPException: Returns 404 if the run is unknown or expired.
+    """
+    try:
+        check_csrf(req)
+    except Exception as err:
+        print(f"{PY_FILE_NAME}{err}")
+        raise err
+    run = run_registry.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=REST_API_404_ERROR)
+    metrics.inc("run_reattached_total")
+    return stream_run(run, req)
@@ -0,0 +1,26 @@
+"""Expose the metrics of the agent to Prometheus"""
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from .utils.metrics import Metrics
+
+router = APIRouter()
+metrics = Metrics()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    An API endpoint to scrape the metrics of the agent.
+
+    Counters, gauges and histograms (request duration, time to first token, time per node and tool,
+    LLM tokens per node, runs in flight) are returned in the text format of Prometheus.
+    The endpoint is only registered when ENABLE_METRICS_ENDPOINT is True. Do not expose it to the internet.
+
+    Returns:
+      PlainTextResponse: Metrics in the text format of Prometheus.
+    """
+    return PlainTextResponse(
+        metrics.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
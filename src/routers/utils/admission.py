@@ -0,0 +1,202 @@
+"""Admission control of the graph runs of /api/ask_agent and of the background jobs"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from .metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Number of graph runs of /api/ask_agent and the background jobs at the same time. Further runs wait in the admission queue (0: no limit)
+MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", 0))
+# Longest expected wait in the admission queue. A request expected to wait longer is rejected at once with 503 (seconds)
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 120))
+# Duration of a run assumed until a run has finished (seconds)
+ADMISSION_INITIAL_RUN_SECONDS = float(
+    os.environ.get("ADMISSION_INITIAL_RUN_SECONDS", 60)
+)
+
+
+class AdmissionRejectedError(Exception):
+    """Exception thrown when a request would wait longer than ADMISSION_MAX_WAIT in the admission queue"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"expected wait {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    AdmissionController
+    Bounds the graph runs in flight, queueing the requests over the limit in order
+
+    The wait of a new request is estimated from the time left to the runs in flight (their elapsed time against
+    the average duration of the latest runs) and from the runs queued ahead of it.
+    A request expected to wait longer than ADMISSION_MAX_WAIT is rejected at once, so that a burst is shed quickly
+    instead of slowing down every request.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_RUNS,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        initial_run_seconds: float = ADMISSION_INITIAL_RUN_SECONDS,
+    ):
+        """
+        Constructor of AdmissionController class
+
+        Args:
+          max_concurrent (int): Number of runs at the same time (0: no limit).
+          max_wait (float): Longest expected wait in the queue (seconds).
+          initial_run_seconds (float): Duration of a run assumed until a run has finished (seconds).
+        """
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.initial_run_seconds = initial_run_seconds
+        # Average duration of the latest runs, None until a run has finished
+        self.run_seconds = None
+        self.running = 0
+        self._waiters = deque()
+        # Start time of each run in flight, by its slot
+        self._started = {}
+        self._slot_ids = itertools.count(1)
+
+    def estimate_wait(self) -> float:
+        """
+        Estimate the wait of a new request
+
+        Returns:
+          float: Seconds, 0 if a run can start at once
+        """
+        if self.max_concurrent <= 0 or (
+            self.running < self.max_concurrent and not self._waiters
+        ):
+            return 0.0
+        run_seconds = (
+            self.initial_run_seconds if self.run_seconds is None else self.run_seconds
+        )
+        now = time.monotonic()
+        # Time until each slot is free: a run in flight is expected to last the average duration.
+        # A run longer than that may end at any time. A slot just handed over has not started its run yet.
+        free_at = [
+            max(run_seconds - (now - start), 0.0) for start in self._started.values()
+        ]
+        free_at += [run_seconds] * (self.running - len(free_at))
+        free_at += [0.0] * (self.max_concurrent - self.running)
+        heapq.heapify(free_at)
+        # Each request ahead takes the first free slot for one run
+        for _ in range(len(self._waiters)):
+            heapq.heappush(free_at, heapq.heappop(free_at) + run_seconds)
+        return free_at[0]
+
+    def check(self):
+        """
+        Reject a new request at once if it would wait too long for a slot
+
+        Raises:
+          AdmissionRejectedError: The expected wait is longer than max_wait.
+        """
+        if self.max_concurrent <= 0:
+            return
+        expected = self.estimate_wait()
+        if expected > self.max_wait:
+            metrics.inc("admission_total", result="rejected")
+            raise AdmissionRejectedError(expected)
+
+    async def acquire(self):
+        """
+        Wait for a slot to start a run
+
+        Returns:
+          int or None: The slot, to pass to release(). None if there is no limit.
+        """
+        if self.max_concurrent <= 0:
+            return None
+        start = time.monotonic()
+        if self.running < self.max_concurrent and not self._waiters:
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._update_gauges()
+            try:
+                # The slot is handed over by release()
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release(None)
+                else:
+                    self._waiters.remove(waiter)
+                raise
+            finally:
+                self._update_gauges()
+        slot = next(self._slot_ids)
+        self._started[slot] = time.monotonic()
+        metrics.inc("admission_total", result="admitted")
+        metrics.inc("admission_wait_seconds_total", time.monotonic() - start)
+        self._update_gauges()
+        return slot
+
+    def release(self, slot):
+        """
+        Free the slot of a finished run, handing it to the next request in the queue
+
+        Args:
+          slot (int or None): Slot returned by acquire(). Its run duration is used to estimate the wait.
+        """
+        if self.max_concurrent <= 0:
+            return
+        start = self._started.pop(slot, None)
+        if start is not None:
+            run_seconds = time.monotonic() - start
+            # Moving average of the latest runs, starting from the first observed run
+            if self.run_seconds is None:
+                self.run_seconds = run_seconds
+            else:
+                self.run_seconds = 0.8 * self.run_seconds + 0.2 * run_seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self.running -= 1
+        self._update_gauges()
+
+    async def admit(self, frames, on_start=None):
+        """
+        Run the frames of a run in a slot: the slot is taken when the first frame is requested and freed at the end
+
+        The registry starts producing the frames only after the previous run of the same chat has finished,
+        so a run waiting for its chat does not hold a slot.
+
+        Args:
+          frames: Asynchronous generator of the frames of the run.
+          on_start: Function called once the run has its slot, before its first frame. None: not called.
+
+        Yields:
+          str: Frames
+        """
+        slot = await self.acquire()
+        try:
+            if on_start is not None:
+                on_start()
+            async for frame in frames:
+                yield frame
+        finally:
+            self.release(slot)
+
+    def _update_gauges(self):
+        metrics.set("admission_queue_depth", len(self._waiters))
+        metrics.set("runs_in_flight", self.running)
+
+
+__all__ = ["AdmissionController", "AdmissionRejectedError"]
@@ -3,4 +3,5 @@
 # messages
 REST_API_401_ERROR = "Session error."
 REST_API_403_ERROR = "Forbidden error."
+REST_API_404_ERROR = "Not found."
 REST_API_500_ERROR = "Internal server error."
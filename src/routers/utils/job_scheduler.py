@@ -0,0 +1,214 @@
+"""In-process scheduler of the background jobs of the agent"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from .metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Number of jobs running at the same time
+JOB_MAX_CONCURRENCY = int(os.environ.get("JOB_MAX_CONCURRENCY", 4))
+# Number of jobs waiting to run, beyond which new jobs are rejected
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", 100))
+# Time the status and result of a finished job are kept (seconds)
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 3600))
+
+
+class QueueFullError(Exception):
+    """Exception thrown when a job is submitted while the queue of the scheduler is full"""
+
+    pass
+
+
+class Job:
+    """
+    Job
+    A request run in the background: its status, progress and result
+    """
+
+    def __init__(self, start, priority: int):
+        """
+        Constructor of Job class
+
+        Args:
+          start: Function starting the run of the job, called with the job and returning its RunStream.
+          priority (int): Priority of the job. Higher runs first.
+        """
+        self.job_id = uuid4().hex
+        self.priority = priority
+        self.status = "queued"
+        self.progress = ""
+        self.result = ""
+        self.usage = None
+        self.run = None
+        self.seq = 0
+        self.started = asyncio.Event()
+        self.submitted_at = time.monotonic()
+        self.finished_at = None
+        self._start = start
+
+    def on_run_start(self):
+        """
+        Record the start of the run, once it has waited for the previous run of its chat and for a slot of the admission control
+        """
+        self.status = "running"
+        metrics.inc("job_wait_seconds_total", time.monotonic() - self.submitted_at)
+
+    def on_event(self, data: dict):
+        """
+        Record an event of the run (the latest progress message, the final answer and the usage)
+
+        Args:
+          data (dict): Event ({"type": ..., "content": ...}).
+        """
+        if data.get("type") == "final_msg":
+            self.result = data["content"]
+        elif data.get("type") == "usage":
+            self.usage = data["content"]
+        elif data.get("type") == "custom":
+            self.progress = data["content"]
+
+
+class JobScheduler:
+    """
+    JobScheduler
+    Runs the jobs with a bounded concurrency, higher priority first (first submitted first within a priority)
+
+    A dispatched job stays queued until its run starts: the run waits for the previous run of its chat
+    and for a slot of the admission control shared with /api/ask_agent (MAX_CONCURRENT_RUNS).
+
+    The number of waiting and running jobs is kept in the metrics (job_queue_depth, jobs_running).
+    When JOB_MAX_QUEUE jobs are waiting, new jobs are rejected so that the load is shed before the service slows down.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = JOB_MAX_CONCURRENCY,
+        max_queue: int = JOB_MAX_QUEUE,
+        retention: float = JOB_RETENTION,
+    ):
+        """
+        Constructor of JobScheduler class
+
+        Args:
+          max_concurrency (int): Number of jobs running at the same time.
+          max_queue (int): Number of jobs waiting to run.
+          retention (float): Time a finished job is kept (seconds).
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retention = retention
+        self.jobs = {}
+        self.running = 0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def submit(self, start, priority: int = 0) -> Job:
+        """
+        Submit a job
+
+        Args:
+          start: Function starting the run of the job, called with the job and returning its RunStream.
+          priority (int): Priority of the job. Higher runs first.
+
+        Returns:
+          Job: The job
+
+        Raises:
+          QueueFullError: The queue is full.
+        """
+        self._remove_expired()
+        if len(self._queue) >= self.max_queue:
+            metrics.inc("jobs_rejected_total")
+            raise QueueFullError(f"{len(self._queue)} jobs are waiting")
+        job = Job(start, priority)
+        self.jobs[job.job_id] = job
+        job.seq = next(self._seq)
+        heapq.heappush(self._queue, (-priority, job.seq, job))
+        metrics.inc("jobs_submitted_total")
+        self._dispatch()
+        return job
+
+    def get(self, job_id: str):
+        """
+        Get a job by its id
+
+        Args:
+          job_id (str): Job ID.
+
+        Returns:
+          Job or None: The job, None if unknown or expired
+        """
+        self._remove_expired()
+        return self.jobs.get(job_id)
+
+    def get_position(self, job: Job) -> int:
+        """
+        Get the position of a waiting job in the queue
+
+        Args:
+          job (Job): The job.
+
+        Returns:
+          int: Position in the queue (1: runs next), 0 if the job is not waiting or has been dispatched
+        """
+        if job.status != "queued" or job.run is not None:
+            return 0
+        return 1 + sum(
+            1
+            for priority, seq, _ in self._queue
+            if (priority, seq) < (-job.priority, job.seq)
+        )
+
+    def _dispatch(self):
+        while self._queue and self.running < self.max_concurrency:
+            _, _, job = heapq.heappop(self._queue)
+            self.running += 1
+            try:
+                job.run = job._start(job)
+            except Exception as err:
+                logging.error(f"Error: [job {job.job_id}] {err}")
+                self.running -= 1
+                job.status = "failed"
+                job.finished_at = time.monotonic()
+                metrics.inc("jobs_finished_total", status=job.status)
+                job.started.set()
+                continue
+            job.run.task.add_done_callback(lambda _, job=job: self._finish(job))
+            job.started.set()
+        metrics.set("job_queue_depth", len(self._queue))
+        metrics.set("jobs_running", self.running)
+
+    def _finish(self, job: Job):
+        self.running -= 1
+        if job.run.cancelled:
+            job.status = "cancelled"
+        elif job.run.error is not None:
+            job.status = "failed"
+        else:
+            job.status = "done"
+        job.finished_at = time.monotonic()
+        metrics.inc("jobs_finished_total", status=job.status)
+        self._dispatch()
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.retention
+        ]:
+            del self.jobs[job_id]
+
+
+__all__ = ["Job", "JobScheduler", "QueueFullError"]
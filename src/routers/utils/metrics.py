@@ -0,0 +1,150 @@
+"""In-process metrics of the agent"""
+
+from bisect import bisect_left
+
+# Upper bounds of the buckets of the duration histograms (seconds)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class Metrics:
+    """
+    Metrics is a singleton class that holds the counters of the agent (e.g. plans skipped by early stop).
+
+    Counters (and gauges, histograms) are identified by a name and optional labels, and are kept in memory for the life of the process.
+    Updates take no lock: they are single dictionary and list operations, cheap enough for every node and tool call.
+    """
+
+    _instance = None  # Singleton instance storage
+
+    def __new__(cls):
+        # Create a new instance only if one does not exist.
+        if cls._instance is None:
+            cls._instance = super(Metrics, cls).__new__(cls)
+            cls._instance.counters = {}
+            cls._instance.gauges = set()
+            cls._instance.histograms = {}
+        return cls._instance
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): Name of the counter (e.g. "early_stop_total").
+            value (float): Amount to add. Default is 1.
+            **labels: Labels of the counter (e.g. node="create_plan").
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Sets a gauge (a value that goes up and down, e.g. the depth of a queue).
+
+        Args:
+            name (str): Name of the gauge (e.g. "job_queue_depth").
+            value (float): Current value.
+            **labels: Labels of the gauge.
+        """
+        self.counters[(name, tuple(sorted(labels.items())))] = value
+        self.gauges.add(name)
+
+    def observe(
+        self, name: str, value: float, buckets: tuple = DURATION_BUCKETS, **labels
+    ):
+        """
+        Adds an observation to a histogram (e.g. the duration of a node).
+
+        Args:
+            name (str): Name of the histogram (e.g. "node_duration_seconds").
+            value (float): Observed value.
+            buckets (tuple): Upper bounds of the buckets, fixed by the first observation.
+            **labels: Labels of the histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # [bounds, count per bucket (the last one is +Inf), sum]
+            histogram = self.histograms.setdefault(
+                key, [buckets, [0] * (len(buckets) + 1), 0.0]
+            )
+        histogram[1][bisect_left(histogram[0], value)] += 1
+        histogram[2] += value
+
+    def get(self, name: str, **labels) -> float:
+        """
+        Returns the value of a counter.
+
+        Args:
+            name (str): Name of the counter.
+            **labels: Labels of the counter.
+
+        Returns:
+            float: Value of the counter, 0 if it has never been incremented.
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of all counters.
+
+        Returns:
+            dict: {(name, labels): value}
+        """
+        return dict(self.counters)
+
+    def render_prometheus(self) -> str:
+        """
+        Returns all the metrics in the text format of Prometheus.
+
+        Returns:
+            str: Exposition text
+        """
+        lines = []
+        typed = set()
+
+        def add_type(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            add_type(name, "gauge" if name in self.gauges else "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (bounds, counts, total) in sorted(self.histograms.items()):
+            add_type(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(bounds + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(
+                    f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Formats labels for the text format of Prometheus
+
+    Args:
+        labels (tuple): ((name, value), ...)
+
+    Returns:
+        str: {name="value",...}, "" without labels
+    """
+    if not labels:
+        return ""
+    values = ",".join(
+        f'{name}="{escape_label_value(str(value))}"' for name, value in labels
+    )
+    return "{" + values + "}"
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escapes the backslashes, double quotes and line feeds of a label value
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
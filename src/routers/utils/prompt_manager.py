@@ -1,8 +1,11 @@
 import os
+import re
 from pathlib import Path
+from string import Formatter
 
 import yaml
 from dotenv import load_dotenv
+from langchain_core.prompts import ChatPromptTemplate
 
 load_dotenv()
 
@@ -10,6 +13,11 @@ PROMPT_LANG = os.environ.get("PROMPT_LANG", "EN")
 prompts_ja_file = "prompts_ja.yaml"
 prompts_en_file = "prompts_en.yaml"
 
+# Variables whose values are the same for every request. Sections that only use these variables belong to the static prefix.
+STATIC_VARIABLES = {"tool_info", "vector_db_info", "max_plan"}
+# Top-level sections of the templates ("# Instructions", "# Conversation History", ...)
+SECTION_HEAD = re.compile(r"^# ", re.MULTILINE)
+
 
 class PromptManager:
     """
@@ -19,6 +27,11 @@ class PromptManager:
     prompt templates by their names. If the file path is not explicitly provided, it determines the file
     based on the PROMPT_LANG environment variable (using 'prompts_ja.yaml' if PROMPT_LANG is 'JA', otherwise
     'prompts_en.yaml').
+
+    Each template is also compiled once into a ChatPromptTemplate whose system message holds the static sections
+    (instructions, constraints, output format, tool information) and whose human message holds the sections that
+    change with every request (request, history, date and time). Providers cache the identical prefix of the prompts,
+    so the static part is kept first and unchanged.
     """
 
     _instance = None  # Class variable for the singleton instance
@@ -50,6 +63,10 @@ class PromptManager:
             prompt_file = prompts_ja_file if PROMPT_LANG == "JA" else prompts_en_file
             file_path = str(Path.cwd() / "src" / "routers" / "utils" / prompt_file)
             self.prompts = self.load_prompts_from_yaml(file_path)
+            self.chat_prompts = {
+                name: self.compile_prompt(template)
+                for name, template in self.prompts.items()
+            }
             self._initialized = True
 
     def load_prompts_from_yaml(self, file_path: str) -> dict:
@@ -85,3 +102,65 @@ class PromptManager:
             raise ValueError(
                 f"The prompt '{template_name}' does not exist. Available templates are: {available}"
             )
+
+    def split_prompt(self, template: str) -> tuple:
+        """
+        Split a prompt template into its static sections and its dynamic sections, each keeping their original order.
+
+        Args:
+            template (str): The prompt template.
+
+        Returns:
+            tuple: (static part, dynamic part) of the template.
+        """
+        starts = [m.start() for m in SECTION_HEAD.finditer(template)]
+        if not starts or starts[0] != 0:
+            starts = [0] + starts
+        static_sections = []
+        dynamic_sections = []
+        for start, end in zip(starts, starts[1:] + [len(template)]):
+            section = template[start:end].strip("\n")
+            if not section:
+                continue
+            variables = {
+                field for _, field, _, _ in Formatter().parse(section) if field
+            }
+            if variables <= STATIC_VARIABLES:
+                static_sections.append(section)
+            else:
+                dynamic_sections.append(section)
+        return "\n\n".join(static_sections), "\n\n".join(dynamic_sections)
+
+    def compile_prompt(self, template: str) -> ChatPromptTemplate:
+        """
+        Compile a prompt template into a chat prompt (static system message + dynamic human message).
+
+        Args:
+            template (str): The prompt template.
+
+        Returns:
+            ChatPromptTemplate: The compiled prompt.
+        """
+        static_part, dynamic_part = self.split_prompt(template)
+        messages = []
+        if static_part:
+            messages.append(("system", static_part))
+        messages.append(("human", dynamic_part))
+        return ChatPromptTemplate.from_messages(messages)
+
+    def get_chat_prompt(self, template_name: str) -> ChatPromptTemplate:
+        """
+        Return the compiled chat prompt corresponding to the specified template name.
+
+        Args:
+            template_name (str): The name of the prompt to retrieve (e.g., "create_plan").
+
+        Returns:
+            ChatPromptTemplate: The compiled prompt.
+
+        Raises:
+            ValueError: If the specified template name does not exist.
+        """
+        # Same error as get_prompt for unknown names
+        self.get_prompt(template_name)
+        return self.chat_prompts[template_name]
@@ -0,0 +1,303 @@
+"""Registry of the streamed runs of /api/ask_agent, for reconnection with Last-Event-ID"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from .metrics import Metrics
+
+load_dotenv()
+
+metrics = Metrics()
+
+# Number of latest events of a run kept for replay when the client reconnects
+RUN_BUFFER_SIZE = int(os.environ.get("RUN_BUFFER_SIZE", 2000))
+# Time a run keeps running without a connected client, waiting for a reconnection (seconds, 0: cancelled at once)
+RUN_DETACH_GRACE = float(os.environ.get("RUN_DETACH_GRACE", 30))
+# Time the events of a finished run are kept for a reconnection (seconds)
+RUN_RETENTION = float(os.environ.get("RUN_RETENTION", 300))
+
+
+class RunStream:
+    """
+    RunStream
+    One run of the graph: its events (the latest RUN_BUFFER_SIZE in a ring buffer) and the task producing them
+    """
+
+    def __init__(
+        self, chat_id: str, user_request: str, buffer_size: int, keep_alive: bool
+    ):
+        """
+        Constructor of RunStream class
+
+        Args:
+          chat_id (str): Chat ID of the run.
+          user_request (str): Request of the user.
+          buffer_size (int): Number of latest events kept.
+          keep_alive (bool): True to keep the run running without a connected client (e.g. background jobs).
+        """
+        self.run_id = uuid4().hex
+        self.chat_id = chat_id
+        self.user_request = user_request
+        # (event id, frame), the id of a frame is the id of its last event
+        self.frames = deque(maxlen=buffer_size)
+        self.keep_alive = keep_alive
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.finished_at = None
+        self.task = None
+        self.subscribers = 0
+        self._expire_handle = None
+        self._changed = asyncio.Event()
+
+    def append(self, event_id: int, frame: str):
+        """
+        Add a frame and wake up the clients
+
+        Args:
+          event_id (int): Id of the last event of the frame.
+          frame (str): Frame to send.
+        """
+        self.frames.append((event_id, frame))
+        self._notify()
+
+    def close(self):
+        """
+        Mark the end of the run
+        """
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class RunRegistry:
+    """
+    RunRegistry
+    Runs the graph of a request independently of the HTTP response, so that a client can reconnect to it
+
+    The runs of a chat are serialized: a run starts once the previous run of the chat has finished,
+    so that two runs never update the checkpoint of the same thread at once.
+    The events of a run are buffered. A client reconnecting with the id of the last event it received (Last-Event-ID)
+    gets the missed events and then the live events, instead of starting a new run.
+    When no client is connected, the run is cancelled after RUN_DETACH_GRACE seconds.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = RUN_BUFFER_SIZE,
+        detach_grace: float = RUN_DETACH_GRACE,
+        retention: float = RUN_RETENTION,
+    ):
+        """
+        Constructor of RunRegistry class
+
+        Args:
+          buffer_size (int): Number of latest events kept per run.
+          detach_grace (float): Time a run keeps running without a client (seconds).
+          retention (float): Time a finished run is kept (seconds).
+        """
+        self.buffer_size = buffer_size
+        self.detach_grace = detach_grace
+        self.retention = retention
+        self.runs = {}
+        self.active = 0
+        # chat_id: [lock, number of users]
+        self._chat_locks = {}
+
+    def start(
+        self,
+        chat_id: str,
+        user_request: str,
+        frames,
+        get_event_id,
+        keep_alive: bool = False,
+    ) -> RunStream:
+        """
+        Start a run, after the live run of the same chat if any
+
+        Args:
+          chat_id (str): Chat ID of the run.
+          user_request (str): Request of the user.
+          frames: Asynchronous generator of the frames of the run.
+          get_event_id: Function returning the id of the last event encoded.
+          keep_alive (bool): True to keep the run running without a connected client.
+
+        Returns:
+          RunStream: The run
+        """
+        self._remove_expired()
+        previous = None
+        for other in self.runs.values():
+            if not other.done and other.chat_id == chat_id:
+                # Each run waits for the one before it, so the latest is enough
+                previous = other
+        run = RunStream(chat_id, user_request, self.buffer_size, keep_alive)
+        run.task = asyncio.create_task(
+            self._produce(run, frames, get_event_id, previous)
+        )
+        self.runs[run.run_id] = run
+        self.active += 1
+        metrics.set("active_runs", self.active)
+        return run
+
+    def get(self, run_id: str):
+        """
+        Get a run by its id
+
+        Args:
+          run_id (str): Run ID.
+
+        Returns:
+          RunStream or None: The run, None if unknown or expired
+        """
+        self._remove_expired()
+        return self.runs.get(run_id)
+
+    def find_live(self, chat_id: str, user_request: str):
+        """
+        Get the live run of the same request in the chat (e.g. the request was sent again after the connection dropped)
+
+        Args:
+          chat_id (str): Chat ID.
+          user_request (str): Request of the user.
+
+        Returns:
+          RunStream or None: The run, None if there is none
+        """
+        for run in self.runs.values():
+            if (
+                not run.done
+                and run.chat_id == chat_id
+                and run.user_request == user_request
+            ):
+                return run
+        return None
+
+    @asynccontextmanager
+    async def lock_chat(self, chat_id: str):
+        """
+        Lock a chat while its live run is looked up and a new run is started,
+        so that identical requests sent at the same time share one run
+
+        Args:
+          chat_id (str): Chat ID.
+        """
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def subscribe(
+        self,
+        run: RunStream,
+        last_event_id: int = 0,
+        is_disconnected=None,
+        poll_interval: float = 1.0,
+    ):
+        """
+        Stream the frames of a run after the given event, then the live frames until the end of the run
+
+        Args:
+          run (RunStream): The run.
+          last_event_id (int): Id of the last event the client received. 0: from the start.
+          is_disconnected: Coroutine function returning True when the client has disconnected.
+          poll_interval (float): Interval of the checks of the connection (seconds).
+
+        Yields:
+          str: Frames
+        """
+        self._attach(run)
+        if last_event_id and run.frames and run.frames[0][0] > last_event_id + 1:
+            # The missed events are no longer in the buffer (the final message still has the whole answer)
+            metrics.inc("run_replay_gaps_total")
+        checked_at = time.monotonic()
+        try:
+            while True:
+                changed = run._changed
+                for event_id, frame in list(run.frames):
+                    if event_id > last_event_id:
+                        last_event_id = event_id
+                        yield frame
+                if run.done:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if (
+                    is_disconnected is not None
+                    and time.monotonic() - checked_at >= poll_interval
+                ):
+                    checked_at = time.monotonic()
+                    if await is_disconnected():
+                        return
+        finally:
+            self._detach(run)
+
+    def _attach(self, run: RunStream):
+        if run._expire_handle is not None:
+            run._expire_handle.cancel()
+            run._expire_handle = None
+        run.subscribers += 1
+
+    def _detach(self, run: RunStream):
+        run.subscribers -= 1
+        if run.subscribers > 0 or run.done or run.keep_alive:
+            return
+        if self.detach_grace <= 0:
+            run.task.cancel()
+            return
+        run._expire_handle = asyncio.get_running_loop().call_later(
+            self.detach_grace, self._cancel_detached, run
+        )
+
+    def _cancel_detached(self, run: RunStream):
+        run._expire_handle = None
+        if run.subscribers == 0 and not run.done:
+            run.task.cancel()
+
+    async def _produce(self, run: RunStream, frames, get_event_id, previous):
+        try:
+            if previous is not None and not previous.task.done():
+                metrics.inc("chat_serialized_total")
+                # Waiting does not cancel the previous run when this run is cancelled
+                await asyncio.wait({previous.task})
+            async for frame in frames:
+                run.append(get_event_id(), frame)
+        except asyncio.CancelledError:
+            run.cancelled = True
+        except Exception as err:
+            run.error = err
+            logging.error(f"Error: [run {run.run_id}] {err}")
+        finally:
+            run.close()
+            self.active -= 1
+            metrics.set("active_runs", self.active)
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        for run_id in [
+            run_id
+            for run_id, run in self.runs.items()
+            if run.done and now - run.finished_at > self.retention
+        ]:
+            del self.runs[run_id]
+
+
+__all__ = ["RunRegistry", "RunStream"]
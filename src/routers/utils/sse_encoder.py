@@ -0,0 +1,133 @@
+"""Encoder of the events streamed by /api/ask_agent"""
+
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Framing of the streamed events (sse: Server-Sent Events with "id:" and "data:" fields, legacy: JSON followed by a blank line)
+SSE_FRAMING = os.environ.get("SSE_FRAMING", "legacy")
+# Longest time the tokens of the answer are held before they are sent (seconds)
+SSE_FLUSH_INTERVAL = float(os.environ.get("SSE_FLUSH_INTERVAL", 0.05))
+# Size of the held tokens from which they are sent at once (bytes)
+SSE_FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", 512))
+
+
+class SseEncoder:
+    """
+    SseEncoder
+    Encodes the events of a streamed answer, coalescing the tokens of the answer ("msg" events)
+
+    Tokens are held and sent as one "msg" event when SSE_FLUSH_BYTES is reached, when SSE_FLUSH_INTERVAL has passed
+    since the first held token, or before any other event. When no token follows, the stream waits at most get_flush_delay()
+    for the next event and then calls flush().
+    The client receives the same text in fewer and larger events.
+    """
+
+    def __init__(
+        self,
+        framing: str = SSE_FRAMING,
+        flush_interval: float = SSE_FLUSH_INTERVAL,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        clock=time.monotonic,
+    ):
+        """
+        Constructor of SseEncoder class
+
+        Args:
+          framing (str): sse or legacy.
+          flush_interval (float): Longest time the tokens are held (seconds). 0 sends every token.
+          flush_bytes (int): Size of the held tokens from which they are sent (bytes).
+          clock: Function returning the current time in seconds.
+        """
+        self.framing = framing.lower()
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.clock = clock
+        self.event_id = 0
+        self._tokens = []
+        self._size = 0
+        self._held_since = None
+
+    def encode(self, data: dict) -> str:
+        """
+        Encodes one event
+
+        Args:
+          data (dict): Event ({"type": ..., "content": ...}).
+
+        Returns:
+          str: Frame of the event
+        """
+        self.event_id += 1
+        payload = json.dumps(data)
+        if self.framing == "sse":
+            return f"id: {self.event_id}\ndata: {payload}\n\n"
+        return f"{payload}\n\n"
+
+    def add_token(self, token: str) -> str:
+        """
+        Adds a token of the answer
+
+        Args:
+          token (str): Token (or piece) of the answer.
+
+        Returns:
+          str: Frame to send, "" while the tokens are held
+        """
+        if not token:
+            return ""
+        if self._held_since is None:
+            self._held_since = self.clock()
+        self._tokens.append(token)
+        self._size += len(token.encode("utf-8"))
+        if (
+            self._size >= self.flush_bytes
+            or self.clock() - self._held_since >= self.flush_interval
+        ):
+            return self.flush()
+        return ""
+
+    def add_event(self, data: dict) -> str:
+        """
+        Adds an event other than a token of the answer. The held tokens are sent first to keep the order.
+
+        Args:
+          data (dict): Event ({"type": ..., "content": ...}).
+
+        Returns:
+          str: Frames to send
+        """
+        return self.flush() + self.encode(data)
+
+    def get_flush_delay(self):
+        """
+        Time until the held tokens have to be sent
+
+        Returns:
+          float or None: Seconds (0 if already due), None if no tokens are held
+        """
+        if self._held_since is None:
+            return None
+        return max(0.0, self.flush_interval - (self.clock() - self._held_since))
+
+    def flush(self) -> str:
+        """
+        Sends the held tokens
+
+        Returns:
+          str: Frame of the held tokens as one "msg" event, "" if none are held
+        """
+        if not self._tokens:
+            return ""
+        content = "".join(self._tokens)
+        self._tokens = []
+        self._size = 0
+        self._held_since = None
+        return self.encode({"type": "msg", "content": content})
+
+
+__all__ = ["SseEncoder"]
@@ -38,3 +38,21 @@ class ChatModel(BaseModel):
     user_request: str = Field(..., title="User request or question")
     answer: str = Field(..., title="Answer of LLM")
     chat_start_date: Union[datetime, str] = Field("", title="Chat start date and time")
+
+
+class JobRequest(ChatModel):
+    priority: int = Field(0, title="Priority of the job (higher runs first)")
+
+
+class JobStatus(BaseModel):
+    job_id: str = Field(..., title="Job id")
+    status: Literal["queued", "running", "done", "failed", "cancelled"] = Field(
+        ..., title="Status of the job"
+    )
+    queue_position: int = Field(0, title="Position in the queue (0: not waiting)")
+    progress: str = Field("", title="Latest progress message of the research")
+    result: str = Field("", title="Final answer (when done)")
+    usage: Union[dict, None] = Field(
+        None,
+        title="Tokens and cost of the run, of each node and of the chat (when done)",
+    )